@@ -0,0 +1,300 @@
+# ac_shared_memory.py
+import ctypes
+import mmap
+import os
+from ams2_memory_source import MemorySource
+
+# Assetto Corsa shared memory, as documented in the AC Python/C++ SDK (sim_info, shared memory v1.7).
+# Strings are wchar_t on Windows (UTF-16), stored here as uint16 arrays so the layout is the same on
+# every platform; read them with wide_string().
+WCHAR = ctypes.c_uint16
+
+AC_STATUS_OFF = 0
+AC_STATUS_REPLAY = 1
+AC_STATUS_LIVE = 2
+AC_STATUS_PAUSE = 3
+
+# Same numbering as SESSION_TYPE_MAP in data_collector_AC
+AC_SESSION_UNKNOWN = -1
+AC_SESSION_PRACTICE = 0
+AC_SESSION_QUALIFY = 1
+AC_SESSION_RACE = 2
+AC_SESSION_HOTLAP = 3
+AC_SESSION_TIME_ATTACK = 4
+AC_SESSION_DRIFT = 5
+AC_SESSION_DRAG = 6
+
+PHYSICS_TAG = "Local\\acpmf_physics"
+GRAPHICS_TAG = "Local\\acpmf_graphics"
+STATIC_TAG = "Local\\acpmf_static"
+
+
+class SPageFilePhysics(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [
+        ('packetId', ctypes.c_int),
+        ('gas', ctypes.c_float),
+        ('brake', ctypes.c_float),
+        ('fuel', ctypes.c_float),
+        ('gear', ctypes.c_int),
+        ('rpms', ctypes.c_int),
+        ('steerAngle', ctypes.c_float),
+        ('speedKmh', ctypes.c_float),
+        ('velocity', ctypes.c_float * 3),
+        ('accG', ctypes.c_float * 3),
+        ('wheelSlip', ctypes.c_float * 4),
+        ('wheelLoad', ctypes.c_float * 4),
+        ('wheelsPressure', ctypes.c_float * 4),
+        ('wheelAngularSpeed', ctypes.c_float * 4),
+        ('tyreWear', ctypes.c_float * 4),
+        ('tyreDirtyLevel', ctypes.c_float * 4),
+        ('tyreCoreTemperature', ctypes.c_float * 4),
+        ('camberRAD', ctypes.c_float * 4),
+        ('suspensionTravel', ctypes.c_float * 4),
+        ('drs', ctypes.c_float),
+        ('tc', ctypes.c_float),
+        ('heading', ctypes.c_float),
+        ('pitch', ctypes.c_float),
+        ('roll', ctypes.c_float),
+        ('cgHeight', ctypes.c_float),
+        ('carDamage', ctypes.c_float * 5),
+        ('numberOfTyresOut', ctypes.c_int),
+        ('pitLimiterOn', ctypes.c_int),
+        ('abs', ctypes.c_float),
+        ('kersCharge', ctypes.c_float),
+        ('kersInput', ctypes.c_float),
+        ('autoShifterOn', ctypes.c_int),
+        ('rideHeight', ctypes.c_float * 2),
+        ('turboBoost', ctypes.c_float),
+        ('ballast', ctypes.c_float),
+        ('airDensity', ctypes.c_float),
+        ('airTemp', ctypes.c_float),
+        ('roadTemp', ctypes.c_float),
+        ('localAngularVel', ctypes.c_float * 3),
+        ('finalFF', ctypes.c_float),
+        ('performanceMeter', ctypes.c_float),
+        ('engineBrake', ctypes.c_int),
+        ('ersRecoveryLevel', ctypes.c_int),
+        ('ersPowerLevel', ctypes.c_int),
+        ('ersHeatCharging', ctypes.c_int),
+        ('ersIsCharging', ctypes.c_int),
+        ('kersCurrentKJ', ctypes.c_float),
+        ('drsAvailable', ctypes.c_int),
+        ('drsEnabled', ctypes.c_int),
+        ('brakeTemp', ctypes.c_float * 4),
+        ('clutch', ctypes.c_float),
+        ('tyreTempI', ctypes.c_float * 4),
+        ('tyreTempM', ctypes.c_float * 4),
+        ('tyreTempO', ctypes.c_float * 4),
+        ('isAIControlled', ctypes.c_int),
+        ('tyreContactPoint', (ctypes.c_float * 3) * 4),
+        ('tyreContactNormal', (ctypes.c_float * 3) * 4),
+        ('tyreContactHeading', (ctypes.c_float * 3) * 4),
+        ('brakeBias', ctypes.c_float),
+        ('localVelocity', ctypes.c_float * 3),
+    ]
+
+
+class SPageFileGraphic(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [
+        ('packetId', ctypes.c_int),
+        ('status', ctypes.c_int), # AC_STATUS_*
+        ('session', ctypes.c_int), # AC_SESSION_*
+        ('currentTime', WCHAR * 15),
+        ('lastTime', WCHAR * 15),
+        ('bestTime', WCHAR * 15),
+        ('split', WCHAR * 15),
+        ('completedLaps', ctypes.c_int),
+        ('position', ctypes.c_int),
+        ('iCurrentTime', ctypes.c_int),
+        ('iLastTime', ctypes.c_int),
+        ('iBestTime', ctypes.c_int),
+        ('sessionTimeLeft', ctypes.c_float),
+        ('distanceTraveled', ctypes.c_float),
+        ('isInPit', ctypes.c_int),
+        ('currentSectorIndex', ctypes.c_int),
+        ('lastSectorTime', ctypes.c_int),
+        ('numberOfLaps', ctypes.c_int),
+        ('tyreCompound', WCHAR * 33),
+        ('replayTimeMultiplier', ctypes.c_float),
+        ('normalizedCarPosition', ctypes.c_float),
+        ('carCoordinates', ctypes.c_float * 3),
+        ('penaltyTime', ctypes.c_float),
+        ('flag', ctypes.c_int),
+        ('idealLineOn', ctypes.c_int),
+        ('isInPitLane', ctypes.c_int),
+        ('surfaceGrip', ctypes.c_float),
+        ('mandatoryPitDone', ctypes.c_int),
+        ('windSpeed', ctypes.c_float),
+        ('windDirection', ctypes.c_float),
+    ]
+
+
+class SPageFileStatic(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [
+        ('smVersion', WCHAR * 15),
+        ('acVersion', WCHAR * 15),
+        ('numberOfSessions', ctypes.c_int),
+        ('numCars', ctypes.c_int),
+        ('carModel', WCHAR * 33),
+        ('track', WCHAR * 33),
+        ('playerName', WCHAR * 33),
+        ('playerSurname', WCHAR * 33),
+        ('playerNick', WCHAR * 33),
+        ('sectorCount', ctypes.c_int),
+        ('maxTorque', ctypes.c_float),
+        ('maxPower', ctypes.c_float),
+        ('maxRpm', ctypes.c_int),
+        ('maxFuel', ctypes.c_float),
+        ('suspensionMaxTravel', ctypes.c_float * 4),
+        ('tyreRadius', ctypes.c_float * 4),
+        ('maxTurboBoost', ctypes.c_float),
+        ('deprecated_1', ctypes.c_float),
+        ('deprecated_2', ctypes.c_float),
+        ('penaltiesEnabled', ctypes.c_int),
+        ('aidFuelRate', ctypes.c_float),
+        ('aidTireRate', ctypes.c_float),
+        ('aidMechanicalDamage', ctypes.c_float),
+        ('aidAllowTyreBlankets', ctypes.c_int),
+        ('aidStability', ctypes.c_float),
+        ('aidAutoClutch', ctypes.c_int),
+        ('aidAutoBlip', ctypes.c_int),
+        ('hasDRS', ctypes.c_int),
+        ('hasERS', ctypes.c_int),
+        ('hasKERS', ctypes.c_int),
+        ('kersMaxJ', ctypes.c_float),
+        ('engineBrakeSettingsCount', ctypes.c_int),
+        ('ersPowerControllerCount', ctypes.c_int),
+        ('trackSPlineLength', ctypes.c_float),
+        ('trackConfiguration', WCHAR * 33),
+        ('ersMaxJ', ctypes.c_float),
+        ('isTimedRace', ctypes.c_int),
+        ('hasExtraLap', ctypes.c_int),
+        ('carSkin', WCHAR * 33),
+        ('reversedGridPositions', ctypes.c_int),
+        ('pitWindowStart', ctypes.c_int),
+        ('pitWindowEnd', ctypes.c_int),
+    ]
+
+
+# page name -> (Structure, Windows tag, file name when the pages are file-backed)
+AC_PAGES = {
+    'physics': (SPageFilePhysics, PHYSICS_TAG, "physics.bin"),
+    'graphics': (SPageFileGraphic, GRAPHICS_TAG, "graphics.bin"),
+    'static': (SPageFileStatic, STATIC_TAG, "static.bin"),
+}
+
+
+def wide_string(field):
+    """Decodes a WCHAR array field to str, stopping at the first null."""
+    return bytes(field).decode('utf-16le', errors='ignore').split('\x00', 1)[0]
+
+
+class ACPages:
+    """One read of the three AC pages. physics/graphics/static are live views onto the maps, not copies."""
+
+    def __init__(self, physics, graphics, static, physics_changed, graphics_changed, static_changed):
+        self.physics = physics
+        self.graphics = graphics
+        self.static = static
+        self.physics_changed = physics_changed
+        self.graphics_changed = graphics_changed
+        self.static_changed = static_changed
+
+
+class ACSharedMemorySource(MemorySource):
+    """
+    Reads AC's physics, graphics and static pages through ctypes structures laid directly over the
+    mappings (from_buffer, no copying). read() returns an ACPages only when something moved on:
+    the physics and graphics pages carry a packetId the game bumps on every write, and the static
+    page's version tags (smVersion/acVersion) plus track/car are re-checked when the session changes.
+
+    directory=None maps the live Windows pages; a directory maps physics.bin / graphics.bin /
+    static.bin files instead, for running without the game.
+    """
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = directory
+        self.description = f"AC shared memory files in {directory}" if directory else "AC shared memory"
+        self.maps = {}
+        self.files = {}
+        self.pages = {}
+        self.version = None # (smVersion, acVersion) once the static page is filled in
+        self._last_packet_ids = (None, None)
+        self._last_session = None
+        self._static_key = None
+
+    def open(self):
+        for name, (structure, tag, file_name) in AC_PAGES.items():
+            size = ctypes.sizeof(structure)
+            if self.directory:
+                path = os.path.join(self.directory, file_name)
+                if not os.path.exists(path) or os.path.getsize(path) < size:
+                    raise FileNotFoundError(f"AC page file '{path}' is missing or smaller than {size} bytes")
+                self.files[name] = open(path, 'r+b')
+                self.maps[name] = mmap.mmap(self.files[name].fileno(), size)
+            else:
+                # tagname is only supported on Windows, this raises everywhere else
+                self.maps[name] = mmap.mmap(-1, size, tag)
+            self.pages[name] = structure.from_buffer(self.maps[name])
+
+    def _static_changed(self, graphics):
+        """Re-reads the static page's identity only when the session/status changes, not every poll."""
+        session = (graphics.session, graphics.status)
+        if session == self._last_session and self._static_key is not None:
+            return False
+        self._last_session = session
+        static = self.pages['static']
+        key = (wide_string(static.smVersion), wide_string(static.acVersion), wide_string(static.track),
+               wide_string(static.trackConfiguration), wide_string(static.carModel), static.numCars)
+        if key == self._static_key:
+            return False
+        self._static_key = key
+        self.version = key[:2] if key[0] else None
+        return True
+
+    def read(self):
+        if not self.pages:
+            return None
+        physics, graphics = self.pages['physics'], self.pages['graphics']
+        packet_ids = (physics.packetId, graphics.packetId)
+        static_changed = self._static_changed(graphics)
+        if packet_ids == self._last_packet_ids and not static_changed:
+            return None # Nothing new since the last poll
+        physics_changed = packet_ids[0] != self._last_packet_ids[0]
+        graphics_changed = packet_ids[1] != self._last_packet_ids[1]
+        self._last_packet_ids = packet_ids
+        return ACPages(physics, graphics, self.pages['static'], physics_changed, graphics_changed, static_changed)
+
+    def close(self):
+        self.pages = {} # Drop the views first, a map can't close while structures still point into it
+        for handle in self.maps.values():
+            try:
+                handle.close()
+            except BufferError:
+                pass # A reader still holds a view; the map is released with it
+        for file in self.files.values():
+            file.close()
+        self.maps = {}
+        self.files = {}
+
+
+def create_ac_memory_source(spec=None):
+    """None / "" / "shared" -> live AC pages, "file:<dir>" or "<dir>" -> page files in that directory."""
+    if not spec or spec == "shared":
+        return ACSharedMemorySource()
+    if spec.startswith("file:"):
+        spec = spec[len("file:"):]
+    return ACSharedMemorySource(spec)
+
+
+def write_page_files(directory, physics=None, graphics=None, static=None):
+    """Writes page files for ACSharedMemorySource(directory); any page left as None is written zeroed."""
+    os.makedirs(directory, exist_ok=True)
+    for name, data in (('physics', physics), ('graphics', graphics), ('static', static)):
+        structure, _tag, file_name = AC_PAGES[name]
+        with open(os.path.join(directory, file_name), 'wb') as f:
+            f.write(bytes(data) if data is not None else bytes(ctypes.sizeof(structure)))
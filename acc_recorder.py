@@ -0,0 +1,204 @@
+# acc_recorder.py
+import gzip
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+from accapi.client import Event, Observable
+
+# The broadcasting updates the ACC collector subscribes to, and the fields of each that it reads
+UPDATE_FIELDS = {
+    'onTrackDataUpdate': ('trackName', 'trackMeters'),
+    'onEntryListCarUpdate': ('carIndex', 'drivers'),
+    'onRealtimeUpdate': ('sessionType', 'sessionPhase', 'sessionTimeMs'),
+    'onRealtimeCarUpdate': ('carIndex', 'kmh', 'position', 'laps', 'splinePosition', 'location'),
+    'onBroadcastingEvent': ('type', 'message', 'timeMs', 'carIndex'),
+}
+DRIVER_FIELDS = ('firstName', 'lastName', 'nationality')
+
+
+def _open(path, mode):
+    """Text file, gzipped if the path ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _get(content, name):
+    return content.get(name) if isinstance(content, dict) else getattr(content, name, None)
+
+
+def _fields(update, content):
+    fields = {}
+    for name in UPDATE_FIELDS[update]:
+        value = _get(content, name)
+        if name == 'drivers':
+            value = [{key: _get(driver, key) for key in DRIVER_FIELDS} for driver in value or []]
+        fields[name] = value
+    return fields
+
+
+class AccRecorder:
+    """
+    Writes the broadcasting updates an AccClient delivers to a JSON lines file (gzipped if the
+    path ends in .gz), one {"t", "update", "content"} object per update, where t is seconds since
+    the recording started and content holds only the fields the collector reads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.started = None
+        self.count = 0
+        self.lock = threading.Lock() # Updates arrive on the client's reader thread
+
+    def attach(self, client):
+        """Subscribes to every update the collector uses. Returns self."""
+        for update in UPDATE_FIELDS:
+            getattr(client, update).subscribe(lambda event, update=update: self.record(update, event.content))
+        return self
+
+    def record(self, update, content, timestamp=None):
+        with self.lock:
+            if self.file is None:
+                self.file = _open(self.path, 'w')
+                self.started = time.perf_counter()
+            if timestamp is None:
+                timestamp = time.perf_counter() - self.started
+            self.file.write(json.dumps({'t': round(timestamp, 3), 'update': update, 'content': _fields(update, content)}) + "\n")
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class AccReplayClient:
+    """
+    Stands in for AccClient: start() plays a recording to the same subscribers from a thread of
+    its own, at the recorded pace times speed (speed=None runs as fast as possible). play() does
+    the same in the calling thread.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        for update in UPDATE_FIELDS:
+            setattr(self, update, Observable())
+        self.thread = None
+        self.stopped = False
+
+    @property
+    def isAlive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, **_connection): # Same keyword arguments as AccClient.start(), all ignored
+        self.stopped = False
+        self.thread = threading.Thread(target=self.play, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def play(self):
+        started = time.perf_counter()
+        with _open(self.path, 'r') as f:
+            for line in f:
+                if self.stopped:
+                    break
+                record = json.loads(line)
+                if self.speed:
+                    delay = record['t'] / self.speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                content = SimpleNamespace(**record['content'])
+                if record['update'] == 'onEntryListCarUpdate':
+                    content.drivers = [SimpleNamespace(**driver) for driver in content.drivers]
+                event = Event(self, content=content)
+                for callback in getattr(self, record['update']).callbacks:
+                    callback(event)
+
+
+def record_session(updates, path):
+    """Records an iterable of (timestamp, update, content) (e.g. synthetic_session()) and returns the update count."""
+    with AccRecorder(path) as recorder:
+        for timestamp, update, content in updates:
+            recorder.record(update, content, timestamp)
+    return recorder.count
+
+
+def synthetic_session(num_cars=10, seconds=450.0, track_meters=4000.0, update_interval=0.5, seed=2):
+    """
+    Generates a fake ACC race as (timestamp, update, content) tuples, in the order the broadcasting
+    API sends them, for running the collector without the game. Cars lap at slightly different
+    paces; the last car makes a pit stop, the cars running P4 and P5 crash together and the
+    session ends with a lap and a half to go, so the race finishes on track.
+    """
+    rng = random.Random(seed)
+    yield 0.0, 'onTrackDataUpdate', {'trackName': "Synthetic Ring", 'trackMeters': track_meters}
+    for i in range(num_cars):
+        yield 0.0, 'onEntryListCarUpdate', {'carIndex': i, 'drivers': [
+            {'firstName': "Driver", 'lastName': str(i + 1), 'nationality': "Any"}]}
+
+    base_speeds = [rng.uniform(45.0, 55.0) for _ in range(num_cars)] # m/s
+    distances = [-(i * 12.0) for i in range(num_cars)] # Grid spacing behind the line
+    start_time = 5.0
+    over_time = seconds - 1.5 * track_meters / 50.0
+    pit_times = (start_time + seconds * 0.3, start_time + seconds * 0.3 + 20.0)
+    crash_time = start_time + seconds * 0.5
+    stopped = {} # car -> time it drives off again
+
+    steps = int(seconds / update_interval)
+    for step in range(steps):
+        now = step * update_interval
+        phase = "Pre Session" if now < start_time else ("Session" if now < over_time else "Session Over")
+        speeds = [0.0] * num_cars
+        locations = ["Track"] * num_cars
+        if now >= start_time:
+            if not stopped and now >= crash_time:
+                order = sorted(range(num_cars), key=lambda i: -distances[i])
+                first, second = order[3], order[4]
+                distances[second] = distances[first] - 15.0 # Ran into the back of it
+                stopped[first] = stopped[second] = now + 8.0
+            for i in range(num_cars):
+                if stopped.get(i, 0) > now:
+                    continue
+                if i == num_cars - 1 and pit_times[0] <= now < pit_times[1]:
+                    locations[i] = "Pitlane"
+                    speeds[i] = 16.0
+                else:
+                    speeds[i] = base_speeds[i]
+                    distances[i] += rng.uniform(-3.0, 3.0) * update_interval
+                distances[i] += speeds[i] * update_interval
+
+        yield now, 'onRealtimeUpdate', {'sessionType': "Race", 'sessionPhase': phase, 'sessionTimeMs': int(now * 1000)}
+        order = sorted(range(num_cars), key=lambda i: -distances[i])
+        for position, i in enumerate(order, start=1):
+            yield now, 'onRealtimeCarUpdate', {
+                'carIndex': i, 'kmh': round(speeds[i] * 3.6, 1), 'position': position,
+                'laps': int(max(0.0, distances[i]) // track_meters),
+                'splinePosition': round((distances[i] % track_meters) / track_meters, 5), 'location': locations[i]}
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Synthetic recording: python acc_recorder.py <out.jsonl[.gz]> [cars] [seconds]
+    if len(sys.argv) < 2:
+        print("usage: python acc_recorder.py <out.jsonl[.gz]> [cars] [seconds]")
+        sys.exit(2)
+    cars = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 450.0
+    total = record_session(synthetic_session(num_cars=cars, seconds=duration), sys.argv[1])
+    print(f"Recorded {total} updates to {sys.argv[1]}")
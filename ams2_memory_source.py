@@ -0,0 +1,233 @@
+# ams2_memory_source.py
+import ctypes
+import mmap
+import os
+import random
+from shared_memory_struct import SharedMemory
+
+# Size of one raw AMS2 shared memory page
+SHARED_MEMORY_SIZE = ctypes.sizeof(SharedMemory)
+
+
+class MemorySource:
+    """Base class for anything the AMS2 collector can read SharedMemory pages from."""
+    description = "memory source"
+    paced = False # True if read() does its own pacing, so the collector shouldn't sleep between reads
+
+    def __init__(self):
+        self.exhausted = False # True once a finite source has no more pages to give
+
+    def open(self):
+        pass
+
+    def read(self):
+        """Returns a buffer holding one full SharedMemory page, or None if nothing is available."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NamedMemorySource(MemorySource):
+    """The live Windows named mapping ("$pcars2$") written by the game."""
+
+    def __init__(self, tag_name="$pcars2$", size=SHARED_MEMORY_SIZE):
+        super().__init__()
+        self.tag_name = tag_name
+        self.size = size
+        self.description = f"named mapping {tag_name}"
+        self.handle = None
+
+    def open(self):
+        # tagname is only supported on Windows, this raises everywhere else
+        self.handle = mmap.mmap(-1, self.size, self.tag_name, access=mmap.ACCESS_READ)
+
+    def read(self):
+        return self.handle
+
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+
+class FileMemorySource(MemorySource):
+    """A file-backed mmap, updated in place by FileMemoryWriter (or anything else writing raw pages)."""
+
+    def __init__(self, path, size=SHARED_MEMORY_SIZE):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.description = f"file mapping {path}"
+        self.file = None
+        self.handle = None
+
+    def open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.size:
+            raise FileNotFoundError(f"Memory file '{self.path}' is missing or smaller than {self.size} bytes")
+        self.file = open(self.path, 'rb')
+        self.handle = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+
+    def read(self):
+        return self.handle
+
+    def close(self):
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class SnapshotStreamSource(MemorySource):
+    """Feeds pages from an iterable of raw snapshots (bytes or SharedMemory), one per read()."""
+
+    def __init__(self, snapshots, description="snapshot stream"):
+        super().__init__()
+        self.snapshots = snapshots
+        self.description = description
+        self._iterator = None
+
+    def open(self):
+        self._iterator = iter(self.snapshots)
+        self.exhausted = False
+
+    def read(self):
+        if self._iterator is None or self.exhausted:
+            return None
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self.exhausted = True
+            return None
+
+    def close(self):
+        close = getattr(self.snapshots, 'close', None)
+        if close:
+            close()
+        self._iterator = None
+
+
+class FileMemoryWriter:
+    """Stand-in for the game: writes SharedMemory pages into a file that FileMemorySource maps."""
+
+    def __init__(self, path, size=SHARED_MEMORY_SIZE):
+        self.path = path
+        self.size = size
+        self.file = None
+        self.handle = None
+
+    def open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a+b')
+        self.file.truncate(self.size)
+        self.handle = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_WRITE)
+        return self
+
+    def write(self, data):
+        """Writes a SharedMemory instance (or raw page bytes) over the mapped page."""
+        raw = bytes(data) if isinstance(data, ctypes.Structure) else data
+        self.handle[0:len(raw)] = raw
+
+    def close(self):
+        if self.handle:
+            self.handle.flush()
+            self.handle.close()
+            self.handle = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def create_memory_source(spec=None):
+    """
+    Builds a source from a short spec string:
+    None / "" -> live named mapping, "file:<path>" -> FileMemorySource,
+    "replay:<path>" -> real-time replay of a recording, "replay-fast:<path>" -> replay as fast as possible,
+    "<path>" -> FileMemorySource.
+    """
+    if not spec:
+        return NamedMemorySource()
+    if spec.startswith(("replay:", "replay-fast:")):
+        from ams2_recorder import ReplayMemorySource # Recorder imports this module
+        mode, path = spec.split(":", 1)
+        return ReplayMemorySource(path, speed=None if mode == "replay-fast" else 1.0)
+    if spec.startswith("file:"):
+        return FileMemorySource(spec[len("file:"):])
+    return FileMemorySource(spec)
+
+
+def synthetic_session(num_cars=20, frames=600, track_length=4000.0, frame_time=0.2, seed=1, incidents=False):
+    """
+    Generates a fake AMS2 race, one SharedMemory page per frame, for running the collector
+    without the game. Cars lap at slightly different paces so positions change over time.
+    With incidents, the last car makes a pit stop, the cars running P4 and P5 crash together
+    and the timer runs out with a lap and a half to go, so the race finishes on track.
+    """
+    rng = random.Random(seed)
+    num_cars = min(num_cars, len(SharedMemory().mParticipantInfo))
+    base_speeds = [rng.uniform(45.0, 55.0) for _ in range(num_cars)] # m/s
+    distances = [-(i * 12.0) for i in range(num_cars)] # Grid spacing behind the line
+    speeds = [0.0] * num_cars
+    pit_modes = [0] * num_cars
+    stopped = {} # car -> frame it drives off again
+    timer_frames = frames - int(1.5 * track_length / 50.0 / frame_time) if incidents else frames
+    pit_frames = range(int(frames * 0.3), int(frames * 0.3) + int(20 / frame_time))
+    crash_frame = int(frames * 0.5)
+
+    for frame in range(frames):
+        data = SharedMemory()
+        data.mVersion = 14
+        data.mGameState = 2 # GAME_INGAME_PLAYING
+        data.mSessionState = 5 # SESSION_RACE
+        data.mRaceState = 1 if frame < 5 else 2 # NOT_STARTED then RACING
+        if incidents and frame >= frames - 5:
+            data.mRaceState = 3 # FINISHED
+        data.mNumParticipants = num_cars
+        data.mTrackLength = track_length
+        data.mTrackLocation = b"Synthetic Ring"
+        data.mEventTimeRemaining = max(0.0, (timer_frames - frame) * frame_time)
+        data.mSequenceNumber = frame * 2
+
+        if incidents and frame == crash_frame:
+            order = sorted(range(num_cars), key=lambda i: -distances[i])
+            first, second = order[3], order[4]
+            distances[second] = distances[first] - 15.0 # Ran into the back of it
+            stopped[first] = stopped[second] = frame + int(8 / frame_time)
+
+        if data.mRaceState == 2:
+            for i in range(num_cars):
+                pit_modes[i] = 2 if incidents and i == num_cars - 1 and frame in pit_frames else 0 # PIT_MODE_IN_PIT
+                if stopped.get(i, 0) > frame:
+                    speeds[i] = 0.0
+                elif pit_modes[i]:
+                    speeds[i] = 15.0
+                else:
+                    speeds[i] = base_speeds[i]
+                    distances[i] += rng.uniform(-3.0, 3.0) * frame_time
+                distances[i] += speeds[i] * frame_time
+
+        order = sorted(range(num_cars), key=lambda i: -distances[i])
+        for position, i in enumerate(order, start=1):
+            participant = data.mParticipantInfo[i]
+            participant.mIsActive = True
+            participant.mName = f"Driver {i + 1}".encode('utf-8')
+            participant.mRacePosition = position
+            total = max(0.0, distances[i])
+            participant.mCurrentLap = int(total // track_length) + 1
+            participant.mLapsCompleted = participant.mCurrentLap - 1
+            participant.mCurrentLapDistance = total % track_length
+            speed_index = i + 8 # DataCollector.speed_offset
+            if speed_index < len(data.mSpeeds):
+                data.mSpeeds[speed_index] = speeds[i]
+            if i < len(data.mPitModes):
+                data.mPitModes[i] = pit_modes[i]
+        yield data
@@ -0,0 +1,317 @@
+# ams2_recorder.py
+import bisect
+import lzma
+import os
+import struct
+import time
+import zlib
+from shared_memory_struct import SharedMemory
+from ams2_memory_source import MemorySource, SHARED_MEMORY_SIZE
+
+# --- File layout ---
+# Header : magic (8s) | format version (H) | codec (B) | page size (I) | keyframe interval (I)
+# Frame  : timestamp (d) | sequence number (I) | is_keyframe (B) | payload length (I) | payload
+#          keyframes hold the compressed page, other frames the compressed XOR delta
+#          against the previous page
+# Index  : count (I) then count * (frame number (I) | timestamp (d) | file offset (Q)), one per keyframe
+# Footer : index offset (Q) | total frames (I) | magic (8s)
+RECORDING_MAGIC = b"AMS2REC1"
+RECORDING_VERSION = 1
+HEADER_STRUCT = struct.Struct('<8sHBII')
+FRAME_STRUCT = struct.Struct('<dIBI')
+INDEX_ENTRY_STRUCT = struct.Struct('<IdQ')
+FOOTER_STRUCT = struct.Struct('<QI8s')
+
+CODEC_ZLIB = 0
+CODEC_LZMA = 1
+CODEC_NAMES = {"zlib": CODEC_ZLIB, "lzma": CODEC_LZMA}
+
+SEQUENCE_OFFSET = SharedMemory.mSequenceNumber.offset
+
+
+def _compress(codec, data):
+    if codec == CODEC_LZMA:
+        return lzma.compress(data, preset=6)
+    return zlib.compress(data, 6)
+
+
+def _decompress(codec, data):
+    if codec == CODEC_LZMA:
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def _xor(a, b):
+    """XOR two equal-length pages; unchanged bytes become zero and compress to almost nothing."""
+    size = len(a)
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(size, 'little')
+
+
+def sequence_number(page):
+    return struct.unpack_from('<I', page, SEQUENCE_OFFSET)[0]
+
+
+class SnapshotRecorder:
+    """Writes raw SharedMemory pages to a delta-compressed recording, one frame per new mSequenceNumber."""
+
+    def __init__(self, path, codec="zlib", keyframe_interval=300, page_size=SHARED_MEMORY_SIZE):
+        self.path = path
+        self.codec = CODEC_NAMES.get(codec, CODEC_ZLIB)
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.page_size = page_size
+        self.file = None
+        self.previous_page = None
+        self.previous_sequence = None
+        self.frame_count = 0
+        self.index = [] # (frame number, timestamp, offset) per keyframe
+        self.raw_bytes = 0
+        self.written_bytes = 0
+
+    def open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'wb')
+        self.file.write(HEADER_STRUCT.pack(RECORDING_MAGIC, RECORDING_VERSION, self.codec,
+                                           self.page_size, self.keyframe_interval))
+        return self
+
+    def record(self, page, timestamp=None):
+        """
+        Records a page if its sequence number moved on. Odd sequence numbers mean the game is
+        mid-write, so those pages are skipped. Returns True if a frame was written.
+        """
+        if self.file is None:
+            return False
+        page = bytes(page[:self.page_size])
+        if len(page) < self.page_size:
+            return False
+
+        sequence = sequence_number(page)
+        if sequence & 1 or sequence == self.previous_sequence:
+            return False
+
+        timestamp = time.time() if timestamp is None else timestamp
+        is_keyframe = self.previous_page is None or self.frame_count % self.keyframe_interval == 0
+        if is_keyframe:
+            payload = _compress(self.codec, page)
+            self.index.append((self.frame_count, timestamp, self.file.tell()))
+        else:
+            payload = _compress(self.codec, _xor(page, self.previous_page))
+
+        self.file.write(FRAME_STRUCT.pack(timestamp, sequence, 1 if is_keyframe else 0, len(payload)))
+        self.file.write(payload)
+
+        self.previous_page = page
+        self.previous_sequence = sequence
+        self.frame_count += 1
+        self.raw_bytes += self.page_size
+        self.written_bytes += FRAME_STRUCT.size + len(payload)
+        return True
+
+    def compression_ratio(self):
+        return self.raw_bytes / self.written_bytes if self.written_bytes else 0.0
+
+    def close(self):
+        if self.file is None:
+            return
+        index_offset = self.file.tell()
+        self.file.write(struct.pack('<I', len(self.index)))
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY_STRUCT.pack(*entry))
+        self.file.write(FOOTER_STRUCT.pack(index_offset, self.frame_count, RECORDING_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class SnapshotReplayer:
+    """Reads a recording back as (timestamp, page bytes) frames, with keyframe-indexed seeking."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        header = self.file.read(HEADER_STRUCT.size)
+        magic, version, self.codec, self.page_size, self.keyframe_interval = HEADER_STRUCT.unpack(header)
+        if magic != RECORDING_MAGIC:
+            raise ValueError(f"'{path}' is not an AMS2 recording")
+        if version != RECORDING_VERSION:
+            raise ValueError(f"Unsupported recording version {version} in '{path}'")
+        self.data_start = self.file.tell()
+        self.index = []
+        self.frame_count = None
+        self.data_end = None
+        self._load_index()
+
+    def _load_index(self):
+        """Reads the keyframe index from the footer; recordings cut short (no footer) are still playable."""
+        self.file.seek(0, os.SEEK_END)
+        file_size = self.file.tell()
+        if file_size < self.data_start + FOOTER_STRUCT.size:
+            return
+        self.file.seek(file_size - FOOTER_STRUCT.size)
+        index_offset, frame_count, magic = FOOTER_STRUCT.unpack(self.file.read(FOOTER_STRUCT.size))
+        if magic != RECORDING_MAGIC:
+            return
+        self.file.seek(index_offset)
+        count = struct.unpack('<I', self.file.read(4))[0]
+        raw_index = self.file.read(count * INDEX_ENTRY_STRUCT.size)
+        self.index = [INDEX_ENTRY_STRUCT.unpack_from(raw_index, i * INDEX_ENTRY_STRUCT.size) for i in range(count)]
+        self.frame_count = frame_count
+        self.data_end = index_offset
+
+    def frames(self, start_time=None):
+        """Yields (timestamp, page bytes) from the start, or from the first frame at/after start_time."""
+        offset = self.data_start
+        if start_time is not None and self.index:
+            # Jump to the last keyframe at or before start_time and roll forward from there
+            times = [entry[1] for entry in self.index]
+            position = max(0, bisect.bisect_right(times, start_time) - 1)
+            offset = self.index[position][2]
+
+        self.file.seek(offset)
+        page = None
+        while self.data_end is None or self.file.tell() < self.data_end:
+            header = self.file.read(FRAME_STRUCT.size)
+            if len(header) < FRAME_STRUCT.size:
+                break
+            timestamp, _sequence, is_keyframe, length = FRAME_STRUCT.unpack(header)
+            payload = self.file.read(length)
+            if len(payload) < length:
+                break # Truncated final frame
+            decoded = _decompress(self.codec, payload)
+            if is_keyframe:
+                page = decoded
+            elif page is None:
+                continue # Can't apply a delta without a base page
+            else:
+                page = _xor(page, decoded)
+            if start_time is not None and timestamp < start_time:
+                continue
+            yield timestamp, page
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class RecordingMemorySource(MemorySource):
+    """Wraps another source and records every new page it hands to the collector."""
+
+    def __init__(self, inner, recorder):
+        super().__init__()
+        self.inner = inner
+        self.recorder = recorder
+        self.description = f"{inner.description} (recording to {recorder.path})"
+
+    @property
+    def exhausted(self):
+        return self.inner.exhausted
+
+    @exhausted.setter
+    def exhausted(self, value):
+        pass # Mirrors the wrapped source
+
+    @property
+    def paced(self):
+        return self.inner.paced
+
+    def open(self):
+        self.inner.open()
+        self.recorder.open()
+
+    def read(self):
+        page = self.inner.read()
+        if page is not None:
+            self.recorder.record(page)
+        return page
+
+    def close(self):
+        self.inner.close()
+        self.recorder.close()
+
+
+class ReplayMemorySource(MemorySource):
+    """
+    Plays a recording into the collector. speed=1.0 keeps the original pacing, larger values
+    play faster, and speed=None runs as fast as possible. clock() returns the recorded time of
+    the current frame so the collector's timecodes match the original session either way.
+    """
+    paced = True # read() waits for each frame's due time itself (or not at all)
+
+    def __init__(self, path, speed=1.0, start_time=None):
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self.start_time = start_time
+        self.description = f"replay of {path}" + (" (as fast as possible)" if not speed else f" (x{speed:g})")
+        self.replayer = None
+        self._frames = None
+        self.current_timestamp = None
+        self._first_timestamp = None
+        self._wall_start = None
+
+    def open(self):
+        self.replayer = SnapshotReplayer(self.path)
+        self._frames = self.replayer.frames(self.start_time)
+        self.exhausted = False
+
+    def clock(self):
+        return self.current_timestamp if self.current_timestamp is not None else time.time()
+
+    def read(self):
+        if self._frames is None or self.exhausted:
+            return None
+        try:
+            timestamp, page = next(self._frames)
+        except StopIteration:
+            self.exhausted = True
+            return None
+
+        if self.speed:
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+                self._wall_start = time.perf_counter()
+            due = (timestamp - self._first_timestamp) / self.speed
+            wait = due - (time.perf_counter() - self._wall_start)
+            if wait > 0:
+                time.sleep(wait)
+        self.current_timestamp = timestamp
+        return page
+
+    def close(self):
+        if self.replayer:
+            self.replayer.close()
+            self.replayer = None
+        self._frames = None
+
+
+def record_session(frames, path, codec="zlib", keyframe_interval=300, frame_time=0.2):
+    """Records an iterable of SharedMemory pages (e.g. synthetic_session()) and returns the recorder stats."""
+    with SnapshotRecorder(path, codec=codec, keyframe_interval=keyframe_interval) as recorder:
+        timestamp = 0.0
+        for data in frames:
+            recorder.record(bytes(data), timestamp)
+            timestamp += frame_time
+    return recorder
+
+
+if __name__ == "__main__":
+    import sys
+    from ams2_memory_source import synthetic_session
+
+    # Quick size check: python ams2_recorder.py [cars] [frames] [zlib|lzma]
+    cars = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    frame_total = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    codec_name = sys.argv[3] if len(sys.argv) > 3 else "zlib"
+    out_path = os.path.join("Race Data", "synthetic_recording.ams2rec")
+    start = time.perf_counter()
+    stats = record_session(synthetic_session(num_cars=cars, frames=frame_total), out_path, codec=codec_name)
+    elapsed = time.perf_counter() - start
+    print(f"Recorded {stats.frame_count} frames in {elapsed:.2f}s -> {os.path.getsize(out_path) / 1024:.0f} KiB "
+          f"(raw {stats.raw_bytes / 1024:.0f} KiB, ratio {stats.compression_ratio():.1f}x)")
@@ -0,0 +1,98 @@
+# battle_tracker.py
+
+
+class BattleTracker:
+    """
+    Follows close fights between cars in consecutive positions, frame by frame.
+
+    update() takes every running car's position, distance and speed, works out the time gap to
+    the car directly ahead and returns battle events:
+        ("start", battle)     - gap under start_gap for confirm_time seconds
+        ("intensify", battle) - gap under intense_gap, at most once every intense_repeat seconds of battle
+        ("end", battle)       - gap over end_gap, or the pair split up, for grace_time seconds;
+                                only reported if the battle lasted min_report_duration seconds
+    where battle is a dict with leader, follower, position, gap, start_time and duration.
+
+    Each frame is a single pass over the field plus one over the live battles, so it can run on
+    every shared memory read rather than on a timer.
+    """
+
+    def __init__(self, start_gap=1.0, end_gap=1.5, intense_gap=0.5, confirm_time=2.0, grace_time=3.0,
+                 intense_repeat=30.0, min_report_duration=20.0, min_speed=10.0):
+        self.start_gap = start_gap
+        self.end_gap = end_gap
+        self.intense_gap = intense_gap
+        self.confirm_time = confirm_time
+        self.grace_time = grace_time
+        self.intense_repeat = intense_repeat
+        self.min_report_duration = min_report_duration
+        self.min_speed = min_speed # m/s floor so a car crawling out of a corner doesn't inflate the gap
+        self.reset()
+
+    def reset(self):
+        self.candidates = {} # pair -> time the gap first closed
+        self.battles = {} # pair -> battle dict
+
+    def update(self, cars, now):
+        """
+        cars: iterable of (car, position, total_distance, speed) for cars on track, where
+        total_distance = laps completed * track length + current lap distance (metres) and
+        speed is in m/s. now: session time in seconds.
+        """
+        by_position = {}
+        for car in cars:
+            by_position[car[1]] = car
+
+        events = []
+        seen = set()
+        for position, ahead in by_position.items():
+            behind = by_position.get(position + 1)
+            if behind is None:
+                continue
+            speed = max(behind[3], self.min_speed)
+            gap = (ahead[2] - behind[2]) / speed
+            if gap < 0:
+                continue # Distance and position disagree for a frame (line crossing, reset)
+
+            pair = (ahead[0], behind[0]) if ahead[0] < behind[0] else (behind[0], ahead[0])
+            battle = self.battles.get(pair)
+
+            if battle is None:
+                if gap >= self.start_gap:
+                    self.candidates.pop(pair, None)
+                    continue
+                seen.add(pair)
+                first_close = self.candidates.setdefault(pair, now)
+                if now - first_close >= self.confirm_time:
+                    del self.candidates[pair]
+                    battle = {'leader': ahead[0], 'follower': behind[0], 'position': position, 'gap': gap,
+                              'min_gap': gap, 'start_time': first_close, 'duration': now - first_close,
+                              'last_close': now, 'last_intense': now}
+                    self.battles[pair] = battle
+                    events.append(("start", battle))
+                continue
+
+            seen.add(pair)
+            battle['leader'], battle['follower'], battle['position'] = ahead[0], behind[0], position
+            battle['gap'] = gap
+            battle['duration'] = now - battle['start_time']
+            battle['min_gap'] = min(battle['min_gap'], gap)
+            if gap <= self.end_gap:
+                battle['last_close'] = now
+            if gap < self.intense_gap and now - battle['last_intense'] >= self.intense_repeat:
+                battle['last_intense'] = now
+                events.append(("intensify", battle))
+
+        # Candidates that opened up again before being confirmed are dropped
+        for pair in [pair for pair in self.candidates if pair not in seen]:
+            del self.candidates[pair]
+
+        for pair, battle in list(self.battles.items()):
+            if pair not in seen or battle['gap'] > self.end_gap:
+                if now - battle['last_close'] >= self.grace_time:
+                    battle['duration'] = battle['last_close'] - battle['start_time']
+                    del self.battles[pair]
+                    if battle['duration'] >= self.min_report_duration:
+                        events.append(("end", battle))
+
+        return events
@@ -0,0 +1,158 @@
+# benchmark_pipeline.py
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from PyQt5.QtCore import QCoreApplication, Qt
+import voice_generator
+from data_filterer import DataFilterer
+from race_commentator import RaceCommentator, LinePipeline
+from voice_generator import VoiceGenerator
+from mock_backends import MockTTSServer, mock_llm
+
+# End-to-end throughput of DataFilterer -> RaceCommentator -> VoiceGenerator (with the second pass)
+# against the offline fakes in mock_backends: no keys, no network.
+
+MOCK_PROMPT = "You are a race commentator. Comment on every event, keeping its timecode."
+
+
+def make_race_log(minutes, drivers=20, seed=1):
+    """A synthetic collector log: overtakes, battles, pit stops and a leaderboard every 4 minutes."""
+    rng = random.Random(seed)
+    names = [f"Driver {i}" for i in range(1, drivers + 1)]
+    lines = ["Pre-Race Information: Benchmark Circuit, synthetic race", "00:00:00 - The Race Begins!"]
+    second = 0
+    while second < minutes * 60:
+        second += rng.randint(5, 40)
+        stamp = f"{second // 3600:02}:{second % 3600 // 60:02}:{second % 60:02}"
+        if second // 240 != (second - 40) // 240:
+            lines.append(f"{stamp} - Current positions: " + ", ".join(f"(P{i + 1}) {name}" for i, name in enumerate(names)))
+        roll = rng.random()
+        p = rng.randint(1, drivers - 1)
+        if roll < 0.5:
+            names[p - 1], names[p] = names[p], names[p - 1]
+            lines.append(f"{stamp} - Overtake! {names[p - 1]} passes {names[p]} for P{p} at Turn {rng.randint(1, 12)}.")
+        elif roll < 0.7:
+            lines.append(f"{stamp} - Battle brewing! {names[p - 1]} defends P{p} from {names[p]} with just 0.{rng.randint(2, 9)}s gap!")
+        elif roll < 0.85:
+            lines.append(f"{stamp} - {rng.choice(names)} has entered the pits.")
+        else:
+            lines.append(f"{stamp} - Incident: {rng.choice(names)} has gone off at Turn {rng.randint(1, 12)}.")
+    lines.append(f"{second // 3600:02}:{second % 3600 // 60:02}:{second % 60:02} - Checkered flag! {names[0]} takes the win!")
+    return "\n".join(lines) + "\n"
+
+
+def _direct(signal, callback):
+    signal.connect(callback, Qt.DirectConnection) # Called on the emitting thread, no event loop needed
+
+
+def run_benchmark(minutes=30, llm_latency=0.5, tokens_per_second=200, tts_latency=0.3, tts_max_concurrent=None,
+                  pipeline=False, log_path=None, verbose=False, tts_concurrency=4):
+    app = QCoreApplication.instance() or QCoreApplication([])
+    log = print if verbose else (lambda text: None)
+    results = {'minutes': minutes, 'pipeline': pipeline, 'tts_concurrency': tts_concurrency}
+    server = MockTTSServer(latency=tts_latency, max_concurrent=tts_max_concurrent).start()
+    voice_generator.CARTESIA_TTS_URL = server.url
+    mock_llm.reset_stats()
+    settings = {"api": "mock", "model": "mock", "mock_latency": llm_latency, "mock_tokens_per_second": tokens_per_second,
+                "use_cache": False, "main_prompt": MOCK_PROMPT, "second_pass_prompt": MOCK_PROMPT}
+    previous_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="race_benchmark_")
+    os.chdir(work_dir) # Stages write next to their input and into ./audio_output
+    try:
+        race_path = os.path.join(work_dir, "race.txt")
+        if log_path:
+            with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+                race_log = f.read()
+        else:
+            race_log = make_race_log(minutes)
+        with open(race_path, 'w', encoding='utf-8') as f:
+            f.write(race_log)
+        results['events'] = sum(1 for line in race_log.splitlines() if line[:2].isdigit())
+        started = time.perf_counter()
+
+        filterer = DataFilterer(race_path, settings, "Keep the events worth commenting on.")
+        _direct(filterer.output_signal, log)
+        stage = time.perf_counter()
+        filterer.run()
+        results['filter_seconds'] = time.perf_counter() - stage
+        filtered_path = filterer.get_output_path()
+        if not filtered_path:
+            raise RuntimeError("Filter stage produced no output")
+
+        commentator = RaceCommentator(filtered_path, settings)
+        _direct(commentator.output_signal, log)
+        stage = time.perf_counter()
+        if pipeline:
+            line_pipeline = LinePipeline()
+            commentator.line_pipeline = line_pipeline
+            voice = VoiceGenerator(commentator.create_output_file(), "mock-key", "mock-voice",
+                                   commentary_api_settings=settings, line_pipeline=line_pipeline, tts_concurrency=tts_concurrency)
+            _direct(voice.output_signal, log)
+            voice.start()
+            commentator.run()
+            results['commentary_seconds'] = time.perf_counter() - stage
+            voice.wait()
+        else:
+            commentator.run()
+            results['commentary_seconds'] = time.perf_counter() - stage
+            voice = VoiceGenerator(commentator.get_output_path(), "mock-key", "mock-voice", commentary_api_settings=settings,
+                                   tts_concurrency=tts_concurrency)
+            _direct(voice.output_signal, log)
+            voice_stage = time.perf_counter()
+            voice.run()
+            results['voice_seconds'] = time.perf_counter() - voice_stage
+        results['total_seconds'] = time.perf_counter() - started
+
+        with open(commentator.get_output_path(), 'r', encoding='utf-8') as f:
+            results['commentary_lines'] = sum(1 for line in f if line[:2].isdigit())
+        audio_dir = voice.get_output_dir()
+        results['audio_files'] = len([name for name in os.listdir(audio_dir) if name.endswith(".mp3")]) if os.path.isdir(audio_dir) else 0
+        results['lines_per_second'] = results['audio_files'] / results['total_seconds'] if results['total_seconds'] else 0
+        results['llm_calls'] = mock_llm.calls
+        results['llm_max_in_flight'] = mock_llm.max_in_flight
+        results['tts'] = dict(server.stats)
+        results['work_dir'] = work_dir
+        app.processEvents()
+        return results
+    finally:
+        os.chdir(previous_dir)
+        server.stop()
+
+
+def format_results(results):
+    tts = results['tts']
+    lines = [f"Synthetic race: {results['minutes']} min, {results['events']} events "
+             f"({'pipelined' if results['pipeline'] else 'sequential'} commentary -> voice, "
+             f"{results['tts_concurrency']} TTS requests at once)",
+             f"  filter      {results['filter_seconds']:7.2f}s",
+             f"  commentary  {results['commentary_seconds']:7.2f}s"]
+    if 'voice_seconds' in results:
+        lines.append(f"  voice + 2nd {results['voice_seconds']:7.2f}s")
+    lines += [f"  total       {results['total_seconds']:7.2f}s, {results['audio_files']} audio files "
+              f"({results['lines_per_second']:.2f}/s), {results['commentary_lines']} commentary lines",
+              f"  LLM: {results['llm_calls']} calls, up to {results['llm_max_in_flight']} in flight",
+              f"  TTS: {tts['requests']} requests ({tts['rejected']} rejected), up to {tts['max_in_flight']} in flight, "
+              f"{tts['audio_seconds']:.0f}s of audio",
+              f"  Output in {results['work_dir']}"]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark against mock LLM/TTS backends.")
+    parser.add_argument("--minutes", type=int, default=30, help="length of the synthetic race")
+    parser.add_argument("--log", help="use this race log instead of a synthetic one")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake LLM time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="fake LLM output rate")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="fake Cartesia latency per request (s)")
+    parser.add_argument("--tts-max-concurrent", type=int, help="fake Cartesia answers 429 above this many requests at once")
+    parser.add_argument("--tts-concurrency", type=int, default=4, help="VoiceGenerator requests at once")
+    parser.add_argument("--pipeline", action="store_true", help="run voice generation while commentary streams")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the stages' console output")
+    args = parser.parse_args()
+    results = run_benchmark(args.minutes, args.llm_latency, args.tokens_per_second, args.tts_latency,
+                            args.tts_max_concurrent, args.pipeline, args.log, args.verbose, args.tts_concurrency)
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
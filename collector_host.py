@@ -0,0 +1,149 @@
+# collector_host.py
+import multiprocessing
+import threading
+import time
+import traceback
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Sim name -> (module, class), imported in the child so the GUI modules never load there
+COLLECTORS = {
+    "Assetto Corsa Competizione": ("data_collector_ACC", "DataCollector"),
+    "Automobilista 2": ("data_collector_AMS2", "DataCollector"),
+    "Assetto Corsa": ("data_collector_AC", "DataCollector"),
+}
+
+
+def _run_collector(sim_name, conn, stop_event, batch_interval):
+    """
+    Child process entry point. The collector's run() loop gets this process's main thread to
+    itself; its output is buffered and a sender thread pushes it down the pipe in batches.
+    """
+    pending = []
+    progress = [None]
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def queue_output(text):
+        with lock:
+            pending.append(text)
+
+    def queue_progress(value):
+        progress[0] = value
+
+    def send_pending():
+        with lock:
+            lines = pending[:]
+            del pending[:]
+        if lines:
+            conn.send(('output', lines))
+        value, progress[0] = progress[0], None
+        if value is not None:
+            conn.send(('progress', value))
+
+    collector = None
+
+    def sender():
+        stopped = False
+        while not finished.is_set():
+            if stop_event.wait(batch_interval) and not stopped and collector is not None:
+                stopped = True
+                try:
+                    collector.stop()
+                except Exception as e:
+                    queue_output(f"Error stopping collector: {e}")
+            try:
+                send_pending()
+            except (BrokenPipeError, EOFError, OSError):
+                if collector is not None and not stopped:
+                    collector.stop() # GUI went away
+                return
+
+    thread = threading.Thread(target=sender, name="collector-host-sender", daemon=True)
+    try:
+        module_name, class_name = COLLECTORS[sim_name]
+        module = __import__(module_name)
+        collector = getattr(module, class_name)()
+        # run() is called directly on this thread, so these connections are plain direct calls
+        collector.output_signal.connect(queue_output)
+        collector.progress_signal.connect(queue_progress)
+        thread.start()
+        if not stop_event.is_set():
+            collector.run()
+    except Exception as e:
+        queue_output(f"Error in collector process: {e}\n{traceback.format_exc()}")
+    finally:
+        finished.set()
+        if thread.is_alive():
+            thread.join()
+        try:
+            send_pending()
+            conn.send(('exit', None))
+        except (BrokenPipeError, EOFError, OSError):
+            pass
+        conn.close()
+
+
+class CollectorHost(QThread):
+    """
+    Runs a sim's data collector in a separate process so its loop doesn't share the GIL with the
+    Qt event loop, pygame and the LLM/TTS threads. Looks like a collector to the main window
+    (output_signal, progress_signal, stop(), finished), and additionally emits batch_signal with
+    every line received in one batch so the console can append them in one go.
+    """
+    output_signal = pyqtSignal(str)
+    batch_signal = pyqtSignal(list)
+    progress_signal = pyqtSignal(int)
+
+    def __init__(self, sim_name, batch_interval=0.1, stop_timeout=5.0):
+        super().__init__()
+        if sim_name not in COLLECTORS:
+            raise ValueError(f"Unknown sim: {sim_name}")
+        self.sim_name = sim_name
+        self.batch_interval = batch_interval
+        self.stop_timeout = stop_timeout
+        self.stop_event = multiprocessing.Event()
+        self.process = None
+
+    def run(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=_run_collector, name=f"collector-{self.sim_name}",
+                                               args=(self.sim_name, sender, self.stop_event, self.batch_interval),
+                                               daemon=True)
+        try:
+            self.process.start()
+            sender.close() # Only the child writes; EOF on our end then means it has gone
+            self.output_signal.emit(f"Collector process started (pid {self.process.pid}).")
+            stop_requested_at = None
+            while True:
+                if receiver.poll(self.batch_interval):
+                    try:
+                        kind, payload = receiver.recv()
+                    except EOFError:
+                        break
+                    if kind == 'output':
+                        self.batch_signal.emit(payload)
+                    elif kind == 'progress':
+                        self.progress_signal.emit(payload)
+                    elif kind == 'exit':
+                        break
+                elif not self.process.is_alive():
+                    break
+                if self.stop_event.is_set():
+                    stop_requested_at = stop_requested_at or time.monotonic()
+                    if time.monotonic() - stop_requested_at > self.stop_timeout:
+                        self.output_signal.emit("Collector process did not stop in time, terminating it.")
+                        self.process.terminate()
+                        break
+        except Exception as e:
+            self.output_signal.emit(f"Error in collector host: {e}")
+        finally:
+            receiver.close()
+            if self.process is not None:
+                self.process.join(2)
+                if self.process.is_alive():
+                    self.process.terminate()
+                    self.process.join(1)
+                self.output_signal.emit(f"Collector process exited (code {self.process.exitcode}).")
+
+    def stop(self):
+        self.stop_event.set()
@@ -8,43 +8,41 @@ import json
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from accapi.client import AccClient
+from acc_recorder import AccRecorder, AccReplayClient
+from race_state_engine import ACC_MESSAGES, RaceStateEngine, acc_frame
+from event_bus import get_event_bus, SESSION, INFO
 
 
 class DataCollector(QThread):
     output_signal = pyqtSignal(str)
     progress_signal = pyqtSignal(int)
 
-    def __init__(self):
+    def __init__(self, client=None):
         super().__init__()
-        self.client = AccClient()
+        # The broadcasting client: the live game by default, or a recording (ACC_REPLAY_PATH) for running headless
+        if client is None:
+            replay_path = os.environ.get("ACC_REPLAY_PATH")
+            client = AccReplayClient(replay_path) if replay_path else AccClient()
+        self.client = client
+        self.recorder = None
+        record_path = os.environ.get("ACC_RECORD_PATH")
+        if record_path:
+            # Capture every update for replaying bugs and golden tests later
+            self.recorder = AccRecorder(record_path).attach(self.client)
         self.running = False
         self.cars = {}  # Holds info about each car
         self.session_info = {}
-        self.last_update_time = 0
         self.update_interval = 4
-        self.previous_positions = {}
-        self.previous_progress = {}  # Store previous custom "adjusted_progress"
         self.race_started = False
         self.session_time_ms = 0
         self.race_start_time = None
-        self.current_accidents = {}
         self.initialization_complete = False
         self.output_file = None
-        self.cars_in_pits = set()
-        self.last_position_display = 0
+        self.data_directory = "Race Data"
+        self.event_bus = get_event_bus() # Typed copies of logged events for overlays and other tools
         self.track_data = None
         self.weather_data = None
 
-        # Final lap & finishing logic
-        self.final_lap_phase = False
-        self.finished_cars = set()
-        self.leader_finished = False
-        self.leader_car_index = None
-        self.total_laps = None
-
-        self.start_line_crossed = set()
-        self.qualifying_reported = False
-
         # Spline data logging
         self.spline_data = []  # Store spline data for each update cycle
 
@@ -52,23 +50,15 @@ class DataCollector(QThread):
         self.track_name = "Unknown"
         self.corner_data = []  # Store corner data for the current track
 
-        # Per‐car data for custom lap detection with a "just_crossed_line" flag
-        self.custom_laps = {}
-
-        # Thresholds for detecting a crossing
-        self.UPPER_THRESHOLD = 0.8
-        self.LOWER_THRESHOLD = 0.2
-
         # Session state tracking for file creation
         self.previous_session_type = None
         self.previous_session_phase = None
 
-        # New variables for accident detection
-        self.cars_in_accident = {}  # Dictionary to track cars in accident state
-        self.previous_speeds = {}  # Dictionary to track previous speeds
-        self.accident_speed_threshold = 35  # kph - report accident below this speed
-        self.accident_recovery_threshold = 80  # kph - reset accident flag when exceeding this speed
-        self.race_start_immunity = 10.0  # seconds to ignore accidents after race start
+        # Laps, pits, accidents, overtakes, leaderboards and the finish are worked out by the engine
+        # shared with the other sims. Accidents below 35 kph, cleared again above 80 kph; on the final
+        # lap the leader takes the flag once its spline passes 0.99.
+        self.engine = RaceStateEngine(accident_speed=35 / 3.6, recovery_speed=80 / 3.6, messages=ACC_MESSAGES,
+                                      finish_spline=0.99)
 
     def run(self):
         """Main execution loop for data collection."""
@@ -116,12 +106,13 @@ class DataCollector(QThread):
 
         while self.running:
             self.msleep(self.update_interval * 1000)
-            if self.race_started:
-                self.update_race_data()
+        self.log_race_events(self.engine.flush()) # Incidents still open when collection ends
 
         # Save spline data to a JSON file when the race ends
         if hasattr(self, 'spline_data'):
             self.save_spline_data()
+        if self.recorder:
+            self.recorder.close()
 
     def log_pre_race_info(self):
         """Logs comprehensive pre-race information including track, weather, and session details."""
@@ -208,18 +199,21 @@ class DataCollector(QThread):
             if switching_to_qualifying or switching_from_qualifying:
                 self.output_signal.emit(
                     f"Session type changed from {self.previous_session_type} to {current_session_type}")
+                self.log_race_events(self.engine.flush()) # Into the old session's file
 
                 # Create a new file with appropriate label
                 if current_session_type == "Qualify":
                     self.setup_output_file("Qualifying")
                 else:
                     self.setup_output_file("Race")
+                self.race_started = False
+                self.engine.reset()
 
-                self.log_event(f"New session started: {current_session_type} - {current_session_phase}")
+                self.log_event(f"New session started: {current_session_type} - {current_session_phase}", kind=SESSION)
             else:
                 # Just log the session change without creating a new file
                 if self.previous_session_type != current_session_type or self.previous_session_phase != current_session_phase:
-                    self.log_event(f"Session changed: {current_session_type} - {current_session_phase}")
+                    self.log_event(f"Session changed: {current_session_type} - {current_session_phase}", kind=SESSION)
 
         # Update previous session state
         self.previous_session_type = current_session_type
@@ -241,32 +235,31 @@ class DataCollector(QThread):
                         f"Joined ongoing race. Current session time: {self.format_session_time(self.session_time_ms)}"
                     )
 
+        now = self.session_time_ms / 1000
+        events = []
+
         # Detect race start
         if not self.race_started and update.sessionType == "Race" and update.sessionPhase == "Session":
             self.race_started = True
             self.race_start_time = datetime.now() - timedelta(milliseconds=self.session_time_ms)
-            self.log_event("The Race Begins!")
-
-        # Periodic position displays
-        if self.race_started and not self.final_lap_phase:
-            elapsed_time = self.session_time_ms / 1000
-            if elapsed_time >= 240 and (elapsed_time - self.last_position_display) >= 240:
-                self.display_positions()
-                self.last_position_display = elapsed_time
+            events += self.engine.start_race(now)
 
         # Detect final lap
-        if update.sessionPhase == "Session Over" and not self.final_lap_phase:
-            self.final_lap_phase = True
-            self.log_event("Leader is on final lap")
+        if update.sessionPhase == "Session Over":
+            events += self.engine.start_final_lap(now)
 
-        # If in final lap, check when the leader actually finishes
-        if self.final_lap_phase and not self.leader_finished:
-            self.check_race_finish()
+        # One engine tick per realtime update, with the car updates received since the last one
+        frames = [acc_frame(car) for car in self.cars.values() if 'splinePosition' in car]
+        events += self.engine.tick(frames, now)
+        if update.sessionPhase == "Post Session":
+            events += self.engine.flush() # Session over, nobody else is going to join an incident
+        self.log_race_events(events)
 
     def on_track_data_update(self, event):
         track_data = event.content
         self.track_name = track_data.trackName
         self.track_data = track_data
+        self.engine.track_length = track_data.trackMeters
         # Load corner data after receiving track name
         self.load_corner_data()
 
@@ -279,6 +272,7 @@ class DataCollector(QThread):
         if os.path.exists(corner_file_path):
             with open(corner_file_path, 'r') as f:
                 self.corner_data = json.load(f)
+            self.engine.set_corners(self.corner_data)
             self.output_signal.emit(f"Loaded corner data for track: {self.track_name}")
         else:
             self.output_signal.emit(
@@ -287,18 +281,10 @@ class DataCollector(QThread):
     def on_realtime_car_update(self, event):
         car = event.content
 
-        # Get the current speed
-        current_speed = car.kmh if hasattr(car, 'kmh') else 0
-
-        # Store the current speed for future reference
-        if car.carIndex not in self.previous_speeds:
-            self.previous_speeds[car.carIndex] = current_speed
-
         # Initialize the dictionary for this car if needed
         if car.carIndex not in self.cars:
             self.cars[car.carIndex] = {
                 'carIndex': car.carIndex,
-                'previous_spline': 0,
                 'laps': 0
             }
 
@@ -306,148 +292,27 @@ class DataCollector(QThread):
         current_car.update({
             'position': car.position,
             'driverName': current_car.get('driverName', f'Car {car.carIndex}'),
-            'laps': car.laps,  # We'll still store it, but won't use it for adjusted_progress
+            'laps': car.laps,  # ACC's count, for reference; the engine counts line crossings itself
             'splinePosition': car.splinePosition,
             'location': car.location,
-            'speed': current_speed,  # Store speed in the car data
+            'speed': car.kmh if hasattr(car, 'kmh') else 0,
         })
 
-        # -------------------------------
-        # CUSTOM LAP DETECTION LOGIC
-        # -------------------------------
-        if car.carIndex not in self.custom_laps:
-            # Initialize custom lap counters and flags
-            skip_first = (car.splinePosition >= self.UPPER_THRESHOLD)
-            self.custom_laps[car.carIndex] = {
-                'lap_count': 0,
-                'last_spline': None,
-                'skip_first_crossing': skip_first,
-                'just_crossed_line': False
-            }
-
-        custom_car = self.custom_laps[car.carIndex]
-        last_spline = custom_car['last_spline']
-        current_spline = car.splinePosition
-
-        if last_spline is not None:
-            # Has the car gone from >= UPPER_THRESHOLD down to <= LOWER_THRESHOLD?
-            if last_spline >= self.UPPER_THRESHOLD and current_spline <= self.LOWER_THRESHOLD:
-                # Only increment if we haven't already counted it
-                if not custom_car['just_crossed_line']:
-                    if custom_car['skip_first_crossing']:
-                        # Skip this one time
-                        custom_car['skip_first_crossing'] = False
-                    else:
-                        custom_car['lap_count'] += 1
-                    # Mark that we've accounted for this crossing
-                    custom_car['just_crossed_line'] = True
-
-        # If the car is now above LOWER_THRESHOLD, reset the just_crossed_line flag
-        if current_spline > self.LOWER_THRESHOLD:
-            custom_car['just_crossed_line'] = False
-
-        # Update last_spline
-        custom_car['last_spline'] = current_spline
-
-        # -------------------------------
-        # Use OUR lap_count for adjusted progress
-        # -------------------------------
-        adjusted_progress = custom_car['lap_count'] + current_spline
-        current_car['adjusted_progress'] = adjusted_progress
-
         # -------------------------------
         # Store spline data for each cycle
         # -------------------------------
         self.spline_data.append({
             'sessionTime': self.session_time_ms,
             'carIndex': car.carIndex,
-            'splinePosition': current_spline,
+            'splinePosition': car.splinePosition,
             'laps': car.laps  # from ACC, just for reference
         })
 
-        # Pit entry/exit logging
-        if car.carIndex not in self.finished_cars:
-            if car.location in ["Pitlane", "Pit Entry"] and car.carIndex not in self.cars_in_pits:
-                self.cars_in_pits.add(car.carIndex)
-                driver_name = current_car.get('driverName', f"Car {car.carIndex}")
-                self.log_event(f"{driver_name} has entered the pits.")
-            elif car.location not in ["Pitlane", "Pit Entry"] and car.carIndex in self.cars_in_pits:
-                self.cars_in_pits.remove(car.carIndex)
-                driver_name = current_car.get('driverName', f"Car {car.carIndex}")
-                self.log_event(f"{driver_name} has exited the pits.")
-
-        # -------------------------------
-        # ACCIDENT DETECTION
-        # -------------------------------
-        if self.race_started and car.carIndex not in self.finished_cars:
-            # Skip cars in pits and the first 20 seconds after race start
-            session_elapsed = self.session_time_ms / 1000
-            if (car.carIndex not in self.cars_in_pits and
-                    session_elapsed > self.race_start_immunity):
-
-                # Check if speed dropped below threshold
-                if (current_speed < self.accident_speed_threshold and
-                        car.carIndex not in self.cars_in_accident):
-
-                    # Get corner information
-                    corner_name = None
-                    if self.corner_data:
-                        corner_name = self.get_corner_name(car.splinePosition)
-
-                    # Create location description
-                    location_info = f" at {corner_name}" if corner_name else ""
-                    position_info = f" from P{current_car.get('position', '?')}"
-
-                    # Report accident
-                    driver_name = current_car.get('driverName', f"Car {car.carIndex}")
-                    self.log_event(f"Accident! {driver_name} has stopped{position_info}{location_info}")
-
-                    # Add to cars in accident dictionary
-                    self.cars_in_accident[car.carIndex] = {
-                        'time': session_elapsed,
-                        'location': corner_name
-                    }
-
-                # Check if car has recovered (speed above recovery threshold)
-                elif (car.carIndex in self.cars_in_accident and
-                      current_speed > self.accident_recovery_threshold):
-
-                    driver_name = current_car.get('driverName', f"Car {car.carIndex}")
-
-                    # Simple recovery message without time or location
-                    self.log_event(f"{driver_name} appears to be moving again.")
-
-                    # Remove from accident tracking
-                    del self.cars_in_accident[car.carIndex]
-
-        # -------------------------------
-        # CHECK IF A CAR HAS FINISHED AFTER THE LEADER
-        # -------------------------------
-        # Once leader_finished == True, the checkered is out for everyone.
-        # Any car crossing the line (just_crossed_line=True) that is not yet finished is deemed finished.
-        if self.leader_finished:
-            if custom_car['just_crossed_line'] and car.carIndex not in self.finished_cars:
-                # Mark this car as finished and announce final position
-                sorted_cars = self.get_sorted_cars()
-                # Find the position of the finishing car
-                finish_position = None
-                for i, c in enumerate(sorted_cars, start=1):
-                    if c['carIndex'] == car.carIndex:
-                        finish_position = i
-                        break
-                driver_name = current_car.get('driverName', f"Car {car.carIndex}")
-                self.log_event(f"{driver_name} has finished in position {finish_position}.")
-                self.finished_cars.add(car.carIndex)
-
-        # Update the previous speed after all processing
-        self.previous_speeds[car.carIndex] = current_speed
-
     def on_entry_list_car_update(self, event):
         car = event.content
         if car.carIndex not in self.cars:
             self.cars[car.carIndex] = {
                 'carIndex': car.carIndex,
-                'previous_spline': 0,
                 'laps': 0
             }
         if car.drivers:
@@ -460,37 +325,16 @@ class DataCollector(QThread):
         event_content = event.content
         event_type = event_content.type
         if event_type == "Session Over":
-            self.log_event("Leader is on final lap")
-            self.final_lap_phase = True
+            self.log_race_events(self.engine.start_final_lap(self.session_time_ms / 1000))
         # We're ignoring the built-in accident events since we have our own detection
 
-    def check_race_finish(self):
-        """
-        Called after 'Leader is on final lap' to detect exactly when
-        the leader crosses the line for the final time.
-        """
-        sorted_cars = self.get_sorted_cars()
-        leader = sorted_cars[0]
-        # Using ACC's laps + splinePosition to detect the checkered
-        if leader['splinePosition'] > 0.99 and not self.leader_finished:
-            self.leader_finished = True
-            self.total_laps = leader['laps']
-            self.log_event(f"Checkered flag! {leader['driverName']} takes the win!")
-            # Now, each subsequent car is flagged as it crosses the line in on_realtime_car_update()
-
-    def get_sorted_cars(self):
-        """
-        Sort the cars by our custom adjusted_progress. The highest progress is P1.
-        """
-        return sorted(self.cars.values(), key=lambda x: -x.get('adjusted_progress', 0))
-
     def get_qualifying_order(self):
         return sorted(self.cars.values(), key=lambda x: x.get('position', float('inf')))
 
     def report_qualifying_results(self):
         qualifying_order = self.get_qualifying_order()
         result_string = "Qualifying results: " + ", ".join(
-            f"(P{car.get('position', i + 1)}) {car.get('driverName', f'Car {car['carIndex']}')} ({car.get('nationality', 'Unknown')})"
+            f"(P{car.get('position', i + 1)}) {car.get('driverName', 'Car ' + str(car['carIndex']))} ({car.get('nationality', 'Unknown')})"
             for i, car in enumerate(qualifying_order)
         )
         self.log_event(result_string)
@@ -501,129 +345,8 @@ class DataCollector(QThread):
         Before the race starts -> 'Qualifying positions',
         After the race starts -> 'Current positions'.
         """
-        sorted_cars = self.get_sorted_cars()
-        positions = []
-        for position, car in enumerate(sorted_cars, start=1):
-            if car['carIndex'] not in self.finished_cars:
-                driver_name = car.get('driverName', f"Car {car['carIndex']}")
-                positions.append(f"(P{position}) {driver_name}")
-
-        if not self.race_started:
-            title = "Qualifying positions"
-        else:
-            title = "Current positions"
-
-        position_string = f"{title}: " + ", ".join(positions)
-        self.log_event(position_string)
-
-    def update_race_data(self):
-        """
-        Called periodically while the race is ongoing.
-        Detect overtakes and process accidents.
-        """
-        sorted_cars = self.get_sorted_cars()
-
-        # Build current_positions (1-based) for non-finished, non-pitting cars
-        current_positions = {
-            car['carIndex']: i + 1
-            for i, car in enumerate(sorted_cars)
-            if car['carIndex'] not in self.cars_in_pits and car['carIndex'] not in self.finished_cars
-        }
-
-        # Build current_progress from our custom adjusted_progress
-        current_progress = {car['carIndex']: car['adjusted_progress'] for car in sorted_cars}
-
-        # Only detect overtakes after 15 seconds to prevent false positives at the start
-        overtakes = self.detect_overtakes(current_positions, current_progress) if self.session_time_ms >= 15000 else []
-
-        self.previous_positions = current_positions
-        self.previous_progress = current_progress
-
-        # Announce overtakes
-        for overtake in overtakes:
-            self.log_event(overtake)
-
-    def detect_overtakes(self, current_positions, current_progress):
-        """
-        Compare current positions/progress vs previous to detect overtakes.
-        Also detect if an overtake is actually lapping.
-        """
-        overtakes = []
-        if not self.previous_positions or not self.race_started:
-            return overtakes
-
-        for car_index, current_pos in current_positions.items():
-            if car_index in self.previous_positions and car_index not in self.finished_cars:
-                previous_pos = self.previous_positions[car_index]
-                # If current position < previous position, they've moved up
-                if current_pos < previous_pos:
-                    try:
-                        overtaker = self.cars[car_index].get('driverName', f"Car {car_index}")
-                    except KeyError:
-                        overtaker = f"Unknown Car {car_index}"
-
-                    # Figure out who was overtaken (someone at position = current_pos + 1)
-                    for other_index, other_pos in current_positions.items():
-                        if other_index != car_index and other_index not in self.finished_cars:
-                            if other_pos == current_pos + 1:
-                                # Check if we truly passed them (based on adjusted_progress)
-                                prev_overtaker_prog = self.previous_progress.get(car_index, 0)
-                                prev_overtaken_prog = self.previous_progress.get(other_index, 0)
-                                cur_overtaker_prog = current_progress.get(car_index, 0)
-                                cur_overtaken_prog = current_progress.get(other_index, 0)
-
-                                if prev_overtaker_prog < prev_overtaken_prog and cur_overtaker_prog > cur_overtaken_prog:
-                                    try:
-                                        overtaken = self.cars[other_index].get('driverName', f"Car {other_index}")
-                                    except KeyError:
-                                        overtaken = f"Unknown Car {other_index}"
-
-                                    # Determine the corner name
-                                    corner_name = self.get_corner_name(cur_overtaker_prog % 1)
-
-                                    # Check if it's actually a lapping pass
-                                    overtaker_lap_count = self.custom_laps[car_index]['lap_count']
-                                    overtaken_lap_count = self.custom_laps[other_index]['lap_count']
-
-                                    if overtaker_lap_count > overtaken_lap_count:
-                                        # Lapping pass
-                                        overtake_message = f"Overtake! {overtaker} overtook {overtaken} who is being lapped"
-                                    else:
-                                        overtake_message = f"Overtake! {overtaker} overtook {overtaken} for position {current_pos}"
-
-                                    if corner_name:
-                                        overtake_message += f" at {corner_name}."
-                                    else:
-                                        overtake_message += "."
-
-                                    overtakes.append(overtake_message)
-            else:
-                # This car wasn't in previous_positions or just started
-                continue
-
-        return overtakes
-
-    def get_corner_name(self, spline_position):
-        """
-        Find which corner (if any) the given spline_position is in,
-        based on self.corner_data.
-        """
-        if not self.corner_data:
-            return None  # No corner data available
-
-        for corner in self.corner_data:
-            start = corner['start']
-            end = corner['end']
-            # Normal range corner
-            if start <= end:
-                if start <= spline_position <= end:
-                    return corner['name']
-            else:
-                # The corner wraps around 1.0 -> 0.0
-                if spline_position >= start or spline_position <= end:
-                    return corner['name']
-
-        return None  # No matching corner found
+        title = "Current positions" if self.race_started else "Qualifying positions"
+        self.log_race_events([self.engine.leaderboard(self.session_time_ms / 1000, title)])
 
     def format_session_time(self, milliseconds):
         seconds = int(milliseconds // 1000)
@@ -633,8 +356,7 @@ class DataCollector(QThread):
 
     def setup_output_file(self, session_name=None):
         """Set up output file with optional session name for session changes"""
-        if not os.path.exists("Race Data"):
-            os.makedirs("Race Data")
+        os.makedirs(self.data_directory, exist_ok=True)
 
         start_time = datetime.now()
 
@@ -644,18 +366,21 @@ class DataCollector(QThread):
         else:
             filename = start_time.strftime("%Y-%m-%d_%H-%M-%S") + ".txt"
 
-        self.output_file = os.path.join("Race Data", filename)
+        self.output_file = os.path.join(self.data_directory, filename)
 
         with open(self.output_file, 'w', encoding='utf-8') as f:
             f.write(f"Race data collection started at: {start_time}\n\n")
             if session_name:
                 f.write(f"Session: {session_name}\n\n")
 
-    def log_event(self, event):
-        formatted_time = self.format_session_time(self.session_time_ms)
+    def log_event(self, event, session_ms=None, kind=INFO, **data):
+        if session_ms is None:
+            session_ms = self.session_time_ms
+        formatted_time = self.format_session_time(session_ms)
         log_message = f"{formatted_time} - {event}"
 
         self.output_signal.emit(log_message)
+        self.event_bus.publish(kind, event, session_ms, "ACC", **data)
 
         if self.output_file:
             try:
@@ -666,11 +391,28 @@ class DataCollector(QThread):
                 with open(self.output_file, 'a', encoding='utf-8', errors='replace') as f:
                     f.write(log_message + '\n')
 
+    def log_race_events(self, events):
+        for event in events:
+            self.log_event(event.message, int(round(event.time * 1000)), event.kind, **event.data)
+
     def save_spline_data(self):
-        spline_file = os.path.join("Race Data", "spline_data.json")
+        spline_file = os.path.join(self.data_directory, "spline_data.json")
         with open(spline_file, 'w') as f:
             json.dump(self.spline_data, f)
         self.output_signal.emit(f"Spline data saved to {spline_file}")
 
     def get_output_file_path(self):
-        return self.output_file
\ No newline at end of file
+        return self.output_file
+
+def replay_recording(path, data_directory):
+    """Runs a recording (acc_recorder) through the collector as fast as it will go and returns everything it output."""
+    client = AccReplayClient(path, speed=None)
+    collector = DataCollector(client=client)
+    collector.data_directory = data_directory
+    lines = []
+    collector.output_signal.connect(lines.append)
+    collector.setup_client()
+    collector.setup_output_file()
+    client.play() # In this thread, so the collector's handlers run in order without the client's thread
+    collector.log_race_events(collector.engine.flush()) # As run() does when it stops
+    return lines
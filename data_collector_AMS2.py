@@ -1,11 +1,14 @@
 # data_collector_AMS2.py
 import ctypes
-import mmap
 import time
 from datetime import datetime
 import os
 import json # <-- Added import
 from shared_memory_struct import SharedMemory
+from ams2_memory_source import create_memory_source
+from ams2_recorder import RecordingMemorySource, SnapshotRecorder
+from race_state_engine import AMS2_MESSAGES, RaceStateEngine, ams2_frames
+from event_bus import get_event_bus, SESSION, INFO
 from PyQt5.QtCore import QThread, pyqtSignal
 
 # Define race and session state constants
@@ -47,10 +50,23 @@ class DataCollector(QThread):
     output_signal = pyqtSignal(str)
     progress_signal = pyqtSignal(int)
 
-    def __init__(self):
+    def __init__(self, memory_source=None):
         super().__init__()
         self.shared_memory_file = "$pcars2$"
         self.memory_size = ctypes.sizeof(SharedMemory)
+        # Where SharedMemory pages come from: the live game mapping by default, or a
+        # file mapping / recorded stream (AMS2_MEMORY_SOURCE="file:<path>") for running headless
+        self.memory_source = memory_source if memory_source else create_memory_source(os.environ.get("AMS2_MEMORY_SOURCE"))
+        record_path = os.environ.get("AMS2_RECORD_PATH")
+        if record_path:
+            # Capture every new page to a delta-compressed recording for replaying bugs later
+            self.memory_source = RecordingMemorySource(self.memory_source, SnapshotRecorder(record_path))
+        # Replays supply the recorded time so timecodes match the original session at any speed
+        self.clock = getattr(self.memory_source, 'clock', time.time)
+        # Seconds between shared memory reads; replays pace themselves (or run flat out)
+        self.poll_interval = 0 if self.memory_source.paced else 0.2
+        self.data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Race Data")
+        self.event_bus = get_event_bus() # Typed copies of logged events for overlays and other tools
         self.output_file = None
         self.output_file_stem = None # <-- Added to store base filename timestamp
         self.running = False
@@ -58,8 +74,6 @@ class DataCollector(QThread):
         self.race_started = False
         self.race_completed = False
         self.last_leaderboard_time = 0
-        self.previous_positions = {}
-        self.last_overtake_update = 0
         self.race_start_system_time = None
         self.previous_race_state = None
         self.track_name = None
@@ -73,49 +87,39 @@ class DataCollector(QThread):
         self.participant_map_saved = False
         # -----------------------
 
-        # Race ending tracking
-        self.final_lap_announced = False
-        self.race_winner_announced = False
-        self.finished_drivers = set()
-        self.previous_laps = {}
-        self.timer_ended = False
-
-        # Accident detection variables
-        self.cars_in_accident = {}
-        self.previous_speeds = {}
-        self.cars_ready_for_monitoring = set()
+        # Laps, pits, accidents, overtakes, battles, leaderboards and the finish are worked out by
+        # the engine shared with the other sims; this collector only feeds it frames and session state
+        self.engine = RaceStateEngine(accident_speed=5.56, recovery_speed=19.44, messages=AMS2_MESSAGES) # m/s, ~20 and ~70 km/h
         self.speed_offset = 8 # Offset for mSpeeds array
 
-        # Thresholds in METERS PER SECOND (m/s)
-        self.accident_speed_threshold = 5.56 # ~20 km/h
-        self.accident_recovery_threshold = 19.44 # ~70 km/h
-        self.race_start_immunity = 10.0 # seconds
-        self.cars_in_pits = set()
-
     def update_accident_settings(self, speed_threshold=None, time_threshold=None, proximity_time=None):
         if speed_threshold is not None:
-            self.accident_speed_threshold = speed_threshold / 3.6
+            self.engine.accident_speed = speed_threshold / 3.6
 
     def setup_shared_memory(self):
         try:
-            self.file_handle = mmap.mmap(-1, self.memory_size, self.shared_memory_file, access=mmap.ACCESS_READ)
-            self.output_signal.emit("Shared memory setup complete.")
+            self.memory_source.open()
+            self.file_handle = self.memory_source
+            self.output_signal.emit(f"Shared memory setup complete ({self.memory_source.description}).")
         except Exception as e:
             self.output_signal.emit(f"Error setting up shared memory: {e}")
 
     def read_shared_memory(self):
         try:
-            data = SharedMemory()
-            self.file_handle.seek(0)
-            ctypes.memmove(ctypes.addressof(data), self.file_handle.read(ctypes.sizeof(data)), ctypes.sizeof(data))
-            return data
+            page = self.memory_source.read()
+            if page is None:
+                return None
+            if isinstance(page, SharedMemory):
+                return page
+            # Single copy straight out of the mapping (or snapshot bytes) into the struct
+            return SharedMemory.from_buffer_copy(page)
         except Exception as e:
             self.output_signal.emit(f"Error reading shared memory: {e}")
             return None
 
     def setup_output_file(self, session_name=None):
         try:
-            directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Race Data")
+            directory = self.data_directory
             os.makedirs(directory, exist_ok=True)
 
             start_time_dt = datetime.now() # Store datetime object
@@ -139,12 +143,14 @@ class DataCollector(QThread):
             self.output_signal.emit(f"Error setting up output file: {e}")
             self.output_file_stem = None # Ensure stem is None if setup fails
 
-    def log_event(self, event):
+    def log_event(self, event, elapsed=None, kind=INFO, **data):
         try:
-            timestamp = self.format_time(
-                time.time() - self.race_start_system_time if self.race_start_system_time else 0)
+            if elapsed is None:
+                elapsed = self.clock() - self.race_start_system_time if self.race_start_system_time else 0
+            timestamp = self.format_time(elapsed)
             formatted_event = f"{timestamp} - {event}"
             self.output_signal.emit(formatted_event)
+            self.event_bus.publish(kind, event, int(elapsed * 1000), "AMS2", **data)
 
             if self.output_file:
                 try:
@@ -155,13 +161,9 @@ class DataCollector(QThread):
         except Exception as e:
             self.output_signal.emit(f"Error logging event: {e}")
 
-    def get_car_speed(self, data, car_index):
-        try:
-            if hasattr(data, 'mSpeeds') and car_index + self.speed_offset < len(data.mSpeeds):
-                return data.mSpeeds[car_index + self.speed_offset]
-            return 0
-        except Exception:
-            return 0
+    def log_race_events(self, events):
+        for event in events:
+            self.log_event(event.message, event.time, event.kind, **event.data)
 
     # --- Added method to capture participant map ---
     def capture_participant_map(self, data):
@@ -210,30 +212,26 @@ class DataCollector(QThread):
             if raw_track:
                 self.track_name = raw_track
                 self.output_signal.emit(f"Track detected: {self.track_name}")
+                self.load_corner_data()
 
+        events = []
+        starting_grid = False
         if self.previous_race_state != data.mRaceState:
             if data.mRaceState == RACESTATE_NOT_STARTED:
                 self.race_started = False
                 self.race_completed = False
                 self.race_start_system_time = None
-                self.previous_positions = {}
-                self.last_overtake_update = 0
                 self.last_leaderboard_time = 0
                 self.qualifying_positions_output = False
-                self.cars_in_accident = {}
-                self.cars_in_pits = set()
-                self.cars_ready_for_monitoring = set()
-                self.final_lap_announced = False
-                self.race_winner_announced = False
-                self.finished_drivers.clear()
-                self.timer_ended = False
+                events += self.engine.flush() # Incidents from before the restart
+                self.engine.reset()
                 # Don't reset participant map capture flag here, allow capture on transition
             elif data.mRaceState == RACESTATE_RACING and self.previous_race_state != RACESTATE_RACING:
-                self.log_event("Race has started!")
                 self.race_started = True
-                self.race_start_system_time = time.time()
+                self.race_start_system_time = self.clock()
+                events += self.engine.start_race(0)
                 if not self.qualifying_positions_output:
-                    self.output_leaderboard(data, 0, label="Starting Grid") # Changed label
+                    starting_grid = True # Logged once this frame's positions are in
                     self.qualifying_positions_output = True
                 # --- Attempt to capture map right at race start ---
                 if not self.participant_map_captured:
@@ -246,192 +244,56 @@ class DataCollector(QThread):
              self.capture_participant_map(data)
         # -------------------------------------------------------------
 
+        if data.mRaceState == RACESTATE_RACING and not self.race_started: # Should be handled above, but safety check
+            self.race_start_system_time = self.clock()
+            self.race_started = True
+            events += self.engine.start_race(0)
+
         if self.race_start_system_time is not None:
-            session_time_elapsed = time.time() - self.race_start_system_time
+            session_time_elapsed = self.clock() - self.race_start_system_time
         else:
             session_time_elapsed = 0
 
-        if self.race_started and not self.final_lap_announced and not self.race_completed:
-            if 0 <= data.mEventTimeRemaining < 0.5 and not self.timer_ended:
-                self.timer_ended = True
-                self.log_event("The Leader is on the Final Lap")
-                self.final_lap_announced = True
-            elif data.mHighestFlagColour == 11: # FLAG_COLOUR_CHEQUERED
-                if not self.final_lap_announced:
-                    self.log_event("The Leader is on the Final Lap")
-                    self.final_lap_announced = True
-                    self.timer_ended = True
-
-        if not self.race_started and not self.qualifying_positions_output:
-            if data.mNumParticipants > 0 and data.mSessionState == SESSION_QUALIFY: # Only log qualify in Q
-                self.output_leaderboard(data, session_time_elapsed, label="Qualifying positions")
+        if self.race_started and not self.race_completed:
+            if 0 <= data.mEventTimeRemaining < 0.5 or data.mHighestFlagColour == 11: # Timer out or FLAG_COLOUR_CHEQUERED
+                events += self.engine.start_final_lap(session_time_elapsed)
+
+        self.engine.track_length = data.mTrackLength
+        events += self.engine.tick(ams2_frames(data, self.speed_offset), session_time_elapsed)
+
+        if self.race_started and data.mRaceState == RACESTATE_FINISHED and not self.race_completed:
+            self.race_completed = True
+            events += self.engine.finish_race(session_time_elapsed) # Unless a car already took the flag
+            events += self.engine.flush()
+
+        if starting_grid:
+            events.append(self.engine.leaderboard(0, "Starting Grid"))
+        if not self.race_started and self.session_type == SESSION_QUALIFY and data.mNumParticipants > 0:
+            # Qualy leaderboard, once on entering the session and then every minute
+            if not self.qualifying_positions_output or session_time_elapsed - self.last_leaderboard_time >= 60:
+                events.append(self.engine.leaderboard(session_time_elapsed, "Qualifying positions"))
                 self.qualifying_positions_output = True
+                self.last_leaderboard_time = session_time_elapsed
 
         # --- Reset qualy output flag if session changes from Qualify ---
         if self.session_type != SESSION_QUALIFY and self.previous_session_type == SESSION_QUALIFY:
              self.qualifying_positions_output = False
         # --------------------------------------------------------------
 
-        if data.mRaceState == RACESTATE_RACING:
-            if not self.race_started: # Should be handled above, but safety check
-                self.race_start_system_time = time.time()
-                session_time_elapsed = 0
-                self.race_started = True
-                self.last_leaderboard_time = session_time_elapsed
-            else:
-                session_time_elapsed = time.time() - self.race_start_system_time
-
-        if not self.race_started: # Qualy leaderboard
-            if session_time_elapsed - self.last_leaderboard_time >= 60:
-                 if self.session_type == SESSION_QUALIFY:
-                    self.output_leaderboard(data, session_time_elapsed, label="Qualifying positions")
-                    self.last_leaderboard_time = session_time_elapsed
-        elif self.race_started and not self.race_completed: # Race leaderboard
-            if session_time_elapsed - self.last_leaderboard_time >= 4 * 60:
-                self.output_leaderboard(data, session_time_elapsed)
-                self.last_leaderboard_time = session_time_elapsed
-
-        if self.race_started and data.mRaceState == RACESTATE_FINISHED and not self.race_completed:
-            self.race_completed = True
-            if not self.race_winner_announced:
-                leader_index = None
-                leader_name = "The Leader"
-                for i in range(data.mNumParticipants):
-                    if i < len(data.mParticipantInfo) and data.mParticipantInfo[i].mIsActive:
-                        if data.mParticipantInfo[i].mRacePosition == 1:
-                            leader_index = i
-                            try:
-                                leader_name = data.mParticipantInfo[i].mName.decode('utf-8').strip('\x00')
-                                if not leader_name: leader_name = f"Car {i}"
-                            except: leader_name = f"Car {i}"
-                            break
-                self.log_event(f"CHECKERED FLAG: {leader_name} has won the race!")
-                self.race_winner_announced = True
-
-        current_positions = {}
-        position_to_name = {}
-
-        for i in range(data.mNumParticipants):
-            if i >= len(data.mParticipantInfo): continue
-            participant_data = data.mParticipantInfo[i] # <-- participant_data is defined here
-            if not participant_data.mIsActive: continue
-
-            try:
-                driver_name = participant_data.mName.decode('utf-8').strip('\x00')
-                if not driver_name: driver_name = f"Car {i}"
-            except: driver_name = f"Car {i}"
-
-            current_pos_val = participant_data.mRacePosition # <-- Store current position
-            current_positions[i] = current_pos_val
-            position_to_name[current_pos_val] = driver_name
-            current_speed = self.get_car_speed(data, i)
-
-            if i not in self.previous_speeds: self.previous_speeds[i] = current_speed
+        self.log_race_events(events)
 
-            current_pit_mode = PIT_MODE_NONE
-            if i < len(data.mPitModes): current_pit_mode = data.mPitModes[i]
-
-            if current_pit_mode in [PIT_MODE_DRIVING_INTO_PITS, PIT_MODE_IN_PIT, PIT_MODE_IN_GARAGE]:
-                self.cars_in_pits.add(i)
-                if i in self.cars_ready_for_monitoring: self.cars_ready_for_monitoring.remove(i)
-            else:
-                if i in self.cars_in_pits: self.cars_in_pits.remove(i)
-
-            # --- Accident Detection Logic ---
-            if (self.race_started and
-                    not self.race_completed and
-                    i not in self.finished_drivers and
-                    i not in self.cars_in_pits and
-                    session_time_elapsed > self.race_start_immunity):
-
-                # Check if car needs to be monitored (was above recovery speed)
-                if i not in self.cars_ready_for_monitoring:
-                    if current_speed >= self.accident_recovery_threshold:
-                        self.cars_ready_for_monitoring.add(i)
-
-                # If car is being monitored, check for accident speed
-                if i in self.cars_ready_for_monitoring:
-                    if current_speed < self.accident_speed_threshold and i not in self.cars_in_accident:
-                        # --- Accident detected! Log with position ---
-                        # We already have current_pos_val from earlier in the loop
-                        self.log_event(f"Accident! P{current_pos_val} {driver_name} is involved in an accident!")
-                        # --------------------------------------------
-                        self.cars_in_accident[i] = {'time': session_time_elapsed, 'driver': driver_name, 'position': current_pos_val} # Store position too
-                        self.cars_ready_for_monitoring.remove(i) # Stop monitoring until recovered
-
-                # If car was in an accident, check if it has recovered speed
-                elif i in self.cars_in_accident and current_speed > self.accident_recovery_threshold:
-                    # Car recovered, add back to monitoring list
-                    self.cars_ready_for_monitoring.add(i)
-                    # Remove from the active accident list
-                    del self.cars_in_accident[i]
-            # --- End Accident Detection ---
-
-            current_lap = participant_data.mCurrentLap
-            previous_lap = getattr(self, 'previous_laps', {}).get(i, 0)
-            if not hasattr(self, 'previous_laps'): self.previous_laps = {}
-
-            if self.final_lap_announced and not self.race_completed:
-                is_leader = participant_data.mRacePosition == 1
-                crossed_line = current_lap > previous_lap
-                if crossed_line:
-                    if is_leader and not self.race_winner_announced:
-                        self.race_winner_announced = True
-                        self.log_event(f"CHECKERED FLAG: {driver_name} has won the race!")
-                        self.finished_drivers.add(i)
-                    elif self.race_winner_announced and i not in self.finished_drivers:
-                        position = participant_data.mRacePosition
-                        self.log_event(f"{driver_name} has finished in position {position}")
-                        self.finished_drivers.add(i)
-
-            self.previous_laps[i] = current_lap
-            self.previous_speeds[i] = current_speed
-        # --- End of participant loop ---
-
-        # --- Overtake Detection Logic ---
-        if session_time_elapsed - self.last_overtake_update >= 1.0 and session_time_elapsed >= 15:
-            for driver_index, current_pos in current_positions.items():
-                prev_pos = self.previous_positions.get(driver_index)
-                if prev_pos is not None and prev_pos != current_pos:
-                    if driver_index >= len(data.mParticipantInfo): continue
-                    overtaker_data = data.mParticipantInfo[driver_index]
-                    if not overtaker_data.mIsActive: continue
-                    try:
-                        overtaker_name = overtaker_data.mName.decode('utf-8').strip('\x00')
-                        if not overtaker_name: overtaker_name = f"Car {driver_index}"
-                    except: overtaker_name = f"Car {driver_index}"
-
-                    if current_pos < prev_pos: # Position improved (lower number is better)
-                        # Find the driver who was overtaken
-                        overtaken_index = -1
-                        for other_index, other_prev_pos in self.previous_positions.items():
-                            # Find someone who was previously in the position the overtaker is now in,
-                            # and who is now in the position the overtaker was previously in.
-                            if other_index != driver_index and other_prev_pos == current_pos and current_positions.get(other_index) == prev_pos:
-                                overtaken_index = other_index
-                                break
-
-                        if overtaken_index != -1:
-                            if overtaken_index >= len(data.mParticipantInfo): continue
-                            other_data = data.mParticipantInfo[overtaken_index]
-                            if not other_data.mIsActive: continue
-                            try:
-                                other_name = other_data.mName.decode('utf-8').strip('\x00')
-                                if not other_name: other_name = f"Car {overtaken_index}"
-                            except: other_name = f"Car {overtaken_index}"
-
-                            lap_diff = abs(overtaker_data.mCurrentLap - other_data.mCurrentLap)
-                            if lap_diff > 0:
-                                self.log_event(f"{overtaker_name} laps {other_name} for P{current_pos}")
-                            else:
-                                if current_pos == 1:
-                                    self.log_event(f"LEAD CHANGE! {overtaker_name} takes the lead from {other_name}!")
-                                else:
-                                    self.log_event(f"Overtake! {overtaker_name} passes {other_name} for P{current_pos}")
-
-            self.previous_positions = current_positions.copy()
-            self.last_overtake_update = session_time_elapsed
-        # --- End Overtake Detection ---
+    def load_corner_data(self):
+        """Loads CornerData/<track>.json, if there is one, so incidents can name the corner."""
+        corner_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CornerData", f"{self.track_name}.json")
+        if not os.path.exists(corner_file_path):
+            self.engine.set_corners(None)
+            return
+        try:
+            with open(corner_file_path, 'r', encoding='utf-8') as f:
+                self.engine.set_corners(json.load(f))
+            self.output_signal.emit(f"Loaded corner data for track: {self.track_name}")
+        except Exception as e:
+            self.output_signal.emit(f"Error loading corner file {corner_file_path}: {e}")
 
     def format_time(self, elapsed_seconds):
         total_seconds = int(elapsed_seconds)
@@ -450,6 +312,7 @@ class DataCollector(QThread):
 
             if self.previous_session_type is not None:
                 self.output_signal.emit(f"Session changed from {session_names.get(self.previous_session_type, 'Unknown')} to {new_session_name}. Creating new output file.")
+                self.log_race_events(self.engine.flush()) # Into the old session's file
                 # --- Save map before changing file ---
                 self.save_participant_map()
                 # ------------------------------------
@@ -459,46 +322,20 @@ class DataCollector(QThread):
                 self.race_started = False
                 self.race_completed = False
                 self.race_start_system_time = None
-                self.previous_positions = {}
-                self.last_overtake_update = 0
                 self.last_leaderboard_time = 0
                 self.qualifying_positions_output = False
-                self.cars_in_accident = {}
-                self.cars_in_pits = set()
-                self.cars_ready_for_monitoring = set()
-                self.final_lap_announced = False
-                self.race_winner_announced = False
-                self.finished_drivers.clear()
-                self.timer_ended = False
+                self.engine.reset()
                 # --- Reset participant map capture/saved flags for new session ---
                 self.participant_map_captured = False
                 self.participant_map_saved = False
                 self.participant_map = {}
                 # ---------------------------------------------------------------
 
-                self.log_event(f"Session changed to {new_session_name}")
+                self.log_event(f"Session changed to {new_session_name}", kind=SESSION)
 
             self.session_type = current_session_type # Update current session type
             self.previous_session_type = self.session_type # Update previous for next check
 
-    def output_leaderboard(self, data, session_time_elapsed, label="Current positions"):
-        participants = []
-        for i in range(data.mNumParticipants):
-            if i >= len(data.mParticipantInfo): continue # Boundary check
-            participant_data = data.mParticipantInfo[i]
-            if not participant_data.mIsActive: continue
-            try:
-                driver_name = participant_data.mName.decode('utf-8').strip('\x00')
-                if not driver_name or driver_name.strip() == "" or driver_name == "Safety Car": continue
-            except: continue
-            position = participant_data.mRacePosition
-            # Only include valid positions in the leaderboard
-            if position > 0:
-                participants.append((position, driver_name))
-        participants.sort()
-        leaderboard_str = f"{label}: " + ", ".join(f"(P{pos}) {name}" for pos, name in participants)
-        self.log_event(leaderboard_str)
-
     # --- Added method to save the map ---
     def save_participant_map(self):
         if not self.participant_map_captured or self.participant_map_saved:
@@ -509,7 +346,7 @@ class DataCollector(QThread):
              return
 
         try:
-            directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Race Data")
+            directory = self.data_directory
             map_filename = f"{self.output_file_stem}_participants.json"
             map_filepath = os.path.join(directory, map_filename)
 
@@ -548,6 +385,7 @@ class DataCollector(QThread):
             if data.mTrackLocation:
                 try: self.track_name = data.mTrackLocation.decode('utf-8').strip('\x00')
                 except: self.track_name = "Unknown Track"
+                self.load_corner_data()
         else:
             # If no data on start, still need previous state set
             self.session_type = SESSION_INVALID
@@ -560,11 +398,16 @@ class DataCollector(QThread):
                 data = self.read_shared_memory()
                 if data:
                     self.process_participant_data(data)
+                elif self.memory_source.exhausted:
+                    # Recorded/synthetic stream has run out
+                    self.output_signal.emit("Memory source exhausted.")
+                    break
                 else:
                     # Handle case where memory becomes unreadable (e.g., game closed)
                     # Optionally add a check here to try reconnecting or just sleep
                     pass
-                time.sleep(0.2) # Main loop delay
+                if self.poll_interval:
+                    time.sleep(self.poll_interval) # Main loop delay
         except Exception as e:
             self.output_signal.emit(f"Error in data collection loop: {e}")
         finally:
@@ -574,6 +417,7 @@ class DataCollector(QThread):
                     self.output_signal.emit("Shared memory closed.")
                 except Exception as e_close:
                      self.output_signal.emit(f"Error closing shared memory: {e_close}")
+            self.log_race_events(self.engine.flush()) # Incidents still open when collection ends
             # --- Save map when stopping ---
             self.save_participant_map()
             # ------------------------------
@@ -584,3 +428,14 @@ class DataCollector(QThread):
         self.output_signal.emit("Stopping data collection...")
         self.running = False
         # Saving is handled in the finally block of run()
+
+
+def replay_recording(path, data_directory):
+    """Runs a recording (ams2_recorder) through the collector as fast as it will go and returns everything it output."""
+    from ams2_recorder import ReplayMemorySource # Recorder imports the memory sources, not the collector
+    collector = DataCollector(memory_source=ReplayMemorySource(path, speed=None))
+    collector.data_directory = data_directory
+    lines = []
+    collector.output_signal.connect(lines.append)
+    collector.run()
+    return lines
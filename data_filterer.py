@@ -1,11 +1,121 @@
 # data_filterer.py
 import os
+import re
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyQt5.QtCore import QThread, pyqtSignal
 from datetime import datetime, timedelta
-import anthropic
-from openai import OpenAI
-import google.generativeai as genai
+import llm_providers
+from llm_providers import BlockedResponse
+from llm_cache import get_response_cache
+from log_compactor import LogCompactor
+
+FILTER_SYSTEM_PROMPT = "You are a race data filterer that processes racing telemetry and events into a clean, organized format."
+
+# "HH:MM:SS - event" as written by the collectors
+TIMECODE_PATTERN = re.compile(r"^\s*(\d{1,2}):(\d{2}):(\d{2})\b")
+
+
+def parse_timecode(line):
+    """Seconds for a line starting with HH:MM:SS, or None."""
+    match = TIMECODE_PATTERN.match(line)
+    if not match:
+        return None
+    hours, minutes, seconds = (int(part) for part in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_timecode(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}"
+
+
+def split_into_windows(race_data, window_seconds, overlap_seconds):
+    """
+    Splits a race log into time windows at event-line boundaries. Each window covers
+    [start, start + window_seconds) plus overlap_seconds of the next one for context, so a
+    battle or accident that straddles the boundary is seen whole by one of them.
+    Lines without a timecode stay with the event above them; lines before the first event
+    (pre-race info, grid) go to the first window.
+
+    Returns a list of (start, end, text), where end is where the window's own events stop.
+    """
+    header = []
+    events = [] # (seconds, [lines])
+    for line in race_data.splitlines():
+        seconds = parse_timecode(line)
+        if seconds is not None:
+            events.append((seconds, [line]))
+        elif events:
+            events[-1][1].append(line)
+        elif line.strip():
+            header.append(line)
+    if not events:
+        return [(0, None, race_data)]
+
+    first, last = events[0][0], max(seconds for seconds, _lines in events)
+    windows = []
+    start = first
+    while start <= last:
+        end = start + window_seconds
+        lines = list(header) if not windows else []
+        for seconds, event_lines in events:
+            if start <= seconds < end + overlap_seconds:
+                lines.extend(event_lines)
+        windows.append((start, end, "\n".join(lines)))
+        start = end
+    windows[-1] = (windows[-1][0], None, windows[-1][2]) # The last window keeps everything to the end
+    return windows
+
+
+def _event_key(seconds, line):
+    """(seconds, event text without the timecode, case and spacing normalised) for spotting repeats."""
+    text = TIMECODE_PATTERN.sub("", line, count=1).lstrip(" -:")
+    return seconds, " ".join(text.split()).casefold()
+
+
+def merge_window_results(results):
+    """
+    Merges filtered windows [(start, end, text)] into one event list. Every line a window reports
+    for its own time range is kept, including separate events in the same second. Lines it
+    reports from outside its range (the overlap into the next window) are kept only if the owning
+    window didn't report the same event, matched on (seconds, normalised text), which also keeps
+    them when the owning window failed. Lines without a timecode stay with the event above them,
+    as in split_into_windows; ones before a window's first event are placed at the window's start.
+    """
+    owned = []
+    borrowed = []
+    for i, (start, end, text) in enumerate(results):
+        events = [] # (seconds, [line, untimed lines after it])
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            seconds = parse_timecode(line)
+            if seconds is not None:
+                events.append((seconds, [line.strip()]))
+            elif events:
+                events[-1][1].append(line.strip())
+            else:
+                events.append((start, [line.strip()]))
+        for seconds, lines in events:
+            if (i and seconds < start) or (end is not None and seconds >= end):
+                borrowed.append((seconds, lines)) # Another window's territory
+            else:
+                owned.append((seconds, lines))
+
+    seen = {_event_key(seconds, lines[0]) for seconds, lines in owned}
+    merged = list(owned)
+    for seconds, lines in borrowed:
+        key = _event_key(seconds, lines[0])
+        if key not in seen:
+            seen.add(key)
+            merged.append((seconds, lines))
+    merged.sort(key=lambda item: item[0]) # Stable: same-second events keep their order
+    return [line for _seconds, lines in merged for line in lines]
+
 
 class DataFilterer(QThread):
     output_signal = pyqtSignal(str)
@@ -18,18 +128,14 @@ class DataFilterer(QThread):
         self.output_path = None
         self.settings = settings
         self.prompt = prompt_content # Store the passed prompt content
-
-        # Initialize appropriate client based on settings
-        if self.settings["api"] == "claude":
-            self.client = anthropic.Anthropic(api_key=settings["claude_key"])
-        elif self.settings["api"] == "openai":
-            self.client = OpenAI(api_key=settings["openai_key"])
-        elif self.settings["api"] == "gemini":
-            self.client = None # No persistent client needed
-        else:
-             self.client = None
-
-        # Removed self.load_prompt call
+        # Long races are filtered in overlapping time windows, several at once
+        self.window_seconds = int(settings.get("window_minutes", 10) * 60)
+        self.overlap_seconds = int(settings.get("window_overlap_seconds", 60))
+        self.max_workers = int(settings.get("max_workers", 4))
+        self.window_retries = int(settings.get("window_retries", 2))
+        self.cache = get_response_cache()
+        self.token_usage = llm_providers.new_usage() # Summed over every window
+        self.usage_lock = threading.Lock()
 
     def run(self):
         self.output_signal.emit("Starting data filtering...")
@@ -47,19 +153,37 @@ class DataFilterer(QThread):
             if race_data is None:
                  raise Exception("Failed to read race data file.")
 
-            filtered_content = self.filter_race_data(race_data)
-            if not isinstance(filtered_content, str):
-                filtered_content = str(filtered_content)
-            self.progress_signal.emit(50)
+            if self.settings.get("compact_log", True):
+                # Every window is filtered on its own, so each one starts from a full leaderboard rather than
+                # changes since one only an earlier window saw. Compaction keeps the first event, so the
+                # windows of the compacted log start at the same times.
+                windows = split_into_windows(race_data, self.window_seconds, self.overlap_seconds)
+                compactor = LogCompactor()
+                race_data = compactor.compact(race_data, restarts=[start for start, _end, _text in windows[1:]])
+                self.output_signal.emit(compactor.summary())
+
+            windows = split_into_windows(race_data, self.window_seconds, self.overlap_seconds)
+            if len(windows) > 1:
+                processed_events = self.filter_windows(windows)
+                self.progress_signal.emit(75)
+            else:
+                filtered_content = self.filter_race_data(race_data)
+                if not isinstance(filtered_content, str):
+                    filtered_content = str(filtered_content)
+                self.progress_signal.emit(50)
 
-            processed_events = filtered_content.split('\n')
-            processed_events = [event for event in processed_events if event.strip()]
-            self.progress_signal.emit(75)
+                processed_events = filtered_content.split('\n')
+                processed_events = [event for event in processed_events if event.strip()]
+                self.progress_signal.emit(75)
 
             self.output_path = self.create_filtered_file(processed_events)
             self.progress_signal.emit(100)
 
             self.output_signal.emit(f"Filtered data saved to {self.output_path}")
+            if self.token_usage["input_tokens"]:
+                self.output_signal.emit(f"Filter API usage: {llm_providers.format_usage(self.token_usage)}")
+            if self.settings.get("use_cache", True) and self.cache.enabled:
+                self.output_signal.emit(self.cache.summary())
         except Exception as e:
             self.output_signal.emit(f"An error occurred: {str(e)}")
 
@@ -85,120 +209,83 @@ class DataFilterer(QThread):
 
     # Removed load_prompt method
 
-    def filter_race_data(self, race_data):
-        if self.settings["api"] == "claude":
-            return self._filter_with_claude(race_data)
-        elif self.settings["api"] == "openai":
-            return self._filter_with_openai(race_data)
-        elif self.settings["api"] == "gemini":
-            return self._filter_with_gemini(race_data)
-        else:
-            self.output_signal.emit(f"Error: Unknown API type '{self.settings['api']}'")
-            return ""
-
-    def _filter_with_claude(self, race_data):
-        if not self.client:
-             self.output_signal.emit("Error: Claude client not initialized.")
-             return ""
-        try:
-            message = self.client.messages.create(
-                model=self.settings["model"],
-                max_tokens=4000,
-                temperature=0.1,
-                # Use self.prompt (which holds the content)
-                messages=[
-                    {
-                        "role": "user",
-                        "content": f"{self.prompt}\n\nHere is the race data to filter:\n\n<race_data>\n{race_data}\n</race_data>"
-                    }
-                ]
-            )
-            content = message.content[0].text if isinstance(message.content, list) else message.content
-            return str(content) if content is not None else ""
+    def filter_windows(self, windows):
+        """Filters each window on a bounded worker pool, retrying failed windows, and merges the results."""
+        count = len(windows)
+        self.output_signal.emit(f"Race log split into {count} windows of {self.window_seconds // 60} min "
+                                f"({self.overlap_seconds}s overlap), filtering {min(self.max_workers, count)} at a time...")
+
+        results = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._filter_window, i, count, window): window for i, window in enumerate(windows)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                start, end, _text = futures[future]
+                filtered = future.result()
+                if filtered:
+                    results.append((start, end, filtered))
+                else:
+                    failed.append(format_timecode(start))
+                self.progress_signal.emit(10 + int(60 * done / count))
+
+        if failed:
+            self.output_signal.emit(f"Warning: {len(failed)} window(s) could not be filtered (starting {', '.join(sorted(failed))}).")
+        if not results:
+            raise Exception("No windows could be filtered.")
+        results.sort(key=lambda result: result[0])
+        return merge_window_results(results)
+
+    def _filter_window(self, index, count, window):
+        """Filters one window, retrying with backoff. Returns the filtered text, or "" if every attempt failed."""
+        start, end, text = window
+        until = format_timecode(end) if end is not None else "the finish"
+        section = (f"[This is part {index + 1} of {count} of the race, covering {format_timecode(start)} to {until}. "
+                   f"Only return events from this part; the race before and after is handled separately.]\n")
+        for attempt in range(self.window_retries + 1):
+            if attempt:
+                time.sleep(2 ** attempt)
+                self.output_signal.emit(f"Retrying window {index + 1}/{count} (attempt {attempt + 1})...")
+            try:
+                filtered = self.filter_race_data(section + text)
+            except Exception as e:
+                self.output_signal.emit(f"Error filtering window {index + 1}/{count}: {e}")
+                continue
+            if filtered and not filtered.startswith("Blocked by API"):
+                return filtered
+        return ""
 
-        except Exception as e:
-            self.output_signal.emit(f"Error in Claude filtering: {str(e)}")
-            return ""
-
-    def _filter_with_openai(self, race_data):
-        if not self.client:
-             self.output_signal.emit("Error: OpenAI client not initialized.")
-             return ""
+    def filter_race_data(self, race_data):
+        """Filters race_data, reusing the cached response for an identical request."""
+        if not self.settings.get("use_cache", True):
+            return self._filter_uncached(race_data)
+        filtered, from_cache = self.cache.cached(
+            ("DataFilterer", self.settings["api"], self.settings.get("model"), 0.1, self.prompt, race_data),
+            lambda: self._filter_uncached(race_data), self.output_signal.emit)
+        if from_cache:
+            self.output_signal.emit("Using cached filter response (identical request).")
+        return filtered
+
+    def _filter_uncached(self, race_data):
         try:
-            messages = []
-
-            if self.settings["model"].startswith(("o-", "o1-")):
-                 messages.append({
-                    "role": "user",
-                    # Use self.prompt (which holds the content)
-                    "content": f"You are a race data filterer that processes racing telemetry and events into a clean, organized format.\n\n{self.prompt}\n\nHere is the race data to filter:\n\n<race_data>\n{race_data}\n</race_data>"
-                })
-            else:
-                 messages.extend([
-                    {
-                        "role": "system",
-                        "content": "You are a race data filterer that processes racing telemetry and events into a clean, organized format."
-                    },
-                    {
-                        "role": "user",
-                        # Use self.prompt (which holds the content)
-                        "content": f"{self.prompt}\n\nHere is the race data to filter:\n\n<race_data>\n{race_data}\n</race_data>"
-                    }
-                ])
-
-            kwargs = {
-                "model": self.settings["model"],
-                "messages": messages
-            }
-            if not self.settings["model"].startswith(("o-", "o1-")):
-                kwargs.update({
-                    "temperature": 0.1,
-                    "max_tokens": 4000
-                })
-
-            response = self.client.chat.completions.create(**kwargs)
-            content = response.choices[0].message.content
-            return str(content) if content is not None else ""
-
+            # The filter prompt is the same for every window, so it goes in the (cached) system prompt
+            return llm_providers.complete(
+                self.settings, f"{FILTER_SYSTEM_PROMPT}\n\n{self.prompt}",
+                f"Here is the race data to filter:\n\n<race_data>\n{race_data}\n</race_data>",
+                temperature=0.1, max_tokens=4000, on_retry=self._on_retry, on_usage=self._on_usage)
+        except BlockedResponse as e:
+            self.output_signal.emit(f"Warning: Gemini response blocked. Reason: {e}")
+            return f"Blocked by API: {e}"
         except Exception as e:
-            self.output_signal.emit(f"Error in OpenAI filtering: {str(e)}")
+            self.output_signal.emit(f"Error in {self.settings.get('api')} filtering: {str(e)}")
             return ""
 
-    def _filter_with_gemini(self, race_data):
-        """Filters race data using the Google Gemini API."""
-        try:
-            api_key = self.settings.get("google_key")
-            if not api_key:
-                self.output_signal.emit("Error: Google API Key not found in settings.")
-                return ""
-
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(self.settings["model"])
-
-            # Use self.prompt (which holds the content)
-            full_prompt = f"{self.prompt}\n\nHere is the race data to filter:\n\n<race_data>\n{race_data}\n</race_data>"
-
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
-            response = model.generate_content(full_prompt, safety_settings=safety_settings)
-
-            if response.parts:
-                 return response.text
-            elif response.prompt_feedback.block_reason:
-                 block_reason = response.prompt_feedback.block_reason
-                 self.output_signal.emit(f"Warning: Gemini response blocked. Reason: {block_reason}")
-                 return f"Blocked by API: {block_reason}"
-            else:
-                 self.output_signal.emit("Warning: Gemini returned an empty response.")
-                 return ""
+    def _on_retry(self, attempt, delay, error):
+        self.output_signal.emit(f"API busy ({type(error).__name__}), retry {attempt} in {delay:.1f}s...")
 
-        except Exception as e:
-            self.output_signal.emit(f"Error in Gemini filtering: {str(e)}")
-            return ""
+    def _on_usage(self, usage):
+        with self.usage_lock:
+            llm_providers.add_usage(self.token_usage, usage)
+        self.output_signal.emit(f"Tokens: {llm_providers.format_usage(usage)}")
 
     def create_filtered_file(self, filtered_content):
         if not self.input_path or not os.path.exists(self.input_path):
@@ -0,0 +1,184 @@
+# event_bus.py
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+# Event kinds shared with race_state_engine, plus a few only the collectors produce
+from race_state_engine import (RACE_START, OVERTAKE, LEAD_CHANGE, LAPPED, PIT_IN, PIT_OUT, ACCIDENT, RECOVERED,
+                               BATTLE_START, BATTLE_INTENSIFY, BATTLE_END, LEADERBOARD, FINAL_LAP, WINNER, FINISH)
+SESSION = "session"
+LAP = "lap"
+INFO = "info"
+
+DEFAULT_PORT = 47600
+
+
+class EventBus:
+    """
+    In-process publish/subscribe for live race events.
+
+    Events are dicts: {'kind', 'session_ms', 'message', 'source', 'wall_time', ...extra data}.
+    Subscribers are called on the publishing thread, so they should hand off anything slow
+    (the socket server below queues per client). The subscriber list is copied on write, so
+    publish() doesn't take a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = () # ((token, callback, kinds), ...)
+        self._next_token = 0
+
+    def subscribe(self, callback, kinds=None):
+        """Calls callback(event) for every event (or only those whose kind is in kinds). Returns a token for unsubscribe()."""
+        with self._lock:
+            self._next_token += 1
+            token = self._next_token
+            self._subscribers = self._subscribers + ((token, callback, frozenset(kinds) if kinds else None),)
+        return token
+
+    def unsubscribe(self, token):
+        with self._lock:
+            self._subscribers = tuple(sub for sub in self._subscribers if sub[0] != token)
+
+    def publish(self, kind, message, session_ms=None, source=None, **data):
+        event = {'kind': kind, 'session_ms': session_ms, 'message': message, 'source': source,
+                 'wall_time': round(time.time(), 3)}
+        event.update(data)
+        for _token, callback, kinds in self._subscribers:
+            if kinds is None or kind in kinds:
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"Event bus subscriber error: {e}")
+        return event
+
+    def publish_race_event(self, event, source=None):
+        """Publishes a race_state_engine.RaceEvent."""
+        return self.publish(event.kind, event.message, int(event.time * 1000), source, **event.data)
+
+
+class EventBusServer:
+    """
+    Streams every bus event to localhost TCP clients as JSON lines, so overlays and other tools
+    can follow the race without reading the log file. Each client gets its own bounded queue and
+    sender thread; a client that falls behind loses events rather than slowing the collector.
+    """
+
+    def __init__(self, bus, host="127.0.0.1", port=DEFAULT_PORT, client_queue_size=1000):
+        self.bus = bus
+        self.host = host
+        self.port = port
+        self.client_queue_size = client_queue_size
+        self.clients = []
+        self.lock = threading.Lock()
+        self.server_socket = None
+        self.token = None
+        self.running = False
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if os.name != 'nt': # On Windows this would let another process share the port
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(8)
+        self.port = self.server_socket.getsockname()[1] # Real port when started with port 0
+        self.running = True
+        self.token = self.bus.subscribe(self._on_event)
+        threading.Thread(target=self._accept_loop, name="event-bus-accept", daemon=True).start()
+        return self
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _address = self.server_socket.accept()
+            except OSError:
+                break # Socket closed by stop()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = (conn, queue.Queue(self.client_queue_size))
+            with self.lock:
+                self.clients.append(client)
+            threading.Thread(target=self._send_loop, args=(client,), name="event-bus-client", daemon=True).start()
+
+    def _on_event(self, event):
+        if not self.clients:
+            return
+        line = (json.dumps(event, default=str) + "\n").encode('utf-8')
+        for _conn, client_queue in tuple(self.clients):
+            try:
+                client_queue.put_nowait(line)
+            except queue.Full:
+                pass # Slow client, drop the event for it
+
+    def _send_loop(self, client):
+        conn, client_queue = client
+        try:
+            while self.running:
+                line = client_queue.get()
+                if line is None:
+                    break
+                conn.sendall(line)
+        except OSError:
+            pass # Client disconnected
+        finally:
+            with self.lock:
+                if client in self.clients:
+                    self.clients.remove(client)
+            conn.close()
+
+    def stop(self):
+        self.running = False
+        if self.token is not None:
+            self.bus.unsubscribe(self.token)
+            self.token = None
+        if self.server_socket:
+            self.server_socket.close()
+            self.server_socket = None
+        with self.lock:
+            clients = list(self.clients)
+        for _conn, client_queue in clients:
+            try:
+                client_queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+
+# --- Process-wide bus ---
+_default_bus = None
+_default_server = None
+_default_lock = threading.Lock()
+
+
+def get_event_bus():
+    """
+    The bus shared by everything in this process. If RACE_EVENT_BUS_PORT is set the socket
+    server is started on that port the first time the bus is asked for (collectors do this when
+    they're created, so it also works when the collector runs in its own process).
+    """
+    global _default_bus, _default_server
+    with _default_lock:
+        if _default_bus is None:
+            _default_bus = EventBus()
+            port = os.environ.get("RACE_EVENT_BUS_PORT")
+            if port:
+                try:
+                    _default_server = EventBusServer(_default_bus, port=int(port)).start()
+                    print(f"Race event bus listening on 127.0.0.1:{_default_server.port}")
+                except (OSError, ValueError) as e:
+                    print(f"Could not start race event bus server on port {port}: {e}")
+        return _default_bus
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Follow a running collector: python event_bus.py [port]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    with socket.create_connection(("127.0.0.1", port)) as conn:
+        for line in conn.makefile('r', encoding='utf-8'):
+            event = json.loads(line)
+            session_ms = event.get('session_ms')
+            stamp = f"{session_ms / 1000:9.3f}" if session_ms is not None else "        -"
+            print(f"{stamp} {event['kind']:16s} {event['message']}")
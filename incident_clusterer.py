@@ -0,0 +1,136 @@
+# incident_clusterer.py
+import bisect
+
+
+class CornerIndex:
+    """
+    Corner lookups for a CornerData track file ([{name, start, end}] on the 0-1 spline),
+    sorted by start so each lookup is a bisect instead of a scan of every corner.
+    """
+
+    def __init__(self, corners=None):
+        self.starts = []
+        self.ends = []
+        self.names = []
+        self.wrapping = [] # (start, end, name) for corners that cross the start/finish line
+        for corner in sorted(corners or [], key=lambda c: float(c['start'])):
+            try:
+                start, end, name = float(corner['start']), float(corner['end']), corner['name']
+            except (KeyError, TypeError, ValueError):
+                continue # Skip malformed entries
+            if start > end:
+                self.wrapping.append((start, end, name))
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.names.append(name)
+
+    def __bool__(self):
+        return bool(self.names or self.wrapping)
+
+    def name_at(self, spline_position):
+        """Returns the corner name at spline_position, or None if it's not in a corner."""
+        i = bisect.bisect_right(self.starts, spline_position) - 1
+        if i >= 0 and spline_position <= self.ends[i]:
+            return self.names[i]
+        for start, end, name in self.wrapping:
+            if spline_position >= start or spline_position <= end:
+                return name
+        return None
+
+
+def _spline_distance(a, b):
+    """Distance between two spline positions, going whichever way round the lap is shorter."""
+    d = abs(a - b) % 1.0
+    return min(d, 1.0 - d)
+
+
+class IncidentClusterer:
+    """
+    Groups cars that stop or slow down close together in time and track position into one incident.
+
+    Collectors add() each car as it's detected and call flush() regularly; an incident is handed
+    back once no new car has joined it for `window` seconds. Open incidents are kept sorted by
+    spline position so each new car only checks its neighbours.
+
+    flush() returns a list of incidents: {'time', 'spline', 'corner', 'cars'} where cars is a list
+    of {'car', 'name', 'position'} in the order they were added.
+    """
+
+    def __init__(self, window=2.0, spline_radius=0.015, corner_index=None):
+        self.window = window
+        self.spline_radius = spline_radius # Fraction of a lap, 0.015 is ~75 m on a 5 km track
+        self.corner_index = corner_index or CornerIndex()
+        self.reset()
+
+    def reset(self):
+        self.open_splines = [] # Sorted spline anchors of open incidents
+        self.open_incidents = [] # Incidents in the same order as open_splines
+
+    def set_corners(self, corners):
+        self.corner_index = corners if isinstance(corners, CornerIndex) else CornerIndex(corners)
+
+    def add(self, car, name, position, spline_position, now):
+        """Adds a stopped/slow car, joining an open incident nearby if there is one."""
+        spline_position = spline_position % 1.0
+        incident = self._find(spline_position, now)
+        entry = {'car': car, 'name': name, 'position': position}
+        if incident is not None:
+            if all(existing['car'] != car for existing in incident['cars']):
+                incident['cars'].append(entry)
+            incident['last_time'] = now
+            return
+
+        incident = {'time': now, 'last_time': now, 'spline': spline_position,
+                    'corner': self.corner_index.name_at(spline_position), 'cars': [entry]}
+        i = bisect.bisect_left(self.open_splines, spline_position)
+        self.open_splines.insert(i, spline_position)
+        self.open_incidents.insert(i, incident)
+
+    def _find(self, spline_position, now):
+        count = len(self.open_splines)
+        if not count:
+            return None
+        i = bisect.bisect_left(self.open_splines, spline_position)
+        # Nearest neighbours either side; index -1 / count wrap round for the start/finish line
+        best = None
+        for j in (i - 1, i, (i + 1) % count, count - 1, 0):
+            if not 0 <= j < count:
+                continue
+            incident = self.open_incidents[j]
+            distance = _spline_distance(self.open_splines[j], spline_position)
+            if distance <= self.spline_radius and now - incident['last_time'] <= self.window:
+                if best is None or distance < best[0]:
+                    best = (distance, incident)
+        return best[1] if best else None
+
+    def flush(self, now, force=False):
+        """Returns incidents that nobody has joined for `window` seconds (or all of them with force)."""
+        if not self.open_incidents:
+            return []
+        done = []
+        keep_splines, keep_incidents = [], []
+        for spline, incident in zip(self.open_splines, self.open_incidents):
+            if force or now - incident['last_time'] >= self.window:
+                done.append(incident)
+            else:
+                keep_splines.append(spline)
+                keep_incidents.append(incident)
+        self.open_splines, self.open_incidents = keep_splines, keep_incidents
+        done.sort(key=lambda incident: incident['time'])
+        return done
+
+
+def describe_incident(incident, single_car="Accident! {name} has stopped from P{position}{where}"):
+    """
+    One log line per incident: single_car (formatted with name, position and where) for one car,
+    or "Accident! Collision involving A (P3), B (P5) and C (P7) at Turn 1!" for several cars.
+    """
+    location = f" at {incident['corner']}" if incident.get('corner') else ""
+    cars = incident['cars']
+    if len(cars) == 1:
+        car = cars[0]
+        return single_car.format(name=car['name'], position=car.get('position') or "?", where=location)
+
+    names = [f"{car['name']} (P{car['position']})" if car.get('position') else car['name'] for car in cars]
+    return f"Accident! Collision involving {', '.join(names[:-1])} and {names[-1]}{location}!"
@@ -0,0 +1,178 @@
+# llm_cache.py
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Cache", "llm")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def make_key(*parts):
+    """SHA-256 of the request parts (stage, provider, model, temperature, system prompt, user content...)."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Disk cache of LLM responses, content-addressed by make_key(), so re-running a stage on the
+    same input with the same prompt and model returns straight away instead of calling the API.
+
+    One file per response under <directory>/<key[:2]>/<key>.txt. A hit touches the file's mtime,
+    and once the cache is over max_bytes the least recently used files are removed. Safe to use
+    from several threads (the windowed DataFilterer does).
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.total_bytes = None # Measured on first store
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except OSError:
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+        try:
+            os.utime(path) # Most recently used
+        except OSError:
+            pass
+        with self.lock:
+            self.stats['hits'] += 1
+        return text
+
+    def put(self, key, text):
+        """Stores text under key. Raises OSError if it can't be written."""
+        path = self._path(key)
+        data = text.encode('utf-8')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path) # Readers never see a half-written response
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        with self.lock:
+            self.stats['stores'] += 1
+            if self.total_bytes is None:
+                self.total_bytes = self._measure()
+            else:
+                self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.txt'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _measure(self):
+        return sum(size for _mtime, size, _path in self._entries())
+
+    def _evict(self):
+        """Removes least recently used responses until the cache is back under 90% of max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _mtime, size, _path in entries)
+        target = self.max_bytes * 0.9
+        for _mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.stats['evictions'] += 1
+            except OSError:
+                pass
+        self.total_bytes = total
+
+    def cached(self, parts, generate, on_error=None):
+        """
+        Returns (response, from_cache): the cached response for parts, or what generate() returns,
+        which is then stored. Empty and blocked responses aren't stored. If storing fails,
+        on_error(message) is called and the response is still returned; without on_error the
+        OSError is raised. With the cache disabled this is just (generate(), False).
+        """
+        if not self.enabled:
+            return generate(), False
+        key = make_key(*parts)
+        text = self.get(key)
+        if text is not None:
+            return text, True
+        text = generate()
+        if isinstance(text, str) and text.strip() and not text.startswith("Blocked by API"):
+            try:
+                self.put(key, text)
+            except OSError as e:
+                if on_error is None:
+                    raise
+                on_error(f"LLM cache write failed: {e}")
+        return text, False
+
+    def clear(self):
+        with self.lock:
+            for _mtime, _size, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.total_bytes = 0
+
+    def summary(self):
+        stats = self.stats
+        lookups = stats['hits'] + stats['misses']
+        rate = f" ({stats['hits'] / lookups:.0%} hit rate)" if lookups else ""
+        return (f"LLM cache: {stats['hits']} hits, {stats['misses']} misses{rate}, "
+                f"{stats['stores']} stored, {stats['evictions']} evicted")
+
+
+# --- Process-wide cache ---
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The shared cache. LLM_CACHE=off disables it, LLM_CACHE_DIR / LLM_CACHE_MAX_MB override the defaults."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(os.environ.get("LLM_CACHE_DIR", DEFAULT_CACHE_DIR),
+                                   int(float(os.environ.get("LLM_CACHE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024))) * 1024 * 1024),
+                                   os.environ.get("LLM_CACHE", "on").lower() not in ("off", "0", "false", "no"))
+        return _cache
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python llm_cache.py [stats|clear]
+    cache = get_response_cache()
+    if len(sys.argv) > 1 and sys.argv[1] == "clear":
+        cache.clear()
+        print(f"Cleared {cache.directory}")
+    else:
+        entries = cache._entries()
+        print(f"{cache.directory}: {len(entries)} responses, {sum(e[1] for e in entries) / 1024:.0f} KiB "
+              f"(limit {cache.max_bytes / (1024 * 1024):.0f} MiB)")
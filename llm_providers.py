@@ -0,0 +1,381 @@
+# llm_providers.py
+import queue
+import random
+import threading
+import time
+import anthropic
+from openai import OpenAI
+import google.generativeai as genai
+
+# Requests in flight per provider, shared by every stage (the windowed DataFilterer, commentary, second pass...)
+DEFAULT_CONCURRENCY = {"claude": 4, "openai": 4, "gemini": 4, "mock": 4}
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0 # Seconds, doubled every retry plus up to the same again in jitter
+BACKOFF_MAX = 30.0
+
+SAFETY_CATEGORIES = ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH",
+                     "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]
+
+# Exception class names (from anthropic, openai, google.api_core and requests) worth retrying
+_RETRYABLE_NAMES = ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+                    "ResourceExhausted", "DeadlineExceeded", "ServiceUnavailable", "TooManyRequests",
+                    "Timeout", "TimeoutError", "ConnectionError")
+
+
+class ProviderError(Exception):
+    """Configuration problems (unknown provider, missing key) that retrying won't fix."""
+
+
+class BlockedResponse(Exception):
+    """The provider refused to answer (Gemini safety block); str(e) is the reason."""
+
+
+_lock = threading.Lock()
+_clients = {} # (provider, api_key) -> client
+_semaphores = {}
+_gemini_key = None
+_gemini_models = {} # model name -> GenerativeModel
+
+
+def set_concurrency(provider, limit):
+    """Changes the in-flight request limit for a provider (takes effect for new requests)."""
+    with _lock:
+        DEFAULT_CONCURRENCY[provider] = limit
+        _semaphores[provider] = threading.BoundedSemaphore(limit)
+
+
+def _semaphore(provider):
+    with _lock:
+        semaphore = _semaphores.get(provider)
+        if semaphore is None:
+            semaphore = _semaphores[provider] = threading.BoundedSemaphore(DEFAULT_CONCURRENCY.get(provider, 4))
+        return semaphore
+
+
+_KEY_NAMES = {"claude": "claude_key", "openai": "openai_key", "gemini": "google_key"}
+
+
+def _key(settings, provider):
+    if provider == "mock":
+        return None # Offline fake from mock_backends, no key needed
+    if provider not in _KEY_NAMES:
+        raise ProviderError(f"Unknown API type '{provider}'")
+    key = settings.get(_KEY_NAMES[provider])
+    if not key:
+        raise ProviderError(f"{provider.capitalize()} API key missing in settings.")
+    return key
+
+
+def get_client(settings):
+    """
+    The long-lived client for the settings' provider and key, created once and shared, so every
+    request reuses the SDK's connection pool. SDK retries are off: retries happen here instead.
+    """
+    global _gemini_key
+    provider = settings.get("api")
+    api_key = _key(settings, provider)
+    with _lock:
+        if provider == "mock":
+            return None
+        if provider == "gemini":
+            if _gemini_key != api_key:
+                genai.configure(api_key=api_key)
+                _gemini_key = api_key
+                _gemini_models.clear()
+            return None
+        client = _clients.get((provider, api_key))
+        if client is None:
+            if provider == "claude":
+                client = anthropic.Anthropic(api_key=api_key, max_retries=0)
+            else:
+                client = OpenAI(api_key=api_key, max_retries=0)
+            _clients[(provider, api_key)] = client
+        return client
+
+
+def _gemini_model(model_name):
+    with _lock:
+        model = _gemini_models.get(model_name)
+        if model is None:
+            model = _gemini_models[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+
+def is_retryable(error):
+    if isinstance(error, (ProviderError, BlockedResponse)):
+        return False
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return any(cls.__name__ in _RETRYABLE_NAMES for cls in type(error).__mro__)
+
+
+def backoff_delay(attempt):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay + random.uniform(0, delay) # Full jitter on top so parallel windows don't retry in lockstep
+
+
+def _is_o_model(model):
+    return model.startswith(("o-", "o1-"))
+
+
+# --- Prompt caching and token usage ---
+# The stable part of every request (filter prompt, persona prompt with its examples) goes first,
+# as the system prompt, and the race data after it. Claude caches the system prompt when it's
+# marked with cache_control; OpenAI and Gemini cache long shared prefixes on their own. Prompts
+# below the providers' minimum (about 1024 tokens) are simply not cached.
+
+def _claude_request(model, system, user, temperature, max_tokens, prompt_cache, cache_prefix=None):
+    content = user
+    if prompt_cache and cache_prefix and user.startswith(cache_prefix) and len(user) > len(cache_prefix):
+        # Second breakpoint after the shared start of the message (e.g. one race log for several personas)
+        content = [{"type": "text", "text": cache_prefix, "cache_control": {"type": "ephemeral"}},
+                   {"type": "text", "text": user[len(cache_prefix):]}]
+    kwargs = {"model": model, "max_tokens": max_tokens, "temperature": temperature,
+              "messages": [{"role": "user", "content": content}]}
+    if system:
+        if prompt_cache:
+            kwargs["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        else:
+            kwargs["system"] = system
+    return kwargs
+
+
+def new_usage(input_tokens=0, cached_tokens=0, cache_write_tokens=0, output_tokens=0):
+    """Token counts for one call. input_tokens includes the cached and cache-write tokens."""
+    return {"input_tokens": input_tokens or 0, "cached_tokens": cached_tokens or 0,
+            "cache_write_tokens": cache_write_tokens or 0, "output_tokens": output_tokens or 0}
+
+
+def _claude_usage(usage):
+    if usage is None:
+        return new_usage()
+    cached = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    written = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+    return new_usage((usage.input_tokens or 0) + cached + written, cached, written, usage.output_tokens)
+
+
+def _openai_usage(usage):
+    if usage is None:
+        return new_usage()
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return new_usage(usage.prompt_tokens, getattr(details, 'cached_tokens', 0), 0, usage.completion_tokens)
+
+
+def _gemini_usage(response):
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return new_usage()
+    return new_usage(getattr(usage, 'prompt_token_count', 0), getattr(usage, 'cached_content_token_count', 0), 0,
+                  getattr(usage, 'candidates_token_count', 0))
+
+
+def add_usage(total, usage):
+    """Adds one call's counts into total (a new_usage() dict) and returns it."""
+    for name, count in usage.items():
+        total[name] = total.get(name, 0) + count
+    return total
+
+
+def format_usage(usage):
+    """'12,400 input tokens (10,200 cached, 82%), 950 output' for the stage consoles."""
+    total, cached = usage["input_tokens"], usage["cached_tokens"]
+    text = f"{total:,} input tokens ({cached:,} cached"
+    if total:
+        text += f", {cached / total:.0%}"
+    text += ")"
+    if usage["cache_write_tokens"]:
+        text += f", {usage['cache_write_tokens']:,} written to cache"
+    return text + f", {usage['output_tokens']:,} output"
+
+
+def _openai_request(model, system, user, temperature, max_tokens):
+    if _is_o_model(model):
+        # 'O' models: no system role, temperature or max_tokens
+        content = f"{system}\n\n{user}" if system else user
+        return {"model": model, "messages": [{"role": "user", "content": content}]}
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": user})
+    return {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+
+
+def _gemini_request(system, user, temperature, safety_threshold):
+    prompt = f"{system}\n\n{user}" if system else user
+    safety_settings = [{"category": category, "threshold": safety_threshold} for category in SAFETY_CATEGORIES]
+    return prompt, genai.types.GenerationConfig(temperature=temperature), safety_settings
+
+
+def _gemini_block_reason(response):
+    feedback = getattr(response, 'prompt_feedback', None)
+    return feedback.block_reason if feedback and feedback.block_reason else None
+
+
+def _complete_once(settings, system, user, temperature, max_tokens, safety_threshold, cache_prefix=None):
+    """Returns (text, usage)."""
+    provider, model = settings.get("api"), settings.get("model")
+    client = get_client(settings)
+    if provider == "mock":
+        from mock_backends import mock_llm
+        return mock_llm.complete(settings, system, user, max_tokens)
+    if provider == "claude":
+        response = client.messages.create(**_claude_request(model, system, user, temperature, max_tokens,
+                                                            settings.get("prompt_cache", True), cache_prefix))
+        text = "".join(block.text for block in response.content if getattr(block, 'text', None))
+        return text, _claude_usage(getattr(response, 'usage', None))
+    if provider == "openai":
+        response = client.chat.completions.create(**_openai_request(model, system, user, temperature, max_tokens))
+        text = (response.choices[0].message.content or "") if response.choices else ""
+        return text, _openai_usage(getattr(response, 'usage', None))
+    prompt, generation_config, safety_settings = _gemini_request(system, user, temperature, safety_threshold)
+    response = _gemini_model(model).generate_content(prompt, generation_config=generation_config, safety_settings=safety_settings)
+    block_reason = _gemini_block_reason(response)
+    if block_reason:
+        raise BlockedResponse(block_reason)
+    try:
+        text = response.text if response.parts else ""
+    except ValueError:
+        text = "" # No text parts (e.g. finished for safety without a prompt block)
+    return text, _gemini_usage(response)
+
+
+def complete(settings, system, user, temperature=0.7, max_tokens=4000, safety_threshold="BLOCK_MEDIUM_AND_ABOVE",
+             on_retry=None, on_usage=None, cache_prefix=None):
+    """
+    One request to the provider in settings ('api', 'model' and its key), returning the full text.
+    Waits for a slot under the provider's concurrency limit and retries rate limits, timeouts and
+    server errors with exponential backoff and jitter. on_retry(attempt, delay, error) is called
+    before each retry, on_usage(usage) with the call's token counts (see format_usage()).
+    The system prompt is marked for prompt caching unless settings has 'prompt_cache' off, and so
+    is cache_prefix, if given: the start of user that other requests share.
+    Raises BlockedResponse if Gemini blocks the prompt.
+    """
+    attempt = 0
+    while True:
+        try:
+            with _semaphore(settings.get("api")):
+                text, usage = _complete_once(settings, system, user, temperature, max_tokens, safety_threshold, cache_prefix)
+            if on_usage:
+                on_usage(usage)
+            return text
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt)
+            attempt += 1
+            if on_retry:
+                on_retry(attempt, delay, e)
+            time.sleep(delay)
+
+
+def _stream_once(settings, system, user, temperature, max_tokens, safety_threshold, usage_out, cache_prefix=None):
+    """Yields text chunks, then fills usage_out with the call's token counts."""
+    provider, model = settings.get("api"), settings.get("model")
+    client = get_client(settings)
+    if provider == "mock":
+        from mock_backends import mock_llm
+        yield from mock_llm.stream(settings, system, user, max_tokens, usage_out)
+        return
+    if provider == "claude":
+        request = _claude_request(model, system, user, temperature, max_tokens, settings.get("prompt_cache", True), cache_prefix)
+        with client.messages.stream(**request) as stream:
+            for text in stream.text_stream:
+                yield text
+            usage_out.update(_claude_usage(getattr(stream.get_final_message(), 'usage', None)))
+        return
+    if provider == "openai":
+        request = _openai_request(model, system, user, temperature, max_tokens)
+        for chunk in client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, 'usage', None):
+                usage_out.update(_openai_usage(chunk.usage)) # Final chunk, no choices
+        return
+    prompt, generation_config, safety_settings = _gemini_request(system, user, temperature, safety_threshold)
+    response = _gemini_model(model).generate_content(prompt, generation_config=generation_config,
+                                                     safety_settings=safety_settings, stream=True)
+    produced = False
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue # Chunk without text (e.g. safety ratings only)
+        if text:
+            produced = True
+            yield text
+    if not produced:
+        block_reason = _gemini_block_reason(response)
+        if block_reason:
+            raise BlockedResponse(block_reason)
+    usage_out.update(_gemini_usage(response))
+
+
+_STREAM_END = object()
+
+
+def _read_stream(settings, args, chunks, stop):
+    """
+    Reads one streamed response into the chunks queue, ending with _STREAM_END or the exception.
+    Runs on its own thread so the provider's concurrency slot is held only while the response is
+    being read, not while the caller is busy with the chunks (e.g. blocked on a full TTS queue).
+    """
+    try:
+        with _semaphore(settings.get("api")):
+            source = _stream_once(settings, *args)
+            try:
+                for text in source:
+                    if stop.is_set():
+                        break # The caller stopped reading
+                    chunks.put(text)
+            finally:
+                source.close()
+        chunks.put(_STREAM_END)
+    except Exception as e:
+        chunks.put(e)
+
+
+def _buffered_stream(settings, *args):
+    """Yields the chunks of _stream_once(settings, *args) as _read_stream reads them."""
+    chunks = queue.Queue() # Unbounded: a response is at most max_tokens long
+    stop = threading.Event()
+    threading.Thread(target=_read_stream, args=(settings, args, chunks, stop), daemon=True).start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def stream(settings, system, user, temperature=0.7, max_tokens=4000, safety_threshold="BLOCK_MEDIUM_AND_ABOVE",
+           on_retry=None, on_usage=None, cache_prefix=None):
+    """
+    Like complete() but yields the response text as it arrives (on_usage is called once the
+    stream has finished). The concurrency slot is released as soon as the response has been
+    read, however slowly the caller consumes it. A failure before the first chunk is retried the
+    same way; once text has been yielded an error is raised to the caller, since it can't be
+    taken back.
+    """
+    attempt = 0
+    while True:
+        started = False
+        usage = new_usage()
+        try:
+            for text in _buffered_stream(settings, system, user, temperature, max_tokens, safety_threshold,
+                                         usage, cache_prefix):
+                started = True
+                yield text
+            if on_usage:
+                on_usage(usage)
+            return
+        except Exception as e:
+            if started or attempt >= MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt)
+            attempt += 1
+            if on_retry:
+                on_retry(attempt, delay, e)
+            time.sleep(delay)
@@ -0,0 +1,241 @@
+# log_compactor.py
+import re
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _ENCODING = None
+
+# "HH:MM:SS - event" as written by the collectors
+LINE_PATTERN = re.compile(r"^(\d{1,2}):(\d{2}):(\d{2}) - (.*)$")
+LEADERBOARD_PATTERN = re.compile(r"^(Current positions|Qualifying positions|[A-Za-z ]*positions): (\(P\d+\) .*)$")
+LEADERBOARD_ENTRY = re.compile(r"\(P(\d+)\) (.+?)(?=, \(P\d+\) |$)")
+# ACC: "A overtook B for position 5 at Turn 1."  AMS2/AC: "A passes B for P5 at Turn 1."
+OVERTAKE_PATTERN = re.compile(r"^Overtake! (?P<overtaker>.+?) (?:passes|overtook) (?P<overtaken>.+?) "
+                              r"for (?:P|position )(?P<position>\d+)(?: at (?P<corner>.+?))?\.?$")
+PIT_IN_PATTERN = re.compile(r"^(?P<driver>.+) has entered the pits\.?$")
+PIT_OUT_PATTERN = re.compile(r"^(?P<driver>.+) has exited the pits\.?$")
+
+
+def estimate_tokens(text):
+    """Token count with tiktoken when it's installed, otherwise the usual ~4 characters per token."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def format_timecode(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}"
+
+
+class _Line:
+    __slots__ = ('time', 'message', 'raw')
+
+    def __init__(self, time, message, raw):
+        self.time = time # Seconds, None for lines without a timecode (headers)
+        self.message = message
+        self.raw = raw
+
+    def text(self):
+        return self.raw if self.time is None else f"{format_timecode(self.time)} - {self.message}"
+
+
+def _parse(text):
+    lines = []
+    for raw in text.splitlines():
+        if not raw.strip():
+            continue
+        match = LINE_PATTERN.match(raw.strip())
+        if match:
+            hours, minutes, seconds, message = match.groups()
+            lines.append(_Line(int(hours) * 3600 + int(minutes) * 60 + int(seconds), message.strip(), raw))
+        else:
+            lines.append(_Line(None, raw, raw))
+    return lines
+
+
+class LogCompactor:
+    """
+    Rule-based compaction of a collector race log before it goes to the filterer LLM. Nothing is
+    invented and every kept line keeps its timecode; only repetition is removed:
+
+    - identical lines repeated within duplicate_window seconds are dropped,
+    - a pit entry and the matching exit become one "X pits (34s)." line at the entry time,
+    - three or more back-and-forth passes between the same two cars within swap_window seconds
+      of each other become one summary line at the first pass,
+    - after the first leaderboard of each kind, later ones only list the position changes. The
+      first leaderboard after each of compact()'s restarts is kept in full again.
+    """
+
+    def __init__(self, swap_window=60, min_swaps=3, pit_window=600, duplicate_window=5):
+        self.swap_window = swap_window
+        self.min_swaps = min_swaps
+        self.pit_window = pit_window
+        self.duplicate_window = duplicate_window
+        self.stats = {}
+
+    def compact(self, text, restarts=()):
+        """
+        Returns the compacted log. self.stats then holds what was done and the size before and after.
+        restarts are times (seconds) from which leaderboards are compared afresh, e.g. the start of
+        each filter window, so a part of the log read on its own still begins with a full leaderboard.
+        """
+        lines = _parse(text)
+        self.stats = {'lines_before': len(lines), 'tokens_before': estimate_tokens(text),
+                      'duplicates': 0, 'pit_stops': 0, 'swap_runs': 0, 'leaderboards': 0}
+        lines = self._drop_duplicates(lines)
+        lines = self._merge_pit_stops(lines)
+        lines = self._collapse_swaps(lines)
+        lines = self._condense_leaderboards(lines, sorted(restarts))
+        result = "\n".join(line.text() for line in lines) + "\n"
+        self.stats['lines_after'] = len(lines)
+        self.stats['tokens_after'] = estimate_tokens(result)
+        return result
+
+    def summary(self):
+        stats = self.stats
+        before, after = stats['tokens_before'], stats['tokens_after']
+        saved = f" (-{1 - after / before:.0%})" if before else ""
+        return (f"Compacted log: {stats['lines_before']} -> {stats['lines_after']} lines, "
+                f"~{before:,} -> ~{after:,} tokens{saved}; {stats['swap_runs']} swap runs, "
+                f"{stats['pit_stops']} pit stops, {stats['leaderboards']} leaderboards condensed, "
+                f"{stats['duplicates']} duplicates dropped")
+
+    # --- Rules ---
+    def _drop_duplicates(self, lines):
+        kept = []
+        last_seen = {} # message -> time it was last kept
+        for line in lines:
+            if line.time is not None:
+                seen = last_seen.get(line.message)
+                if seen is not None and line.time - seen <= self.duplicate_window:
+                    self.stats['duplicates'] += 1
+                    continue
+                last_seen[line.message] = line.time
+            kept.append(line)
+        return kept
+
+    def _merge_pit_stops(self, lines):
+        dropped = set()
+        open_stops = {} # driver -> index of the entry line
+        for i, line in enumerate(lines):
+            if line.time is None:
+                continue
+            match = PIT_IN_PATTERN.match(line.message)
+            if match:
+                driver = match.group('driver')
+                if driver in open_stops:
+                    dropped.add(i) # Entered again without exiting: flicker, keep the first entry
+                    self.stats['duplicates'] += 1
+                else:
+                    open_stops[driver] = i
+                continue
+            match = PIT_OUT_PATTERN.match(line.message)
+            if match and match.group('driver') in open_stops:
+                entry = lines[open_stops.pop(match.group('driver'))]
+                duration = line.time - entry.time
+                if duration <= self.pit_window:
+                    entry.message = f"{match.group('driver')} pits ({duration}s in the pit lane)."
+                    dropped.add(i)
+                    self.stats['pit_stops'] += 1
+        return [line for i, line in enumerate(lines) if i not in dropped]
+
+    def _collapse_swaps(self, lines):
+        passes = [] # (index, overtaker, overtaken, position)
+        for i, line in enumerate(lines):
+            if line.time is None:
+                continue
+            match = OVERTAKE_PATTERN.match(line.message)
+            # Multi-car passes ("passes A, B and C") aren't part of a two-car swap
+            if match and ", " not in match.group('overtaken'):
+                passes.append((i, match.group('overtaker'), match.group('overtaken'), int(match.group('position'))))
+
+        # Runs of passes between one pair where each pass undoes the one before
+        runs = []
+        current = {} # frozenset(pair) -> run (list of passes)
+        for item in passes:
+            _i, overtaker, overtaken, _position = item
+            pair = frozenset((overtaker, overtaken))
+            run = current.get(pair)
+            if run and run[-1][1] == overtaken and lines[item[0]].time - lines[run[-1][0]].time <= self.swap_window:
+                run.append(item)
+            else:
+                run = current[pair] = [item]
+                runs.append(run)
+
+        dropped = set()
+        for run in runs:
+            if len(run) < self.min_swaps:
+                continue
+            first, last = lines[run[0][0]], lines[run[-1][0]]
+            positions = sorted({item[3] for item in run})
+            place = f"P{positions[0]}" if len(positions) == 1 else "positions " + "/".join(f"P{p}" for p in positions)
+            first.message = (f"Overtake! {run[0][1]} and {run[0][2]} swap {place} back and forth {len(run)} times "
+                             f"between {format_timecode(first.time)} and {format_timecode(last.time)}, "
+                             f"{run[-1][1]} ends up ahead.")
+            dropped.update(item[0] for item in run[1:])
+            self.stats['swap_runs'] += 1
+        return [line for i, line in enumerate(lines) if i not in dropped]
+
+    def _condense_leaderboards(self, lines, restarts):
+        previous = {} # label -> (time, {driver: position}, leader)
+        pending = list(restarts)
+        for line in lines:
+            if line.time is None:
+                continue
+            if pending and line.time >= pending[0]:
+                previous.clear()
+                while pending and line.time >= pending[0]:
+                    pending.pop(0)
+            match = LEADERBOARD_PATTERN.match(line.message)
+            if not match:
+                continue
+            label = match.group(1)
+            order = {name.strip(): int(position) for position, name in LEADERBOARD_ENTRY.findall(match.group(2))}
+            leader = next((name for name, position in order.items() if position == 1), None)
+            last = previous.get(label)
+            previous[label] = (line.time, order, leader)
+            if last is None:
+                continue # The first leaderboard of each kind (since the last restart) stays in full
+            last_time, last_order, _last_leader = last
+            changes = [f"{name} P{last_order[name]}->P{position}"
+                       for name, position in sorted(order.items(), key=lambda item: item[1])
+                       if name in last_order and last_order[name] != position]
+            changes += [f"{name} joins at P{position}" for name, position in order.items() if name not in last_order]
+            changes += [f"{name} no longer listed (was P{position})" for name, position in last_order.items() if name not in order]
+            since = format_timecode(last_time)
+            if changes:
+                condensed = f"{label} (changes since {since}, leader {leader}): {', '.join(changes)}"
+            else:
+                condensed = f"{label} unchanged since {since}, leader {leader}."
+            if len(condensed) < len(line.message):
+                line.message = condensed
+                self.stats['leaderboards'] += 1
+        return lines
+
+
+def compact_log(text, **options):
+    """Compacts text with a LogCompactor(**options). Returns (compacted_text, stats)."""
+    compactor = LogCompactor(**options)
+    return compactor.compact(text), compactor.stats
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    # python log_compactor.py <race log>... [--write]  (writes <name>_compact.txt next to each log)
+    write = "--write" in sys.argv
+    for path in [arg for arg in sys.argv[1:] if arg != "--write"]:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            compactor = LogCompactor()
+            compacted = compactor.compact(f.read())
+        print(f"{os.path.basename(path)}: {compactor.summary()}")
+        if write:
+            out_path = f"{os.path.splitext(path)[0]}_compact.txt"
+            with open(out_path, 'w', encoding='utf-8') as f:
+                f.write(compacted)
+            print(f"  -> {out_path}")
@@ -1,5 +1,6 @@
 # main.py
 import sys
+import multiprocessing # Collector host process (collector_host.py)
 import os # Added for path joining
 import time # Keep for potential fallback, but QTimer is preferred
 from PyQt5.QtWidgets import QApplication, QSplashScreen
@@ -56,4 +57,5 @@ def main():
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Needed for the collector process in frozen Windows builds
     main()
\ No newline at end of file
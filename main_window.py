@@ -24,8 +24,9 @@ from prompt_manager import PromptManager
 from data_collector_ACC import DataCollector as DataCollectorACC
 from data_collector_AMS2 import DataCollector as DataCollectorAMS2
 from data_collector_AC import DataCollector as DataCollectorAC
+from collector_host import CollectorHost
 from data_filterer import DataFilterer
-from race_commentator import RaceCommentator
+from race_commentator import RaceCommentator, LinePipeline, CommentaryBatch
 from voice_generator import VoiceGenerator
 from ams2_director import AMS2Director
 from cartesia import Cartesia
@@ -76,6 +77,7 @@ class MainWindow(QMainWindow):
         self.data_collector = None
         self.data_filterer = None
         self.race_commentator = None
+        self.commentary_batch = None
         self.voice_generator = None
         self.ams2_director = None
         # ---------------------------
@@ -206,7 +208,11 @@ class MainWindow(QMainWindow):
             elif sim_name == "Assetto Corsa": CollectorClass = DataCollectorAC
             else: raise ValueError(f"Unknown sim: {sim_name}")
 
-            self.data_collector = CollectorClass()
+            if self.settings.value("collector_process", False, type=bool):
+                self.data_collector = CollectorHost(sim_name) # Collector loop in its own process
+                self.data_collector.batch_signal.connect(self.update_console_batch)
+            else:
+                self.data_collector = CollectorClass()
             self.data_collector.output_signal.connect(self.update_console)
             self.data_collector.progress_signal.connect(self.update_progress_bar)
             self.data_collector.finished.connect(self.on_data_collector_finished)
@@ -262,8 +268,8 @@ class MainWindow(QMainWindow):
             self.update_console(f"Error starting filter thread: {e}\n{traceback.format_exc()}")
             self.highlight_reel_tab.filter_button.setEnabled(True) # Ensure enabled on error
 
-    def start_commentary_generation(self, input_path: str, commentator_name: str):
-        """Starts the commentary generation process."""
+    def start_commentary_generation(self, input_path: str, commentator_name: str, voice_pipeline: bool = False):
+        """Starts the commentary generation process (optionally with voice generation fed line by line)."""
         if self.race_commentator and self.race_commentator.isRunning():
              QMessageBox.warning(self, "Busy", "Commentary generation already running.")
              return
@@ -289,35 +295,104 @@ class MainWindow(QMainWindow):
         try:
             self.race_commentator = RaceCommentator(input_path, settings)
             self.race_commentator.output_signal.connect(self.commentary_tab.update_output) # Send output direct to tab
-            self.race_commentator.progress_signal.connect(self.update_progress_bar)
+            self.race_commentator.line_signal.connect(self.commentary_tab.update_output) # Commentary lines as they stream in
+            pipelined = False
+            if voice_pipeline:
+                # Voice starts on each line as it's written; the voice stage reads the commentary output file's path
+                line_pipeline = LinePipeline()
+                pipelined = self.start_voice_generation(self.race_commentator.create_output_file(), commentator_name, line_pipeline)
+                if pipelined:
+                    self.race_commentator.line_pipeline = line_pipeline
+                else:
+                    self.update_console("Voice pipeline not started, generating commentary only.")
+            if not pipelined: # In pipeline mode the progress bar follows the voice stage
+                self.race_commentator.progress_signal.connect(self.update_progress_bar)
             self.race_commentator.finished.connect(self.on_commentary_finished)
             self.race_commentator.start()
             self.update_console(f"Generating commentary for '{os.path.basename(input_path)}' using '{commentator_name}'...")
             self.commentary_tab.generate_button.setEnabled(False)
         except Exception as e:
+            if self.race_commentator and self.race_commentator.line_pipeline:
+                self.race_commentator.line_pipeline.finish() # Let the waiting voice stage end
             QMessageBox.critical(self, "Error", f"Failed starting commentary: {str(e)}")
             self.update_console(f"Error starting commentary thread: {e}\n{traceback.format_exc()}")
             self.commentary_tab.generate_button.setEnabled(True)
 
 
-    def start_voice_generation(self, input_path: str, commentator_name: str):
-        """Starts the voice generation process."""
+    def start_commentary_batch(self, input_path: str, commentator_names: list):
+        """Generates commentary from one filtered log for several commentators at once (one file each)."""
+        if (self.race_commentator and self.race_commentator.isRunning()) or (self.commentary_batch and self.commentary_batch.isRunning()):
+             QMessageBox.warning(self, "Busy", "Commentary generation already running.")
+             return
+
+        base_settings = self.get_race_commentator_settings()
+        if not self._check_api_key(base_settings["api"], base_settings): return
+
+        persona_settings = {}
+        for name in commentator_names:
+            meta = self.commentator_manager.get_commentator_metadata(name)
+            prompt = self.commentator_manager.get_prompt(name, second_pass=False)
+            if not meta or prompt is None:
+                self.update_console(f"Skipping '{name}': cannot load its metadata or prompt.")
+                continue
+            settings = dict(base_settings)
+            settings.update({
+                'main_prompt': prompt, 'main_voice_id': meta.voice_id,
+                'commentator_name': meta.name, 'commentator_style': meta.style,
+                'commentator_personality': meta.personality, 'commentator_examples': meta.examples,
+            })
+            persona_settings[name] = settings
+        if not persona_settings:
+            QMessageBox.warning(self, "Batch Commentary", "None of the selected commentators could be loaded.")
+            return
+
+        try:
+            self.commentary_batch = CommentaryBatch(input_path, persona_settings)
+            self.commentary_batch.output_signal.connect(self.commentary_tab.update_output)
+            self.commentary_batch.progress_signal.connect(self.update_progress_bar)
+            self.commentary_batch.finished.connect(self.on_commentary_batch_finished)
+            self.commentary_batch.start()
+            self.update_console(f"Generating commentary for '{os.path.basename(input_path)}' with {len(persona_settings)} commentators...")
+            self.commentary_tab.generate_button.setEnabled(False)
+            self.commentary_tab.batch_button.setEnabled(False)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed starting batch commentary: {str(e)}")
+            self.update_console(f"Error starting batch commentary thread: {e}\n{traceback.format_exc()}")
+            self.commentary_tab.generate_button.setEnabled(True)
+            self.commentary_tab.batch_button.setEnabled(True)
+
+    def on_commentary_batch_finished(self):
+        self.update_console("Batch commentary thread finished.")
+        if self.commentary_batch:
+            written = [path for path in self.commentary_batch.output_paths.values() if path]
+            if written:
+                self.last_commentary_output_path = written[0]
+                self.voice_tab.set_input_path(written[0])
+            self.update_console(f"Batch commentary: {len(written)}/{len(self.commentary_batch.persona_settings)} files written.")
+        self.commentary_batch = None
+        self.progress_bar.setValue(0)
+        self.commentary_tab.generate_button.setEnabled(True)
+        self.commentary_tab.batch_button.setEnabled(True)
+
+
+    def start_voice_generation(self, input_path: str, commentator_name: str, line_pipeline=None) -> bool:
+        """Starts the voice generation process. With line_pipeline, first pass lines come from a running RaceCommentator."""
         if self.voice_generator and self.voice_generator.isRunning():
              QMessageBox.warning(self, "Busy", "Voice generation already running.")
-             return
+             return False
 
         cartesia_key = self.get_cartesia_api_key()
         if not cartesia_key:
              QMessageBox.warning(self, "API Key Missing", "Enter Cartesia API key in Settings.")
-             return
+             return False
 
         metadata = self.commentator_manager.get_commentator_metadata(commentator_name)
         if not metadata:
              QMessageBox.warning(self, "Metadata Error", f"Cannot load metadata for '{commentator_name}'.")
-             return
+             return False
         if not metadata.voice_id:
              QMessageBox.warning(self, "Voice ID Missing", f"'{commentator_name}' has no Cartesia Voice ID.")
-             return
+             return False
 
         cartesia_model = self.settings.value("cartesia_model", "sonic-english")
         commentary_api_settings = self.get_race_commentator_settings() # For second pass
@@ -329,13 +404,17 @@ class MainWindow(QMainWindow):
         # Check API key for second pass ONLY if second pass prompt exists
         if second_pass_prompt and not self._check_api_key(commentary_api_settings['api'], commentary_api_settings):
             QMessageBox.warning(self, "API Key Missing", f"Second pass requires {commentary_api_settings['api'].capitalize()} key (set in Settings).")
-            return
+            return False
 
         try:
             self.voice_generator = VoiceGenerator(
                 input_path=input_path, api_key=cartesia_key, voice_id=metadata.voice_id,
                 speed=metadata.voice_speed, emotion=metadata.voice_emotions,
-                model_id=cartesia_model, commentary_api_settings=commentary_api_settings
+                model_id=cartesia_model, commentary_api_settings=commentary_api_settings,
+                line_pipeline=line_pipeline,
+                tts_concurrency=self.settings.value("tts_concurrency", 4, type=int),
+                requests_per_second=self.settings.value("tts_requests_per_second", 0.0, type=float),
+                use_cache=self.settings.value("tts_cache_enabled", True, type=bool)
             )
             self.voice_generator.output_signal.connect(self.voice_tab.update_output) # Output direct to tab
             self.voice_generator.progress_signal.connect(self.update_progress_bar)
@@ -343,10 +422,12 @@ class MainWindow(QMainWindow):
             self.voice_generator.start()
             self.update_console(f"Generating voice using '{commentator_name}' (ID: {metadata.voice_id}, Model: {cartesia_model})...");
             self.voice_tab.generate_button.setEnabled(False)
+            return True
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed starting voice gen: {str(e)}")
             self.update_console(f"Error starting voice gen thread: {e}\n{traceback.format_exc()}")
             self.voice_tab.generate_button.setEnabled(True)
+            return False
 
     def start_auto_director(self, game: str, script_path: str, audio_path: str, map_path: str, pre_roll: int) -> bool:
         """Starts the Auto Director thread."""
@@ -499,6 +580,11 @@ class MainWindow(QMainWindow):
         else:
             print(f"Console log (UI target missing): {text}") # Fallback
 
+    def update_console_batch(self, lines):
+        """Appends a batch of lines (from the collector process) with a single widget update."""
+        if lines:
+            self.update_console("\n".join(str(line) for line in lines))
+
     def update_video_log_display(self, text):
         """Appends event to the dedicated video log display in SetupTab."""
         if hasattr(self.setup_tab, 'video_log_display') and self.setup_tab.video_log_display:
@@ -526,7 +612,9 @@ class MainWindow(QMainWindow):
             "model": self.settings.value("data_filterer_model", "gemini-1.5-flash-latest"),
             "claude_key": self.get_claude_api_key(),
             "openai_key": self.get_openai_api_key(),
-            "google_key": self.get_google_api_key()
+            "google_key": self.get_google_api_key(),
+            "use_cache": self.settings.value("llm_cache_enabled", True, type=bool),
+            "compact_log": self.settings.value("log_compaction", True, type=bool)
         }
 
     def get_race_commentator_settings(self):
@@ -536,7 +624,9 @@ class MainWindow(QMainWindow):
             "model": self.settings.value("race_commentator_model", "gemini-1.5-flash-latest"),
             "claude_key": self.get_claude_api_key(),
             "openai_key": self.get_openai_api_key(),
-            "google_key": self.get_google_api_key()
+            "google_key": self.get_google_api_key(),
+            "use_cache": self.settings.value("llm_cache_enabled", True, type=bool),
+            "second_pass_gaps": self.settings.value("second_pass_gaps", True, type=bool)
         }
 
     def _check_api_key(self, api_name, settings_dict):
@@ -578,6 +668,7 @@ class MainWindow(QMainWindow):
             ("Data Collector", self.data_collector),
             ("Data Filterer", self.data_filterer),
             ("Race Commentator", self.race_commentator),
+            ("Batch Commentary", self.commentary_batch),
             ("Voice Generator", self.voice_generator),
             ("Auto Director", self.ams2_director),
         ]
@@ -0,0 +1,237 @@
+# mock_backends.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Offline stand-ins for the LLM providers and Cartesia, for benchmarks and runs without keys or network.
+# The fake LLM is the "mock" provider in llm_providers (settings {"api": "mock", ...}); the fake
+# Cartesia is a local HTTP server VoiceGenerator talks to when CARTESIA_TTS_URL points at it.
+
+DEFAULT_LLM_LATENCY = 0.5 # Seconds before the first token
+DEFAULT_TOKENS_PER_SECOND = 200.0
+
+_TIMECODE_LINE = re.compile(r"^(\d{2}:\d{2}:\d{2}) - (.+)$")
+_PLACEHOLDER = re.compile(r"<COMMENTATE HERE IN (\d+) WORDS>")
+_WORDS = ("what", "a", "move", "there", "and", "the", "crowd", "loves", "it", "he", "has", "been", "quick",
+          "all", "race", "long", "into", "turn", "one", "pressure", "building", "lap", "after", "tyres",
+          "fading", "gap", "closing", "look", "at", "that", "brave", "late", "braking", "strategy", "call")
+
+
+def _words(seed, count):
+    """count deterministic filler words picked by hashing seed."""
+    digest = hashlib.sha256(seed.encode('utf-8')).digest()
+    return " ".join(_WORDS[digest[i % len(digest)] % len(_WORDS)] for i in range(count))
+
+
+def _respond(system, user):
+    """The fake model: timecoded text shaped like what each stage asks for, the same every time."""
+    gap = re.search(r"<COMMENTATE HERE IN (\d+) WORDS> line at (\d{2}:\d{2}:\d{2})", user)
+    if gap: # One second pass gap
+        return f"{gap.group(2)} - {_words(user, int(gap.group(1)))}"
+    if "Plain sentences, no timecodes" in user: # Story-so-far summary
+        return _words(user, 60).capitalize() + "."
+    lines = []
+    filtering = "<race_data>" in user
+    for line in user.splitlines():
+        match = _TIMECODE_LINE.match(line.strip())
+        if not match:
+            continue
+        timecode, text = match.groups()
+        placeholder = _PLACEHOLDER.search(text)
+        if placeholder: # Whole second pass script
+            lines.append(f"{timecode} - {_words(line, int(placeholder.group(1)))}")
+        elif filtering:
+            lines.append(line.strip())
+        else:
+            lines.append(f"{timecode} - {text} {_words(line, 12)}!")
+    return "\n".join(lines)
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+class MockLLM:
+    """
+    Deterministic fake LLM with a configurable time to first token and token rate. Settings keys
+    mock_latency / mock_tokens_per_second override the MOCK_LLM_LATENCY / MOCK_LLM_TOKENS_PER_SECOND
+    environment variables. Counts calls and the most requests seen in flight at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = self.in_flight = self.max_in_flight = 0
+
+    def _timing(self, settings):
+        latency = float(settings.get("mock_latency", os.environ.get("MOCK_LLM_LATENCY", DEFAULT_LLM_LATENCY)))
+        rate = float(settings.get("mock_tokens_per_second", os.environ.get("MOCK_LLM_TOKENS_PER_SECOND", DEFAULT_TOKENS_PER_SECOND)))
+        return latency, max(rate, 1.0)
+
+    def _enter(self):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _usage(self, system, user, text):
+        return {"input_tokens": _tokens(system or "") + _tokens(user), "cached_tokens": 0,
+                "cache_write_tokens": 0, "output_tokens": _tokens(text)}
+
+    def complete(self, settings, system, user, max_tokens):
+        """Returns (text, usage) after the latency plus the time the text would take to generate."""
+        latency, rate = self._timing(settings)
+        text = _respond(system, user)[:max_tokens * 4]
+        self._enter()
+        try:
+            time.sleep(latency + _tokens(text) / rate)
+        finally:
+            self._leave()
+        return text, self._usage(system, user, text)
+
+    def stream(self, settings, system, user, max_tokens, usage_out):
+        """Yields the text a line at a time at the configured token rate, then fills usage_out."""
+        latency, rate = self._timing(settings)
+        text = _respond(system, user)[:max_tokens * 4]
+        self._enter()
+        try:
+            time.sleep(latency)
+            for line in text.splitlines(keepends=True):
+                time.sleep(_tokens(line) / rate)
+                yield line
+        finally:
+            self._leave()
+        usage_out.update(self._usage(system, user, text))
+
+
+mock_llm = MockLLM()
+
+
+# --- Fake Cartesia ---
+# MPEG-1 Layer III, 32 kbps, 44.1 kHz, mono: 104-byte frames of 1152 samples each
+_MP3_FRAME = bytes([0xFF, 0xFB, 0x10, 0xC0]) + bytes(100)
+_MP3_FRAME_SECONDS = 1152 / 44100
+
+
+def make_silent_mp3(seconds):
+    """A silent MP3 mutagen reads as (about) seconds long."""
+    return _MP3_FRAME * max(1, int(round(seconds / _MP3_FRAME_SECONDS)))
+
+
+class MockTTSServer:
+    """
+    Local HTTP server that answers POST /tts/bytes like Cartesia: checks the API key header and
+    the transcript, waits latency + seconds_per_char per character of transcript, and returns a
+    silent MP3 as long as the line would take to speak (words_per_second). With max_concurrent set,
+    requests over that many at once get a 429, like a rate-limited account. GET /stats returns the
+    request counts and the highest concurrency seen.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.3, seconds_per_char=0.002,
+                 words_per_second=2.5, max_concurrent=None):
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        self.words_per_second = words_per_second
+        self.max_concurrent = max_concurrent
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'rejected': 0, 'in_flight': 0, 'max_in_flight': 0, 'audio_seconds': 0.0}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/tts/bytes"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-tts", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, so pooled sessions reuse connections
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/stats":
+                    return self._reply(404, b'{"error": "not found"}')
+                with mock.lock:
+                    body = json.dumps(mock.stats).encode('utf-8')
+                self._reply(200, body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                if self.path.rstrip("/") != "/tts/bytes":
+                    return self._reply(404, b'{"error": "not found"}')
+                if not self.headers.get("X-API-Key"):
+                    return self._reply(401, b'{"error": "missing X-API-Key"}')
+                try:
+                    transcript = json.loads(body)["transcript"]
+                except (ValueError, KeyError, TypeError):
+                    return self._reply(400, b'{"error": "transcript required"}')
+                with mock.lock:
+                    mock.stats['requests'] += 1
+                    if mock.max_concurrent and mock.stats['in_flight'] >= mock.max_concurrent:
+                        mock.stats['rejected'] += 1
+                        rejected = True
+                    else:
+                        rejected = False
+                        mock.stats['in_flight'] += 1
+                        mock.stats['max_in_flight'] = max(mock.stats['max_in_flight'], mock.stats['in_flight'])
+                if rejected:
+                    return self._reply(429, b'{"error": "too many concurrent requests"}')
+                try:
+                    time.sleep(mock.latency + mock.seconds_per_char * len(transcript))
+                    seconds = max(0.5, len(transcript.split()) / mock.words_per_second)
+                    audio = make_silent_mp3(seconds)
+                finally:
+                    with mock.lock:
+                        mock.stats['in_flight'] -= 1
+                        mock.stats['audio_seconds'] += seconds
+                self._reply(200, audio, "audio/mpeg")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Fake Cartesia for the GUI or other tools: python mock_backends.py [port]
+    # then run with CARTESIA_TTS_URL=http://127.0.0.1:<port>/tts/bytes
+    server = MockTTSServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 47700).start()
+    print(f"Mock Cartesia listening on {server.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
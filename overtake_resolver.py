@@ -0,0 +1,90 @@
+# overtake_resolver.py
+
+
+def resolve_overtakes(previous_positions, current_positions, excluded=()):
+    """
+    Works out who passed whom between two position snapshots ({car: position}).
+
+    Builds a position -> car map for the previous frame, then for every car that moved up walks
+    only the positions it jumped over. Cars it jumped over that are now behind it were passed, so
+    simple swaps, chains of swaps (A takes P1 from B while B passes C) and multi-position jumps are
+    all found in one pass, costing O(cars + positions gained) instead of O(cars^2).
+
+    Cars in `excluded` (e.g. in the pits) are never reported as overtaking or being overtaken.
+
+    Returns a list of (car, new_position, [passed cars, best previous position first]).
+    """
+    previous_by_position = {}
+    for car, position in previous_positions.items():
+        previous_by_position[position] = car
+
+    overtakes = []
+    for car, current_pos in current_positions.items():
+        prev_pos = previous_positions.get(car)
+        if prev_pos is None or current_pos >= prev_pos or car in excluded:
+            continue
+
+        passed = []
+        for position in range(current_pos, prev_pos):
+            other = previous_by_position.get(position)
+            if other is None or other == car or other in excluded:
+                continue
+            other_now = current_positions.get(other)
+            if other_now is not None and other_now > current_pos:
+                passed.append(other)
+
+        if passed:
+            overtakes.append((car, current_pos, passed))
+
+    # Report in finishing order so a chain reads front to back
+    overtakes.sort(key=lambda overtake: overtake[1])
+    return overtakes
+
+
+def _resolve_overtakes_nested(previous_positions, current_positions):
+    """The original nested scan, kept only so the benchmark below has something to compare against."""
+    found = []
+    for driver_index, current_pos in current_positions.items():
+        prev_pos = previous_positions.get(driver_index)
+        if prev_pos is not None and prev_pos != current_pos and current_pos < prev_pos:
+            for other_index, other_prev_pos in previous_positions.items():
+                if other_index != driver_index and other_prev_pos == current_pos and current_positions.get(other_index) == prev_pos:
+                    found.append((driver_index, current_pos, [other_index]))
+                    break
+    return found
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    # Benchmark: python overtake_resolver.py
+    rng = random.Random(7)
+    cars = 64
+    previous = {i: i + 1 for i in range(cars)}
+    scenarios = {}
+
+    swaps = dict(previous)
+    for p in range(0, cars - 1, 4):
+        a, b = p, p + 1
+        swaps[a], swaps[b] = swaps[b], swaps[a]
+    scenarios["16 pairwise swaps"] = swaps
+
+    order = list(range(cars))
+    for _ in range(cars):
+        j = rng.randrange(cars - 1)
+        order[j], order[j + 1] = order[j + 1], order[j]
+    scenarios["random shuffle (64 adjacent swaps)"] = {car: pos + 1 for pos, car in enumerate(order)}
+
+    jump = list(range(cars))
+    jump.insert(0, jump.pop(40)) # P41 jumps to P1 (e.g. pit cycle)
+    scenarios["one 40-place jump"] = {car: pos + 1 for pos, car in enumerate(jump)}
+
+    for name, current in scenarios.items():
+        runs = 2000
+        new_time = timeit.timeit(lambda: resolve_overtakes(previous, current), number=runs) / runs
+        old_time = timeit.timeit(lambda: _resolve_overtakes_nested(previous, current), number=runs) / runs
+        new_count = sum(len(o[2]) for o in resolve_overtakes(previous, current))
+        old_count = len(_resolve_overtakes_nested(previous, current))
+        print(f"{name:38s} indexed {new_time * 1e6:7.1f} us ({new_count} passes) | "
+              f"nested {old_time * 1e6:7.1f} us ({old_count} passes)")
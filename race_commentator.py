@@ -1,38 +1,210 @@
 # race_commentator.py
 import os
+import queue
 import re
-from PyQt5.QtCore import QThread, pyqtSignal
-import anthropic
-from openai import OpenAI
-# --- Add Google Gemini import ---
-import google.generativeai as genai
-# ------------------------------
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QThread, pyqtSignal, Qt
+import llm_providers
+from llm_providers import BlockedResponse
+from llm_cache import get_response_cache
+from data_filterer import parse_timecode, format_timecode, split_into_windows
+
+TIMECODE_PATTERN = re.compile(r"^\s*\d{1,2}:\d{2}:\d{2}\b")
+
+
+# Batch mode: the race log comes first and the persona after it, so every persona's request
+# starts with the same (cached) text and only the persona part is paid for in full each time
+BATCH_SYSTEM_PROMPT = ("You are a motor racing commentator. You will be given a race event log and then the "
+                       "persona and instructions to commentate it with; stay in that persona throughout.")
+
+SUMMARY_SYSTEM_PROMPT = ("You summarise part of a motor race event log for a commentator who will pick up the "
+                         "broadcast later. Be factual and brief.")
+
+
+class PartialCommentary(Exception):
+    """The stream failed after some commentary had already been written out; text is what arrived."""
+
+    def __init__(self, text):
+        super().__init__("commentary stream interrupted")
+        self.text = text
+
+
+def count_timecoded_lines(text):
+    return sum(1 for line in text.splitlines() if TIMECODE_PATTERN.match(line))
+
+
+def log_duration(text):
+    """Seconds from the first to the last timecoded line."""
+    times = [seconds for seconds in map(parse_timecode, text.splitlines()) if seconds is not None]
+    return max(times) - min(times) if times else 0
+
+
+def missing_events(race_events, commentary):
+    """Input event lines whose timecode has no line in the commentary, in input order."""
+    covered = {seconds for seconds in map(parse_timecode, commentary.splitlines()) if seconds is not None}
+    missing = []
+    for line in race_events.splitlines():
+        seconds = parse_timecode(line)
+        if seconds is not None and seconds not in covered:
+            missing.append((seconds, line.strip()))
+            covered.add(seconds) # Several events at one timecode are commented as one
+    return missing
+
+
+def group_missing(missing, max_events=12, max_gap=180):
+    """Splits missing [(seconds, line)] into runs of at most max_events with no more than max_gap seconds between them."""
+    groups = []
+    for event in missing:
+        if groups and len(groups[-1]) < max_events and event[0] - groups[-1][-1][0] <= max_gap:
+            groups[-1].append(event)
+        else:
+            groups.append([event])
+    return groups
+
+
+def merge_commentary(commentary, repaired):
+    """The commentary lines plus repaired [(seconds, line)], in timecode order. Untimed lines stay after the line above them."""
+    entries = []
+    seconds = -1
+    for line in commentary.splitlines():
+        if not line.strip():
+            continue
+        line_seconds = parse_timecode(line)
+        if line_seconds is not None:
+            seconds = line_seconds
+        entries.append((seconds, line))
+    entries.extend(repaired)
+    entries.sort(key=lambda entry: entry[0]) # Stable: lines at one timecode keep their order
+    return [line for _seconds, line in entries]
+
+
+def segment_lines(text, start, end):
+    """The timecoded lines of a segment's commentary inside [start, end); None means no bound."""
+    lines = []
+    for line in text.splitlines():
+        seconds = parse_timecode(line)
+        if seconds is None or (start is not None and seconds < start) or (end is not None and seconds >= end):
+            continue
+        lines.append(line.strip())
+    return lines
+
+
+class CommentaryWriter:
+    """
+    Takes streamed response text, and as each line completes appends it to the commentary file
+    (flushed, so a later stage can read it straight away), hands it to on_line and reports
+    progress from the timecoded lines written against the number of events in the input.
+    """
+
+    def __init__(self, path, on_line, on_progress, expected_lines, progress_start=20, progress_end=95):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.on_line = on_line
+        self.on_progress = on_progress
+        self.expected_lines = max(expected_lines, 1)
+        self.progress_start = progress_start
+        self.progress_end = progress_end
+        self.pending = ""
+        self.timecoded_lines = 0
+        self.last_progress = progress_start
+
+    def feed(self, text):
+        self.pending += text
+        if "\n" not in self.pending:
+            return
+        *lines, self.pending = self.pending.split("\n")
+        for line in lines:
+            self._write_line(line)
+        self.file.flush()
+
+    def _write_line(self, line):
+        self.file.write(line + "\n")
+        if not line.strip():
+            return
+        self.on_line(line)
+        if TIMECODE_PATTERN.match(line):
+            self.timecoded_lines += 1
+            progress = self.progress_start + int((self.progress_end - self.progress_start) *
+                                                 min(1.0, self.timecoded_lines / self.expected_lines))
+            if progress != self.last_progress:
+                self.last_progress = progress
+                self.on_progress(progress)
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.pending:
+            self.file.write(self.pending)
+            if self.pending.strip():
+                self.on_line(self.pending)
+            self.pending = ""
+        self.file.close()
+        self.file = None
+
+
+class LinePipeline:
+    """
+    Bounded hand-off of commentary lines from RaceCommentator to VoiceGenerator, so voice synthesis
+    starts on each line as soon as it has been written. put() blocks while the queue is full (the
+    commentary stream waits for TTS to catch up) unless the consumer has gone away.
+    """
+
+    def __init__(self, maxsize=32):
+        self.queue = queue.Queue(maxsize)
+        self.closed = False # Set by the consumer when it stops reading
+        self.expected_lines = 0 # Events in the commentary input, for the consumer's progress
+
+    def put(self, line):
+        while not self.closed:
+            try:
+                self.queue.put(line, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self):
+        """Producer is done (or failed); the consumer's lines() ends once it has read everything."""
+        self.put(None)
+
+    def lines(self):
+        while True:
+            line = self.queue.get()
+            if line is None:
+                return
+            yield line
+
+    def close(self):
+        self.closed = True
+
 
 class RaceCommentator(QThread):
     output_signal = pyqtSignal(str)
     progress_signal = pyqtSignal(int)
+    line_signal = pyqtSignal(str) # Each commentary line as soon as it has been written to the file
 
     def __init__(self, input_path, settings):
         super().__init__()
         self.input_path = input_path
         self.output_path = None
         self.settings = settings
-
-        # Initialize appropriate client based on settings
-        # Note: Gemini client is configured just before use with the API key
-        if self.settings["api"] == "claude":
-            self.client = anthropic.Anthropic(api_key=settings["claude_key"])
-        elif self.settings["api"] == "openai":
-            self.client = OpenAI(api_key=settings["openai_key"])
-        elif self.settings["api"] == "gemini":
-            self.client = None # No persistent client needed for google-generativeai v0.x.x
-        else:
-             self.client = None # Handle unknown case
-
+        # Provider clients are shared and pooled in llm_providers
 
         # Use the custom prompt from settings for main commentary
         # Ensure 'main_prompt' exists in settings, provide fallback if not
         self.system_prompt = settings.get('main_prompt', "You are a race commentator.") # Basic fallback
+        self.cache = get_response_cache()
+        self.line_pipeline = None # Optional LinePipeline feeding a VoiceGenerator
+        # Endurance races: comment time segments in parallel, each with a "story so far" summary
+        self.map_reduce = settings.get("map_reduce", True)
+        self.map_reduce_after = int(settings.get("map_reduce_after_minutes", 120) * 60)
+        self.segment_seconds = int(settings.get("segment_minutes", 30) * 60)
+        self.max_workers = int(settings.get("max_workers", 4))
+        self.story_segments = int(settings.get("story_segments", 8)) # Most recent summaries given in full
+        # Events the response skipped (or lost to truncation) are filled in with small targeted calls
+        self.repair_missing = settings.get("repair_missing", True)
+        self.output_tag = settings.get("output_tag") # Added to the output file name (one file per persona in a batch)
+        self.shared_log_prefix = settings.get("shared_log_prefix", False)
 
     def run(self):
         self.output_signal.emit("Starting race commentary generation...")
@@ -47,22 +219,25 @@ class RaceCommentator(QThread):
             race_events = self.read_race_events()
             self.progress_signal.emit(20)
 
-            # Generate commentary
+            # Generate commentary (written to the output file as it streams in)
             commentary = self.get_ai_commentary(race_events)
             if commentary is None: # Check if commentary generation failed
                  raise Exception("Commentary generation returned None.")
-            if not isinstance(commentary, str):
-                commentary = str(commentary)
-
-            self.write_commentary(commentary)
+            if self.repair_missing:
+                commentary = self.repair_commentary(race_events, commentary)
 
             self.output_signal.emit(f"Commentary generation complete. Output saved to {self.output_path}")
+            if self.settings.get("use_cache", True) and self.cache.enabled:
+                self.output_signal.emit(self.cache.summary())
             self.progress_signal.emit(100)
 
         except Exception as e:
             self.output_signal.emit(f"An error occurred during commentary generation: {str(e)}")
             # Optionally re-raise if needed
             # raise
+        finally:
+            if self.line_pipeline:
+                self.line_pipeline.finish()
 
     def read_race_events(self):
         try:
@@ -76,159 +251,217 @@ class RaceCommentator(QThread):
              raise # Re-raise
 
     def get_ai_commentary(self, race_events):
-        if self.settings["api"] == "claude":
-            return self._get_claude_commentary(race_events)
-        elif self.settings["api"] == "openai":
-            return self._get_openai_commentary(race_events)
-        # --- Add Gemini handling ---
-        elif self.settings["api"] == "gemini":
-            return self._get_gemini_commentary(race_events)
-        # --------------------------
-        else:
-            self.output_signal.emit(f"Error: Unknown API type '{self.settings['api']}'")
-            return ""
-
-    def _get_claude_commentary(self, race_events):
-        if not self.client:
-            self.output_signal.emit("Error: Claude client not initialized.")
-            return ""
+        """
+        Generates commentary, streaming it into the output file line by line as it arrives
+        (or replaying the cached response for an identical request). Returns the full text.
+        """
+        expected_lines = count_timecoded_lines(race_events)
+        on_line = self.line_signal.emit
+        if self.line_pipeline:
+            self.line_pipeline.expected_lines = expected_lines
+            def on_line(line):
+                self.line_signal.emit(line)
+                if TIMECODE_PATTERN.match(line):
+                    self.line_pipeline.put(line)
+        writer = CommentaryWriter(self.output_path, on_line, self.progress_signal.emit, expected_lines)
         try:
-            response = self.client.messages.create(
-                model=self.settings["model"],
-                max_tokens=8000,
-                temperature=0.99,
-                system=self.system_prompt, # Use the loaded system prompt
-                messages=[
-                    {
-                        "role": "user",
-                        "content": (
-                            f"Here's the complete race event log:\n\n{race_events}\n\n"
-                            "Please provide commentary for each event, maintaining the original timecodes."
-                        )
-                    }
-                ]
+            if self.map_reduce and log_duration(race_events) > self.map_reduce_after:
+                return self.get_segmented_commentary(race_events, writer)
+            if not self.settings.get("use_cache", True):
+                return self._get_uncached_commentary(race_events, writer.feed)
+            # The batch layout (shared log prefix, persona in the user turn) is a different request
+            stage = "RaceCommentatorBatch" if self.shared_log_prefix else "RaceCommentator"
+            commentary, from_cache = self.cache.cached(
+                (stage, self.settings["api"], self.settings.get("model"), 0.99, self.system_prompt, race_events),
+                lambda: self._get_uncached_commentary(race_events, writer.feed), self.output_signal.emit)
+            if from_cache:
+                self.output_signal.emit("Using cached commentary (identical request). Turn off the response cache in Settings for a fresh take.")
+                writer.feed(commentary)
+            return commentary
+        except PartialCommentary as e:
+            return e.text # Not cached; the missing-event repair fills in the rest
+        finally:
+            writer.close()
+
+    def _get_uncached_commentary(self, race_events, on_text):
+        system, cache_prefix = self.system_prompt, None
+        if self.shared_log_prefix:
+            system = BATCH_SYSTEM_PROMPT
+            cache_prefix = f"Here's the complete race event log:\n\n{race_events}\n\n"
+            user_content = (f"{cache_prefix}Your persona and instructions:\n\n<persona>\n{self.system_prompt}\n</persona>\n\n"
+                            "Please provide commentary for each event, maintaining the original timecodes.")
+        else:
+            user_content = (
+                f"Here's the complete race event log:\n\n{race_events}\n\n"
+                "Please provide commentary for each event, maintaining the original timecodes."
             )
-
-            # Handle Claude's response format
-            if hasattr(response, 'content') and isinstance(response.content, list) and response.content:
-                content = response.content[0].text
-            elif hasattr(response, 'content'): # Handle non-list content attribute if applicable
-                content = response.content
-            else: # Fallback if content structure is unexpected
-                content = str(response)
-
-            return str(content) if content is not None else ""
-
+        parts = []
+        try:
+            for text in llm_providers.stream(self.settings, system, user_content, temperature=0.99, max_tokens=8000,
+                                             on_retry=self._on_retry, on_usage=self._on_usage, cache_prefix=cache_prefix):
+                parts.append(text)
+                on_text(text)
+            if not parts:
+                self.output_signal.emit(f"Warning: {self.settings['api']} returned an empty response.")
+            return "".join(parts)
+        except BlockedResponse as e:
+            self.output_signal.emit(f"Warning: Gemini response blocked. Reason: {e}")
+            return f"Blocked by API: {e}"
         except Exception as e:
-            self.output_signal.emit(f"Error in Claude commentary generation: {str(e)}")
+            self.output_signal.emit(f"Error in {self.settings['api']} commentary generation: {str(e)}")
+            if parts:
+                # Those lines are already in the output file, so carry on with them rather than report nothing
+                raise PartialCommentary("".join(parts)) from e
             return ""
 
-    def _get_openai_commentary(self, race_events):
-        if not self.client:
-            self.output_signal.emit("Error: OpenAI client not initialized.")
-            return ""
+    # --- Repairing skipped events ---
+    def repair_commentary(self, race_events, commentary):
+        """
+        Compares the input's event timecodes with the commentary's, asks for commentary on just
+        the missing runs (in parallel, each with the lines either side for context), and rewrites
+        the output file with everything in timecode order. Returns the repaired commentary.
+        """
+        if count_timecoded_lines(commentary) == 0:
+            return commentary # Nothing came back at all: a repair would be a full rerun
+        missing = missing_events(race_events, commentary)
+        if not missing:
+            return commentary
+        groups = group_missing(missing)
+        self.output_signal.emit(f"{len(missing)} events have no commentary, requesting them in {len(groups)} small calls...")
+        context = [(parse_timecode(line), line.strip()) for line in commentary.splitlines() if parse_timecode(line) is not None]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda group: self.repair_group(group, context), groups))
+        repaired = [entry for result in results for entry in result]
+        self.output_signal.emit(f"Recovered commentary for {len(repaired)}/{len(missing)} missing events.")
+        if not repaired:
+            return commentary
+        merged = merge_commentary(commentary, repaired)
         try:
-            messages = []
-
-            # Prepare messages based on model type
-            if self.settings["model"].startswith(("o-", "o1-")):
-                 messages.append({
-                    "role": "user",
-                     # Combine system prompt and user content for 'O' models
-                    "content": f"{self.system_prompt}\n\nHere's the complete race event log:\n\n{race_events}\n\nPlease provide commentary for each event, maintaining the original timecodes."
-                })
-            else:
-                 # Standard OpenAI model message structure
-                messages.extend([
-                    {
-                        "role": "system",
-                        "content": self.system_prompt # Use the loaded system prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": (
-                            f"Here's the complete race event log:\n\n{race_events}\n\n"
-                            "Please provide commentary for each event, maintaining the original timecodes."
-                        )
-                    }
-                ])
-
-            kwargs = {
-                "model": self.settings["model"],
-                "messages": messages
-            }
-
-            # Add parameters only for non-'O' models if needed
-            if not self.settings["model"].startswith(("o-", "o1-")):
-                kwargs.update({
-                    "temperature": 0.99,
-                    "max_tokens": 8000
-                })
-
-            response = self.client.chat.completions.create(**kwargs)
-
-            # Handle OpenAI's response format
-            if response.choices and hasattr(response.choices[0].message, 'content'):
-                content = response.choices[0].message.content
-            else: # Fallback if structure is unexpected
-                content = str(response.choices[0].message) if response.choices else ""
-
-
-            return str(content) if content is not None else ""
-
+            with open(self.output_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(merged) + "\n")
         except Exception as e:
-            self.output_signal.emit(f"Error in OpenAI commentary generation: {str(e)}")
-            return ""
-
-    # --- Add Gemini Commentary Function ---
-    def _get_gemini_commentary(self, race_events):
-        """Generates race commentary using the Google Gemini API."""
+            self.output_signal.emit(f"Error writing repaired commentary: {str(e)}")
+        for _seconds, line in repaired:
+            self.line_signal.emit(line)
+            if self.line_pipeline:
+                self.line_pipeline.put(line) # Voice orders its segments by timecode
+        return "\n".join(merged)
+
+    def repair_group(self, group, context, context_lines=3):
+        """Commentary [(seconds, line)] for one run of missing events, only for their timecodes."""
+        first, last = group[0][0], group[-1][0]
+        before = [line for seconds, line in context if seconds < first][-context_lines:]
+        after = [line for seconds, line in context if seconds > last][:context_lines]
+        events = "\n".join(line for _seconds, line in group)
+        user_content = ("Here's the commentary just before these events:\n\n" + ("\n".join(before) or "(start of the race)") +
+                        f"\n\nThese race events still need commentary:\n\n{events}\n\n"
+                        "And the commentary just after them:\n\n" + ("\n".join(after) or "(end of the race)") +
+                        "\n\nPlease provide commentary for each of these events only, one line each, maintaining the original timecodes.")
+        generate = lambda: self._complete_or_empty(self.settings, self.system_prompt, user_content, 0.99,
+                                                   max(512, 150 * len(group)))
+        if self.settings.get("use_cache", True):
+            response, _from_cache = self.cache.cached(
+                ("RaceCommentatorRepair", self.settings["api"], self.settings.get("model"), 0.99, self.system_prompt, user_content),
+                generate, self.output_signal.emit)
+        else:
+            response = generate()
+        wanted = {seconds for seconds, _line in group}
+        repaired = []
+        for line in response.splitlines():
+            seconds = parse_timecode(line)
+            if seconds in wanted:
+                wanted.discard(seconds) # One line per event
+                repaired.append((seconds, line.strip()))
+        return repaired
+
+    # --- Map-reduce for endurance races ---
+    def get_segmented_commentary(self, race_events, writer):
+        """
+        Splits the log into segments, summarises each one (a cheap call, all in parallel), then
+        comments every segment in parallel with the story so far up to its start, and writes the
+        segments to the file in order as soon as each one and those before it are done.
+        """
+        segments = split_into_windows(race_events, self.segment_seconds, 0)
+        count = len(segments)
+        self.output_signal.emit(f"Long race ({format_timecode(log_duration(race_events))}): commenting {count} segments of "
+                                f"{self.segment_seconds // 60} min, {min(self.max_workers, count)} at a time...")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            summaries = list(executor.map(lambda segment: self.summarise_segment(*segment), segments))
+            self.output_signal.emit(f"Story summaries ready for {sum(1 for s in summaries if s)}/{count} segments.")
+            futures = [executor.submit(self.comment_segment, i, count, segment, self.story_so_far(segments, summaries, i))
+                       for i, segment in enumerate(segments)]
+            results = []
+            for i, future in enumerate(futures): # In order, so the file and the voice pipeline stay in time order
+                start, end, _text = segments[i]
+                text = future.result()
+                if not text:
+                    self.output_signal.emit(f"Warning: No commentary for segment {i + 1}/{count} ({format_timecode(start)}).")
+                owned = segment_lines(text, start if i else None, end)
+                writer.feed("\n".join(owned) + "\n" if owned else "")
+                results.append("\n".join(owned))
+        return "\n".join(result for result in results if result)
+
+    def summarise_segment(self, start, end, text):
+        """Short factual summary of one segment's events, "" if it couldn't be made."""
+        until = format_timecode(end) if end is not None else "the finish"
+        user_content = (f"Race events from {format_timecode(start)} to {until}:\n\n{text}\n\n"
+                        "In at most 120 words, give: the top of the standings at the end of this part, the main "
+                        "storylines (battles, incidents, pit strategy, who is gaining or losing) and anything worth "
+                        "calling back to later. Plain sentences, no timecodes.")
+        settings = dict(self.settings, model=self.settings.get("summary_model") or self.settings.get("model"))
+        generate = lambda: self._complete_or_empty(settings, SUMMARY_SYSTEM_PROMPT, user_content, 0.3, 400)
+        if not self.settings.get("use_cache", True):
+            summary = generate()
+        else:
+            summary, _from_cache = self.cache.cached(
+                ("RaceSummary", settings["api"], settings.get("model"), 0.3, SUMMARY_SYSTEM_PROMPT, user_content), generate,
+                self.output_signal.emit)
+        return "" if summary.startswith("Blocked by API") else summary.strip()
+
+    def story_so_far(self, segments, summaries, index):
+        """The summaries before segment index: the opening one and the most recent story_segments."""
+        earlier = [(segments[i][0], summaries[i]) for i in range(index) if summaries[i]]
+        if len(earlier) > self.story_segments + 1:
+            earlier = earlier[:1] + earlier[-self.story_segments:]
+        return "\n".join(f"- From {format_timecode(start)}: {summary}" for start, summary in earlier)
+
+    def comment_segment(self, index, count, segment, story):
+        start, end, text = segment
+        until = format_timecode(end) if end is not None else "the finish"
+        if index == 0:
+            position = "This is the start of the broadcast."
+        elif index == count - 1:
+            position = "This is the final part of the broadcast, through to the finish."
+        else:
+            position = "You are mid-broadcast: don't re-introduce the race or sign off."
+        story_text = f"The story so far:\n{story}\n\n" if story else ""
+        user_content = (f"{story_text}This is part {index + 1} of {count} of a long race, from {format_timecode(start)} "
+                        f"to {until}. {position}\n\nHere's the race event log for this part:\n\n{text}\n\n"
+                        "Please provide commentary for each event, maintaining the original timecodes.")
+        generate = lambda: self._complete_or_empty(self.settings, self.system_prompt, user_content, 0.99, 8000)
+        if not self.settings.get("use_cache", True):
+            return generate()
+        commentary, _from_cache = self.cache.cached(
+            ("RaceCommentatorSegment", self.settings["api"], self.settings.get("model"), 0.99, self.system_prompt, user_content),
+            generate, self.output_signal.emit)
+        return commentary
+
+    def _complete_or_empty(self, settings, system, user_content, temperature, max_tokens):
         try:
-            api_key = self.settings.get("google_key")
-            if not api_key:
-                self.output_signal.emit("Error: Google API Key not found in settings.")
-                return ""
-
-            # Configure the Gemini client
-            genai.configure(api_key=api_key)
-
-            # Instantiate the model
-            model = genai.GenerativeModel(self.settings["model"])
-
-            # Combine system prompt and race events into a single prompt
-            full_prompt = (
-                f"{self.system_prompt}\n\n"
-                f"Here's the complete race event log:\n\n{race_events}\n\n"
-                "Please provide commentary for each event, maintaining the original timecodes."
-            )
-
-             # Add safety settings to potentially reduce refusals
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
-
-            # Generate content
-            response = model.generate_content(full_prompt, safety_settings=safety_settings)
-
-
-            # Extract the text, checking for blocks
-            if response.parts:
-                 return response.text
-            elif response.prompt_feedback.block_reason:
-                 block_reason = response.prompt_feedback.block_reason
-                 self.output_signal.emit(f"Warning: Gemini response blocked. Reason: {block_reason}")
-                 return f"Blocked by API: {block_reason}"
-            else:
-                 self.output_signal.emit("Warning: Gemini returned an empty response.")
-                 return ""
-
+            return llm_providers.complete(settings, system, user_content, temperature=temperature, max_tokens=max_tokens,
+                                          on_retry=self._on_retry, on_usage=self._on_usage)
+        except BlockedResponse as e:
+            self.output_signal.emit(f"Warning: Response blocked. Reason: {e}")
+            return f"Blocked by API: {e}"
         except Exception as e:
-            self.output_signal.emit(f"Error in Gemini commentary generation: {str(e)}")
+            self.output_signal.emit(f"Error in {settings['api']} request: {str(e)}")
             return ""
-    # ------------------------------------
+
+    def _on_retry(self, attempt, delay, error):
+        self.output_signal.emit(f"API busy ({type(error).__name__}), retry {attempt} in {delay:.1f}s...")
+
+    def _on_usage(self, usage):
+        self.output_signal.emit(f"Commentary API usage: {llm_providers.format_usage(usage)}")
 
     def create_output_file(self):
         """Create the output file path for the commentary."""
@@ -244,7 +477,8 @@ class RaceCommentator(QThread):
              if not file_extension:
                  file_extension = ".txt" # Default to .txt
 
-             new_file_name = f"{file_name}_commentary{file_extension}"
+             tag = re.sub(r'[^\w\-]+', '_', self.output_tag).strip('_') if self.output_tag else ""
+             new_file_name = f"{file_name}_{tag}_commentary{file_extension}" if tag else f"{file_name}_commentary{file_extension}"
 
              original_dir = os.path.dirname(self.input_path)
              # Ensure original_dir is valid
@@ -258,36 +492,73 @@ class RaceCommentator(QThread):
              return None
 
 
-    def write_commentary(self, commentary):
-        """Write the commentary to the output file and emit progress signals."""
-        if not self.output_path:
-             self.output_signal.emit("Error: Output path is not set, cannot write commentary.")
-             return
-        # Ensure commentary is a string and properly encoded
-        if not isinstance(commentary, str):
-            commentary = str(commentary)
+    def get_output_path(self):
+        """Get the path to the output file."""
+        return self.output_path
 
-        try:
-            # Write the file
-            with open(self.output_path, 'w', encoding='utf-8') as f:
-                f.write(commentary)
-
-            # Emit progress updates based on lines written (optional refinement)
-            lines = commentary.split('\n')
-            total_lines = len(lines) if lines else 1 # Avoid division by zero
-            # Basic progress emit after writing is complete
-            self.progress_signal.emit(90) # Indicate writing is nearly done
-            # for i, line in enumerate(lines):
-            #     # self.output_signal.emit(line) # Avoid emitting every line to UI
-            #     progress = int(((i + 1) / total_lines) * 100)
-            #     # Emit progress less frequently if needed
-            #     if i % 10 == 0 or i == total_lines - 1:
-            #          self.progress_signal.emit(progress)
 
-        except Exception as e:
-             self.output_signal.emit(f"Error writing commentary to {self.output_path}: {str(e)}")
+class CommentaryBatch(QThread):
+    """
+    Generates commentary for several personas from one filtered log at the same time, one output
+    file per persona (<log>_<name>_commentary.txt). Requests share the provider's concurrency
+    limit in llm_providers, and the race log goes first in every request (shared_log_prefix) so
+    the provider caches it once for all personas: the first persona starts alone and the others
+    follow as soon as its response begins, by which point the cached prefix exists.
+    """
+    output_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(int)
+    persona_finished_signal = pyqtSignal(str, str) # Commentator name, output path ("" if it failed)
 
+    def __init__(self, input_path, persona_settings):
+        """persona_settings: {commentator name: RaceCommentator settings for that persona}."""
+        super().__init__()
+        self.input_path = input_path
+        self.persona_settings = persona_settings
+        self.output_paths = {}
+        self.progress = {name: 0 for name in persona_settings}
+        self.lock = threading.Lock()
 
-    def get_output_path(self):
-        """Get the path to the output file."""
-        return self.output_path
\ No newline at end of file
+    def run(self):
+        names = list(self.persona_settings)
+        self.output_signal.emit(f"Generating commentary for {len(names)} commentators: {', '.join(names)}")
+        self.progress_signal.emit(0)
+        try:
+            first_started = threading.Event()
+            with ThreadPoolExecutor(max_workers=len(names)) as executor:
+                futures = [executor.submit(self._run_persona, names[0], first_started)]
+                first_started.wait() # Set once the first response is streaming (or the first persona has ended)
+                futures += [executor.submit(self._run_persona, name, None) for name in names[1:]]
+                for future in futures:
+                    future.result()
+            done = sum(1 for path in self.output_paths.values() if path)
+            self.output_signal.emit(f"Batch complete: {done}/{len(names)} commentaries written.")
+            for name in names:
+                self.output_signal.emit(f"  {name}: {self.output_paths.get(name) or 'failed'}")
+        except Exception as e:
+            self.output_signal.emit(f"An error occurred during batch commentary generation: {str(e)}")
+        self.progress_signal.emit(100)
+
+    def _run_persona(self, name, started_event):
+        settings = dict(self.persona_settings[name], output_tag=name, shared_log_prefix=True)
+        commentator = RaceCommentator(self.input_path, settings)
+        # run() is called on this worker thread, so connect directly rather than through an event loop
+        commentator.output_signal.connect(lambda text: self.output_signal.emit(f"[{name}] {text}"), Qt.DirectConnection)
+        commentator.progress_signal.connect(lambda value: self._on_progress(name, value), Qt.DirectConnection)
+        if started_event:
+            commentator.line_signal.connect(lambda _line: started_event.set(), Qt.DirectConnection)
+        try:
+            commentator.run()
+        finally:
+            if started_event:
+                started_event.set()
+        path = commentator.get_output_path()
+        path = path if path and os.path.exists(path) else ""
+        with self.lock:
+            self.output_paths[name] = path
+        self.persona_finished_signal.emit(name, path)
+
+    def _on_progress(self, name, value):
+        with self.lock:
+            self.progress[name] = value
+            overall = sum(self.progress.values()) // len(self.progress)
+        self.progress_signal.emit(overall)
@@ -0,0 +1,520 @@
+# race_state_engine.py
+import re
+from overtake_resolver import resolve_overtakes
+from battle_tracker import BattleTracker
+from incident_clusterer import CornerIndex, IncidentClusterer, describe_incident
+
+# --- Event kinds ---
+RACE_START = "race_start"
+OVERTAKE = "overtake"
+LEAD_CHANGE = "lead_change"
+LAPPED = "lapped"
+PIT_IN = "pit_in"
+PIT_OUT = "pit_out"
+ACCIDENT = "accident"
+RECOVERED = "recovered"
+BATTLE_START = "battle_start"
+BATTLE_INTENSIFY = "battle_intensify"
+BATTLE_END = "battle_end"
+LEADERBOARD = "leaderboard"
+FINAL_LAP = "final_lap"
+WINNER = "winner"
+FINISH = "finish"
+
+BATTLE_KINDS = {"start": BATTLE_START, "intensify": BATTLE_INTENSIFY, "end": BATTLE_END} # BattleTracker's names
+
+# --- Log lines ---
+# Templates per event kind. Each sim keeps the wording its collector always logged, since the
+# filter and commentator prompts key off it (e.g. "The Race Begins!"). None leaves a kind out of
+# that sim's log, for events its collector never reported.
+MESSAGES = {
+    RACE_START: "Race has started!",
+    FINAL_LAP: "The Leader is on the Final Lap",
+    WINNER: "CHECKERED FLAG: {name} has won the race!",
+    FINISH: "{name} has finished in position {position}",
+    OVERTAKE: "Overtake! {name} passes {others} for P{position}{where}",
+    LEAD_CHANGE: "LEAD CHANGE! {name} takes the lead from {other}{where}!",
+    LAPPED: "{name} laps {other} for P{position}",
+    ACCIDENT: "Accident! {name} has stopped from P{position}{where}", # One car; several get describe_incident()'s line
+    PIT_IN: "{name} has entered the pits.",
+    PIT_OUT: "{name} has exited the pits.",
+    RECOVERED: "{name} appears to be moving again.",
+    BATTLE_START: "Battle brewing! {leader} defends P{position} from {follower} with just {gap:.1f}s gap!",
+    BATTLE_INTENSIFY: "Intense battle! {follower} is all over the back of {leader} for P{position} - gap now {gap:.1f}s after {duration}s of pressure!",
+    BATTLE_END: "Battle over! {leader} has broken away from {follower} in the fight for P{position} after {duration}s",
+}
+
+AMS2_MESSAGES = {
+    **MESSAGES,
+    OVERTAKE: "Overtake! {name} passes {others} for P{position}",
+    LEAD_CHANGE: "LEAD CHANGE! {name} takes the lead from {other}!",
+    ACCIDENT: "Accident! P{position} {name} is involved in an accident!",
+    PIT_IN: None,
+    PIT_OUT: None,
+    RECOVERED: None,
+}
+
+ACC_MESSAGES = {
+    **MESSAGES,
+    RACE_START: "The Race Begins!",
+    FINAL_LAP: "Leader is on final lap",
+    WINNER: "Checkered flag! {name} takes the win!",
+    FINISH: "{name} has finished in position {position}.",
+    OVERTAKE: "Overtake! {name} overtook {others} for position {position}{where}.",
+    LEAD_CHANGE: "Overtake! {name} overtook {others} for position {position}{where}.",
+    LAPPED: "Overtake! {name} overtook {other} who is being lapped{where}.",
+    BATTLE_START: None,
+    BATTLE_INTENSIFY: None,
+    BATTLE_END: None,
+}
+
+AC_MESSAGES = {
+    **ACC_MESSAGES,
+    FINAL_LAP: "Timer expired. Leader is on final lap.",
+    "final_lap_laps": "Leader {name} is starting the final lap ({laps}/{total_laps})!", # Lap-based races
+    OVERTAKE: "Overtake! {name} passes {others} for P{position}{where}.",
+    LEAD_CHANGE: "Overtake! {name} passes {others} for P{position}{where}.",
+    LAPPED: "Overtake! {name} laps {other}{where}.",
+}
+
+# Lap line crossing thresholds on the 0-1 spline (same idea as the ACC collector's custom lap counting)
+UPPER_THRESHOLD = 0.8
+LOWER_THRESHOLD = 0.2
+
+
+class CarFrame:
+    """
+    One car in one tick, normalised by a sim adapter.
+    spline: 0-1 position round the lap. speed: m/s. position/laps may be None, in which case
+    the engine ranks cars by progress and counts laps itself from spline crossings.
+    """
+    __slots__ = ('car_id', 'name', 'spline', 'speed', 'in_pit', 'position', 'laps')
+
+    def __init__(self, car_id, name, spline, speed, in_pit=False, position=None, laps=None):
+        self.car_id = car_id
+        self.name = name
+        self.spline = spline
+        self.speed = speed
+        self.in_pit = in_pit
+        self.position = position
+        self.laps = laps
+
+
+class RaceEvent:
+    """A typed race event: kind (one of the constants above), session time in seconds, the log line, and details."""
+    __slots__ = ('kind', 'time', 'message', 'data')
+
+    def __init__(self, kind, time, message, **data):
+        self.kind = kind
+        self.time = time
+        self.message = message
+        self.data = data
+
+    def __repr__(self):
+        return f"RaceEvent({self.kind!r}, {self.time:.3f}, {self.message!r})"
+
+
+class _CarState:
+    __slots__ = ('name', 'laps', 'last_spline', 'skip_first_crossing', 'just_crossed', 'in_pit',
+                 'monitored', 'in_accident', 'finished', 'position', 'progress', 'speed')
+
+    def __init__(self, name, spline):
+        self.name = name
+        self.laps = 0
+        self.last_spline = None
+        self.skip_first_crossing = spline >= UPPER_THRESHOLD # Grid behind the line crosses it at the start
+        self.just_crossed = False
+        self.in_pit = False
+        self.monitored = False
+        self.in_accident = False
+        self.finished = False
+        self.position = 0
+        self.progress = 0.0
+        self.speed = 0.0
+
+
+class RaceStateEngine:
+    """
+    Sim-agnostic race logic: lap counting, pits, accidents (grouped into incidents), overtakes,
+    battles, leaderboards and the finish. Collectors turn their telemetry into CarFrames with a
+    thin adapter, call tick() each update and log the RaceEvents it returns.
+
+    Car state lives in one slotted object per car, and overtakes, battles and incidents go through
+    overtake_resolver, BattleTracker and IncidentClusterer, so a tick is O(n) apart from ranking
+    cars by progress when the sim doesn't supply positions.
+
+    messages maps event kinds to log line templates (MESSAGES, or a sim's own such as ACC_MESSAGES).
+    finish_spline: if set, the leader takes the flag on the final lap as soon as it passes that
+    point of the lap (ACC's 0.99) rather than when its line crossing is counted.
+    Battles are debounced per pair of cars: they have to stay within a second of each other for
+    battle_confirm seconds before it's reported (not just bunch up for a moment, as the whole field
+    does off the start), and once a pair's battle has been reported (started or over) the same two
+    cars don't get another one for battle_repeat seconds.
+    """
+
+    def __init__(self, track_length=0.0, corners=None, accident_speed=5.56, recovery_speed=19.44,
+                 race_start_immunity=10.0, overtake_interval=1.0, overtake_grace=15.0, leaderboard_interval=240.0,
+                 messages=None, finish_spline=None, battle_confirm=10.0, battle_repeat=60.0):
+        self.track_length = track_length
+        self.messages = messages or MESSAGES
+        self.finish_spline = finish_spline
+        self.battle_repeat = battle_repeat
+        self.corner_index = corners if isinstance(corners, CornerIndex) else CornerIndex(corners)
+        self.accident_speed = accident_speed # m/s
+        self.recovery_speed = recovery_speed # m/s
+        self.race_start_immunity = race_start_immunity
+        self.overtake_interval = overtake_interval
+        self.overtake_grace = overtake_grace
+        self.leaderboard_interval = leaderboard_interval
+        self.battle_tracker = BattleTracker(confirm_time=battle_confirm)
+        self.incident_clusterer = IncidentClusterer(corner_index=self.corner_index)
+        self.reset()
+
+    def reset(self):
+        self.cars = {}
+        self.race_started = False
+        self.race_start_time = None
+        self.final_lap = False
+        self.winner = None
+        self.active = [] # Cars in the last tick, in the order they came
+        self.previous_positions = {}
+        self.last_overtake_check = 0.0
+        self.last_leaderboard = 0.0
+        self.reported_battles = {} # (car, car) -> when a battle between them was last reported
+        self.quiet_battles = set() # Pairs fighting again inside battle_repeat, not logged
+        self.battle_tracker.reset()
+        self.incident_clusterer.reset()
+
+    def set_corners(self, corners):
+        self.corner_index = corners if isinstance(corners, CornerIndex) else CornerIndex(corners)
+        self.incident_clusterer.set_corners(self.corner_index)
+
+    def _say(self, kind, **fields):
+        """The log line for kind, or None if this sim doesn't log it (tick() drops those events)."""
+        template = self.messages.get(kind)
+        return template.format(**fields) if template else None
+
+    def _corner_suffix(self, spline):
+        corner = self.corner_index.name_at(spline % 1.0) if self.corner_index else None
+        return f" at {corner}" if corner else ""
+
+    # --- Session control (driven by the adapter from the sim's own session state) ---
+
+    def start_race(self, now):
+        self.race_started = True
+        self.race_start_time = now
+        self.last_leaderboard = now
+        return [RaceEvent(RACE_START, now, self._say(RACE_START))]
+
+    def start_final_lap(self, now, total_laps=None):
+        """The leader has started the last lap (total_laps: the race distance, for lap-based races)."""
+        if self.final_lap or not self.race_started:
+            return []
+        self.final_lap = True
+        if total_laps and "final_lap_laps" in self.messages:
+            leader = self.cars.get(self.leader())
+            message = self.messages["final_lap_laps"].format(name=leader.name if leader else "", laps=leader.laps if leader else 0,
+                                                             total_laps=total_laps)
+        else:
+            message = self._say(FINAL_LAP)
+        return [RaceEvent(FINAL_LAP, now, message)]
+
+    def finish_race(self, now):
+        """The sim says the race is over: the current leader wins if nobody has crossed the line yet."""
+        if self.winner is not None or not self.race_started:
+            return []
+        leader = self.leader()
+        if leader is None:
+            return []
+        self.winner = leader
+        self.cars[leader].finished = True
+        return [RaceEvent(WINNER, now, self._say(WINNER, name=self.cars[leader].name), car=leader)]
+
+    def leader(self):
+        """car_id of P1 in the last tick, or None."""
+        for car_id in self.active:
+            if self.cars[car_id].position == 1:
+                return car_id
+        return None
+
+    def leaderboard(self, now, label="Current positions"):
+        cars = self.cars
+        ranked = sorted((cars[car_id].position, car_id) for car_id in self.active if cars[car_id].position > 0)
+        entries = [(position, self.cars[car_id].name) for position, car_id in ranked]
+        message = f"{label}: " + ", ".join(f"(P{position}) {name}" for position, name in entries)
+        return RaceEvent(LEADERBOARD, now, message, positions=entries)
+
+    # --- Per tick ---
+
+    def tick(self, frames, now):
+        """Processes one tick of CarFrames at session time `now` (seconds) and returns the new RaceEvents."""
+        events = []
+        cars = self.cars
+        track_length = self.track_length
+        elapsed = now - self.race_start_time if self.race_started else 0.0
+        watch_accidents = self.race_started and elapsed > self.race_start_immunity
+
+        for frame in frames:
+            state = cars.get(frame.car_id)
+            if state is None:
+                state = cars[frame.car_id] = _CarState(frame.name, frame.spline)
+            state.name = frame.name
+            state.speed = frame.speed
+
+            # Laps: trust the sim's count when it has one, otherwise count line crossings
+            crossed = False
+            if frame.laps is not None:
+                crossed = frame.laps > state.laps and state.last_spline is not None
+                state.laps = frame.laps
+            elif state.last_spline is not None and state.last_spline >= UPPER_THRESHOLD and frame.spline <= LOWER_THRESHOLD:
+                if not state.just_crossed:
+                    if state.skip_first_crossing:
+                        state.skip_first_crossing = False
+                    else:
+                        state.laps += 1
+                        crossed = True
+                    state.just_crossed = True
+            if frame.spline > LOWER_THRESHOLD:
+                state.just_crossed = False
+            state.last_spline = frame.spline
+            state.progress = state.laps + frame.spline
+
+            if state.finished:
+                continue
+
+            # Pits
+            if frame.in_pit != state.in_pit:
+                state.in_pit = frame.in_pit
+                if frame.in_pit:
+                    state.monitored = False
+                    events.append(RaceEvent(PIT_IN, now, self._say(PIT_IN, name=state.name), car=frame.car_id))
+                else:
+                    events.append(RaceEvent(PIT_OUT, now, self._say(PIT_OUT, name=state.name), car=frame.car_id))
+
+            # Accidents: a monitored car (one that's been up to speed) dropping below accident_speed
+            if watch_accidents and not state.in_pit:
+                if not state.monitored and not state.in_accident:
+                    state.monitored = frame.speed >= self.recovery_speed
+                elif state.monitored and frame.speed < self.accident_speed:
+                    state.monitored = False
+                    state.in_accident = True
+                    self.incident_clusterer.add(frame.car_id, state.name, frame.position or state.position, frame.spline, now)
+                elif state.in_accident and frame.speed > self.recovery_speed:
+                    state.in_accident = False
+                    state.monitored = True
+                    events.append(RaceEvent(RECOVERED, now, self._say(RECOVERED, name=state.name), car=frame.car_id))
+
+            # Finish: once the leader is on the final lap, the leader's next line crossing (or passing
+            # finish_spline) wins the race and every other car finishes at its next crossing after that
+            if not self.final_lap:
+                continue
+            if self.winner is None:
+                at_line = crossed if self.finish_spline is None else frame.spline > self.finish_spline
+                if at_line and (frame.position or state.position) == 1:
+                    state.finished = True
+                    self.winner = frame.car_id
+                    events.append(RaceEvent(WINNER, now, self._say(WINNER, name=state.name), car=frame.car_id))
+            elif crossed:
+                state.finished = True
+                position = frame.position or state.position
+                events.append(RaceEvent(FINISH, now, self._say(FINISH, name=state.name, position=position),
+                                        car=frame.car_id, position=position))
+
+        self.active = [frame.car_id for frame in frames]
+
+        # Positions: from the sim if given, otherwise by progress
+        if frames and all(frame.position for frame in frames):
+            for frame in frames:
+                cars[frame.car_id].position = frame.position
+        else:
+            ranked = sorted(frames, key=lambda frame: -cars[frame.car_id].progress)
+            for position, frame in enumerate(ranked, start=1):
+                cars[frame.car_id].position = position
+
+        events.extend(self._incident_events(self.incident_clusterer.flush(now)))
+
+        if self.race_started and not self.winner:
+            events.extend(self._overtakes(frames, now, elapsed))
+            events.extend(self._battles(frames, now, elapsed, track_length))
+            if now - self.last_leaderboard >= self.leaderboard_interval:
+                self.last_leaderboard = now
+                events.append(self.leaderboard(now))
+        return [event for event in events if event.message is not None]
+
+    def flush(self):
+        """
+        Accidents still waiting for more cars to join. Collectors call this before a reset and when
+        the session ends or they stop, so an incident right at the end isn't lost.
+        """
+        return self._incident_events(self.incident_clusterer.flush(None, force=True))
+
+    def _incident_events(self, incidents):
+        # Timed when the first car stopped, not when the incident was closed a couple of seconds later
+        return [RaceEvent(ACCIDENT, incident['time'], describe_incident(incident, self.messages[ACCIDENT]),
+                          cars=[car['car'] for car in incident['cars']], corner=incident['corner'])
+                for incident in incidents]
+
+    def _overtakes(self, frames, now, elapsed):
+        if elapsed < self.overtake_grace or now - self.last_overtake_check < self.overtake_interval:
+            return []
+        cars = self.cars
+        current_positions = {}
+        excluded = set()
+        for frame in frames:
+            state = cars[frame.car_id]
+            current_positions[frame.car_id] = state.position
+            if state.in_pit or state.finished:
+                excluded.add(frame.car_id)
+
+        events = []
+        if self.previous_positions:
+            for car_id, position, passed in resolve_overtakes(self.previous_positions, current_positions, excluded):
+                state = cars[car_id]
+                racing = []
+                where = self._corner_suffix(state.progress)
+                for other_id in passed:
+                    other = cars[other_id]
+                    if state.laps != other.laps and abs(state.progress - other.progress) > 0.5:
+                        events.append(RaceEvent(LAPPED, now, self._say(LAPPED, name=state.name, other=other.name, position=position, where=where),
+                                                car=car_id, other=other_id, position=position))
+                    else:
+                        racing.append(other_id)
+                if not racing:
+                    continue
+                names = [cars[other_id].name for other_id in racing]
+                fields = {'name': state.name, 'other': names[0], 'position': position, 'where': where,
+                          'others': names[0] if len(names) == 1 else f"{', '.join(names[:-1])} and {names[-1]}"}
+                kind = LEAD_CHANGE if position == 1 and self.previous_positions.get(racing[0]) == 1 else OVERTAKE
+                events.append(RaceEvent(kind, now, self._say(kind, **fields), car=car_id, others=racing, position=position))
+
+        self.previous_positions = current_positions
+        self.last_overtake_check = now
+        return events
+
+    def _battles(self, frames, now, elapsed, track_length):
+        if track_length <= 0 or elapsed <= self.race_start_immunity or not self.messages.get(BATTLE_START):
+            return [] # Sims that don't log battles don't track them
+        cars = self.cars
+        battle_cars = []
+        for frame in frames:
+            state = cars[frame.car_id]
+            if not state.in_pit and not state.finished:
+                battle_cars.append((frame.car_id, state.position, state.progress * track_length, frame.speed))
+
+        events = []
+        for kind, battle in self.battle_tracker.update(battle_cars, now):
+            if not self._report_battle(kind, battle, now):
+                continue
+            event_kind = BATTLE_KINDS[kind]
+            message = self._say(event_kind, leader=cars[battle['leader']].name, follower=cars[battle['follower']].name,
+                                position=battle['position'], gap=battle['gap'], duration=int(battle['duration']))
+            events.append(RaceEvent(event_kind, now, message, leader=battle['leader'], follower=battle['follower'],
+                                    position=battle['position']))
+        return events
+
+    def _report_battle(self, kind, battle, now):
+        """Debounces battle events per pair of cars, whichever of them is ahead."""
+        pair = tuple(sorted((battle['leader'], battle['follower'])))
+        if kind == "start":
+            last = self.reported_battles.get(pair)
+            if last is None or now - last >= self.battle_repeat:
+                self.reported_battles[pair] = now
+                self.quiet_battles.discard(pair)
+                return True
+            self.quiet_battles.add(pair)
+            return False
+        if pair in self.quiet_battles:
+            if kind == "end":
+                self.quiet_battles.discard(pair)
+                self.reported_battles[pair] = now # Still the same fight, so the wait starts again
+            return False
+        if kind == "end":
+            self.reported_battles[pair] = now
+        return True
+
+
+# --- Sim adapters: telemetry -> CarFrames ---
+
+AMS2_PIT_MODES = (1, 2, 4) # Driving into pits, in pit, in garage
+
+def ams2_frames(data, speed_offset=8):
+    """CarFrames from an AMS2 SharedMemory page (positions and laps come from the game). The safety car is left out."""
+    frames = []
+    track_length = data.mTrackLength
+    speeds = data.mSpeeds
+    pit_modes = data.mPitModes
+    for i in range(min(data.mNumParticipants, len(data.mParticipantInfo))):
+        participant = data.mParticipantInfo[i]
+        if not participant.mIsActive:
+            continue
+        try:
+            name = participant.mName.decode('utf-8').strip('\x00') or f"Car {i}"
+        except UnicodeDecodeError:
+            name = f"Car {i}"
+        if name == "Safety Car":
+            continue
+        spline = participant.mCurrentLapDistance / track_length if track_length > 0 else 0.0
+        speed = speeds[i + speed_offset] if i + speed_offset < len(speeds) else 0.0
+        in_pit = i < len(pit_modes) and pit_modes[i] in AMS2_PIT_MODES
+        frames.append(CarFrame(i, name, spline, speed, in_pit, participant.mRacePosition or None, participant.mLapsCompleted))
+    return frames
+
+
+def acc_frame(car):
+    """CarFrame from an entry of the ACC collector's cars dict (speed in km/h, laps counted by the engine)."""
+    return CarFrame(car['carIndex'], car.get('driverName', f"Car {car['carIndex']}"), car.get('splinePosition', 0.0),
+                    car.get('speed', 0) / 3.6, car.get('location') in ("Pitlane", "Pit Entry"))
+
+
+def ac_frame(car, lap_data):
+    """CarFrame from the AC collector's cars and car_lap_data entries (laps from LAP_COMPLETED)."""
+    return CarFrame(car['carIndex'], car.get('driverName', f"Car {car['carIndex']}"), lap_data.get('normalized_pos', 0.0),
+                    car.get('speed', 0) / 3.6, bool(car.get('isInPit')), laps=lap_data.get('laps', 0))
+
+
+# --- Golden replays ---
+
+EVENT_LINE = re.compile(r"^\d{2}:\d{2}:\d{2} - ")
+
+
+def replay(path, data_directory):
+    """
+    Runs a recorded session through its sim's collector (.ams2rec -> AMS2, .jsonl[.gz] -> ACC)
+    as fast as possible and returns the timecoded event lines it logged.
+    """
+    if path.endswith(".ams2rec"):
+        from data_collector_AMS2 import replay_recording
+    else:
+        from data_collector_ACC import replay_recording
+    return [line for line in replay_recording(path, data_directory) if EVENT_LINE.match(line)]
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+
+    # Golden check: python race_state_engine.py <recording> <golden.txt> [--update]
+    if len(sys.argv) < 3:
+        print("usage: python race_state_engine.py <recording.ams2rec|recording.jsonl.gz> <golden.txt> [--update]")
+        sys.exit(2)
+    recording, golden = sys.argv[1], sys.argv[2]
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as data_directory:
+        output = replay(recording, data_directory)
+    elapsed = time.perf_counter() - started
+    if "--update" in sys.argv:
+        with open(golden, 'w', encoding='utf-8') as f:
+            f.write("\n".join(output) + "\n")
+        print(f"Wrote {len(output)} events to {golden} ({elapsed:.2f}s)")
+        sys.exit(0)
+    with open(golden, 'r', encoding='utf-8') as f:
+        expected = f.read().splitlines()
+    if output == expected:
+        print(f"OK: {len(output)} events match {golden} ({elapsed:.2f}s)")
+        sys.exit(0)
+    for i, (got, want) in enumerate(zip(output + [""] * len(expected), expected + [""] * len(output))):
+        if got != want:
+            print(f"First difference at event {i + 1}:\n  expected: {want}\n  got:      {got}")
+            break
+    sys.exit(1)
@@ -1,13 +1,56 @@
 # second_pass_commentator.py
 from PyQt5.QtCore import QThread, pyqtSignal
-import anthropic
-from openai import OpenAI
 import os
 import re
+import threading
 import traceback # Import traceback
-# --- Add Google Gemini import ---
-import google.generativeai as genai
-# ------------------------------
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import llm_providers
+from llm_providers import BlockedResponse
+from llm_cache import get_response_cache
+
+# "HH:MM:SS - <COMMENTATE HERE IN N WORDS>" as written by VoiceGenerator.create_new_script
+PLACEHOLDER_PATTERN = re.compile(r"^(\d{2}:\d{2}:\d{2})\s*-\s*<COMMENTATE HERE IN (\d+) WORDS>\s*$")
+SCRIPT_LINE_PATTERN = re.compile(r"^(\d{2}:\d{2}:\d{2})\s*-\s*(.*)$")
+
+
+def extract_gaps(script_lines, context_lines=4):
+    """
+    Finds every placeholder in the script. Returns [(line index, timecode, words, context)], where
+    context is the placeholder with up to context_lines script lines either side (other
+    placeholders left out, so each request only sees its own gap).
+    """
+    gaps = []
+    for i, line in enumerate(script_lines):
+        match = PLACEHOLDER_PATTERN.match(line.strip())
+        if not match:
+            continue
+        before = [l for l in script_lines[:i] if l.strip() and not PLACEHOLDER_PATTERN.match(l.strip())][-context_lines:]
+        after = [l for l in script_lines[i + 1:i + 1 + context_lines * 3]
+                 if l.strip() and not PLACEHOLDER_PATTERN.match(l.strip())][:context_lines]
+        context = "\n".join(before + [line.strip()] + after)
+        gaps.append((i, match.group(1), int(match.group(2)), context))
+    return gaps
+
+
+def parse_gap_response(response, timecode):
+    """
+    The commentary for the gap at timecode from a response: its "HH:MM:SS - text" line (the model
+    may echo the context lines around it too), or the whole reply if it has no timecoded lines.
+    "" if there's none.
+    """
+    timecoded = False
+    for line in response.splitlines():
+        match = SCRIPT_LINE_PATTERN.match(line.strip())
+        if not match:
+            continue
+        timecoded = True
+        if match.group(1) == timecode and "<COMMENTATE HERE" not in match.group(2):
+            return match.group(2).strip()
+    if timecoded:
+        return "" # Only other lines of the script, nothing for this gap
+    text = " ".join(line.strip() for line in response.splitlines() if line.strip())
+    return "" if not text or "<COMMENTATE HERE" in text or text.startswith("Blocked by API") else text
 
 
 class SecondPassCommentator(QThread):
@@ -20,44 +63,10 @@ class SecondPassCommentator(QThread):
         self.output_path = None
         # Ensure settings is a dictionary, even if None is passed
         self.settings = settings if isinstance(settings, dict) else {}
-        self.client = None # Initialize client to None
 
-        # Initialize appropriate client based on settings
         api_type = self.settings.get("api") # Get API type
         # Use print initially as signals might not be connected yet
-        print(f"[SecondPass Init] Using API type: {api_type}")
-
-        try:
-            if api_type == "claude":
-                claude_key = self.settings.get("claude_key")
-                if claude_key:
-                    self.client = anthropic.Anthropic(api_key=claude_key)
-                    print("[SecondPass Init] Claude client initialized.")
-                else:
-                    print("Error [SecondPass Init]: Claude API Key missing in settings.")
-            elif api_type == "openai":
-                openai_key = self.settings.get("openai_key")
-                if openai_key:
-                    self.client = OpenAI(api_key=openai_key)
-                    print("[SecondPass Init] OpenAI client initialized.")
-                else:
-                    print("Error [SecondPass Init]: OpenAI API Key missing in settings.")
-            elif api_type == "gemini":
-                google_key = self.settings.get("google_key")
-                if not google_key:
-                    print("Error [SecondPass Init]: Google API Key missing in settings for Gemini.")
-                else:
-                    try:
-                         genai.configure(api_key=google_key)
-                         print("[SecondPass Init] Gemini API key seems valid (configuration successful).")
-                    except Exception as gemini_init_e:
-                         print(f"Error [SecondPass Init]: Failed to configure Gemini API: {gemini_init_e}")
-            else:
-                print(f"Warning [SecondPass Init]: Unknown API type '{api_type}'. No client initialized.")
-
-        except Exception as client_init_e:
-             print(f"Error [SecondPass Init]: Failed during API client initialization: {client_init_e}")
-             self.client = None
+        print(f"[SecondPass Init] Using API type: {api_type} (shared client from llm_providers)")
 
         # --- Load Prompt ---
         self.prompt = self.settings.get('second_pass_prompt')
@@ -74,6 +83,13 @@ class SecondPassCommentator(QThread):
                             "commentary fitting the time gap and word count indicated. Maintain the original timecodes. "
                             "ONLY output the filled script lines, do not add any explanation.")
         print(f"[SecondPass Init] Loaded prompt from: {prompt_source}")
+        self.cache = get_response_cache()
+        # Fill each placeholder with its own small request, several at once, instead of the whole script in one
+        self.gap_mode = self.settings.get("second_pass_gaps", True)
+        self.gap_context_lines = int(self.settings.get("gap_context_lines", 4))
+        self.max_workers = int(self.settings.get("max_workers", 4))
+        self.gap_usage = llm_providers.new_usage()
+        self.usage_lock = threading.Lock()
         # --------------------
 
 
@@ -85,8 +101,8 @@ class SecondPassCommentator(QThread):
         try:
             # --- Pre-checks ---
             api_type = self.settings.get("api")
-            if api_type == "claude" and not self.client: raise Exception("Claude client not initialized.")
-            if api_type == "openai" and not self.client: raise Exception("OpenAI client not initialized.")
+            if api_type == "claude" and not self.settings.get("claude_key"): raise Exception("Claude API key missing.")
+            if api_type == "openai" and not self.settings.get("openai_key"): raise Exception("OpenAI API key missing.")
             if api_type == "gemini" and not self.settings.get("google_key"): raise Exception("Google API key missing for Gemini.")
             if not self.prompt: raise Exception("Second pass prompt is missing.")
             # ----------------
@@ -96,7 +112,11 @@ class SecondPassCommentator(QThread):
             self.progress_signal.emit(25)
 
             self.output_signal.emit(f"[SecondPass Run] Generating commentary using API: {api_type}")
-            commentary = self.generate_commentary(race_data)
+            gaps = extract_gaps(race_data.splitlines(), self.gap_context_lines) if self.gap_mode else []
+            if gaps:
+                commentary = self.fill_gaps(race_data.splitlines(), gaps)
+            else:
+                commentary = self.generate_commentary(race_data)
 
             # --- Check AI Response ---
             if commentary is None or commentary == "" or "Blocked by API" in commentary:
@@ -118,6 +138,8 @@ class SecondPassCommentator(QThread):
             # --- Final Status Log ---
             if self.output_path and os.path.exists(self.output_path):
                 self.output_signal.emit(f"[SecondPass Run] Completed. Output saved to: {self.output_path}")
+                if self.settings.get("use_cache", True) and self.cache.enabled:
+                    self.output_signal.emit(f"[SecondPass Run] {self.cache.summary()}")
             else:
                  self.output_signal.emit(f"[SecondPass Run] Completed, but saving appears to have failed. Expected output path was: {getattr(self, '_intended_output_path', self.output_path)}") # Log intended path if save failed
 
@@ -162,115 +184,103 @@ class SecondPassCommentator(QThread):
 
 
     def generate_commentary(self, race_data):
-        """Calls the appropriate AI generation method based on settings."""
+        """Calls the appropriate AI generation method, reusing the cached response for an identical request."""
+        if not self.settings.get("use_cache", True):
+            return self._generate_uncached(race_data)
+        commentary, from_cache = self.cache.cached(
+            ("SecondPassCommentator", self.settings.get("api"), self.settings.get("model"), 0.7, self.prompt, race_data),
+            lambda: self._generate_uncached(race_data), self.output_signal.emit)
+        if from_cache:
+            self.output_signal.emit("[SecondPass Generate] Using cached response (identical request).")
+        return commentary
+
+    def _generate_uncached(self, race_data):
         api_type = self.settings.get("api")
         self.output_signal.emit(f"[SecondPass Generate] Calling API: {api_type}, Model: {self.settings.get('model')}")
-        if api_type == "claude":
-            return self._generate_with_claude(race_data)
-        elif api_type == "openai":
-            return self._generate_with_openai(race_data)
-        elif api_type == "gemini":
-            return self._generate_with_gemini(race_data)
-        else:
-            self.output_signal.emit(f"Error [SecondPass Generate]: Unknown API type '{api_type}'.")
-            return ""
-
-
-    def _generate_with_claude(self, race_data):
-        """Generates filled commentary using Claude."""
-        if not self.client: self.output_signal.emit("Error [SecondPass Claude]: Client not initialized."); return ""
-        if not self.prompt: self.output_signal.emit("Error [SecondPass Claude]: Prompt not loaded."); return ""
+        if not self.prompt: self.output_signal.emit("Error [SecondPass Generate]: Prompt not loaded."); return ""
+        user_content = (f"Here is the commentary script with placeholders to fill:\n\n<script>\n{race_data}\n</script>\n\n"
+                        "Fill the placeholders according to the instructions in the system prompt, providing only the completed script.")
         try:
-            self.output_signal.emit("[SecondPass Claude] Sending request...")
-            response = self.client.messages.create(
-                model=self.settings.get("model", "claude-3-haiku-20240307"),
-                max_tokens=8000, temperature=0.7, system=self.prompt,
-                messages=[{"role": "user", "content": f"Here is the commentary script with placeholders to fill:\n\n<script>\n{race_data}\n</script>\n\nFill the placeholders according to the instructions in the system prompt, providing only the completed script."}]
-            )
-            content = response.content[0].text if isinstance(response.content, list) and response.content else ""
-            if not content: self.output_signal.emit("Warning [SecondPass Claude]: Received empty content.")
-            else: self.output_signal.emit("[SecondPass Claude] Received non-empty response.")
+            content = llm_providers.complete(
+                self.settings, self.prompt, user_content, temperature=0.7,
+                max_tokens=4090 if api_type == "openai" else 8000,
+                safety_threshold="BLOCK_NONE", on_retry=self._on_retry, on_usage=self._on_usage)
+            if not content: self.output_signal.emit(f"Warning [SecondPass Generate]: Received empty content from {api_type}.")
+            else: self.output_signal.emit(f"[SecondPass Generate] Received non-empty response from {api_type}.")
             return content.strip()
+        except BlockedResponse as e:
+            self.output_signal.emit(f"Warning [SecondPass Generate]: Response BLOCKED. Reason: {e}")
+            return f"Blocked by API: {e}"
         except Exception as e:
-            self.output_signal.emit(f"Error [SecondPass Claude]: {str(e)}")
+            self.output_signal.emit(f"Error [SecondPass Generate]: {str(e)}")
             self.output_signal.emit(traceback.format_exc())
             return ""
 
+    def fill_gaps(self, script_lines, gaps):
+        """
+        Fills every placeholder concurrently and splices each result back in at the placeholder's
+        timecode. A gap that fails keeps its placeholder (dropped when saving), so the rest of the
+        pass still goes through. Returns the full script.
+        """
+        count = len(gaps)
+        self.output_signal.emit(f"[SecondPass Gaps] Filling {count} gaps, {min(self.max_workers, count)} at a time...")
+        filled = 0
+        lines = list(script_lines)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.fill_gap, timecode, words, context): (index, timecode)
+                       for index, timecode, words, context in gaps}
+            for done, future in enumerate(as_completed(futures), start=1):
+                index, timecode = futures[future]
+                try:
+                    text = future.result()
+                except Exception as e:
+                    self.output_signal.emit(f"Error [SecondPass Gaps]: Gap at {timecode} failed: {e}")
+                    text = ""
+                if text:
+                    lines[index] = f"{timecode} - {text}"
+                    filled += 1
+                self.progress_signal.emit(25 + int(50 * done / count))
+        self.output_signal.emit(f"[SecondPass Gaps] Filled {filled}/{count} gaps.")
+        if self.gap_usage["input_tokens"]:
+            self.output_signal.emit(f"[SecondPass Gaps] API usage: {llm_providers.format_usage(self.gap_usage)}")
+        return "\n".join(lines) if filled else ""
+
+    def fill_gap(self, timecode, words, context):
+        """Commentary text for one placeholder (from the cache for an identical request), or "" on failure."""
+        user_content = (f"Here is the part of the commentary script around one gap:\n\n<script>\n{context}\n</script>\n\n"
+                        f"Write the commentary for the <COMMENTATE HERE IN {words} WORDS> line at {timecode}, "
+                        "following the instructions in the system prompt. Reply with that one line only, "
+                        f"as '{timecode} - your commentary'.")
+        generate = lambda: self._generate_gap_uncached(timecode, words, user_content)
+        if self.settings.get("use_cache", True):
+            response, _from_cache = self.cache.cached(
+                ("SecondPassGap", self.settings.get("api"), self.settings.get("model"), 0.7, self.prompt, user_content), generate,
+                self.output_signal.emit)
+        else:
+            response = generate()
+        return parse_gap_response(response or "", timecode)
 
-    def _generate_with_openai(self, race_data):
-        """Generates filled commentary using OpenAI."""
-        if not self.client: self.output_signal.emit("Error [SecondPass OpenAI]: Client not initialized."); return ""
-        if not self.prompt: self.output_signal.emit("Error [SecondPass OpenAI]: Prompt not loaded."); return ""
+    def _generate_gap_uncached(self, timecode, words, user_content):
         try:
-            self.output_signal.emit("[SecondPass OpenAI] Sending request...")
-            messages = [
-                {"role": "system", "content": self.prompt},
-                {"role": "user", "content": f"Here is the commentary script with placeholders to fill:\n\n<script>\n{race_data}\n</script>\n\nFill the placeholders according to the instructions in the system prompt, providing only the completed script."}
-            ]
-            kwargs = {"model": self.settings.get("model", "gpt-4o-mini"), "messages": messages, "temperature": 0.7, "max_tokens": 4090}
-            response = self.client.chat.completions.create(**kwargs)
-            content = response.choices[0].message.content if response.choices and response.choices[0].message else ""
-            if not content: self.output_signal.emit("Warning [SecondPass OpenAI]: Received empty content.")
-            else: self.output_signal.emit("[SecondPass OpenAI] Received non-empty response.")
-            return content.strip()
+            return llm_providers.complete(
+                self.settings, self.prompt, user_content, temperature=0.7, max_tokens=max(256, words * 4),
+                safety_threshold="BLOCK_NONE", on_retry=self._on_retry, on_usage=self._on_gap_usage).strip()
+        except BlockedResponse as e:
+            self.output_signal.emit(f"Warning [SecondPass Gaps]: Gap at {timecode} BLOCKED. Reason: {e}")
+            return f"Blocked by API: {e}"
         except Exception as e:
-            self.output_signal.emit(f"Error [SecondPass OpenAI]: {str(e)}")
-            self.output_signal.emit(traceback.format_exc())
+            self.output_signal.emit(f"Error [SecondPass Gaps]: Gap at {timecode}: {str(e)}")
             return ""
 
+    def _on_retry(self, attempt, delay, error):
+        self.output_signal.emit(f"[SecondPass Generate] API busy ({type(error).__name__}), retry {attempt} in {delay:.1f}s...")
 
-    def _generate_with_gemini(self, race_data):
-        """Generates second pass commentary using the Google Gemini API."""
-        api_key = self.settings.get("google_key")
-        if not api_key: self.output_signal.emit("Error [SecondPass Gemini]: Google API Key missing."); return ""
-        if not self.prompt: self.output_signal.emit("Error [SecondPass Gemini]: Prompt not loaded."); return ""
-        try:
-            self.output_signal.emit("[SecondPass Gemini] Configuring client...")
-            genai.configure(api_key=api_key)
-            model_name = self.settings.get("model", "gemini-1.5-flash-latest")
-            model = genai.GenerativeModel(model_name)
-            self.output_signal.emit(f"[SecondPass Gemini] Sending request to model: {model_name}...")
-
-            full_prompt = (f"{self.prompt}\n\nHere is the commentary script...\n<script>\n{race_data}\n</script>\n\nFill placeholders...")
-            safety_settings = [{"category": c, "threshold": "BLOCK_NONE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
-            generation_config = genai.types.GenerationConfig(temperature=0.7)
-
-            response = model.generate_content(full_prompt, generation_config=generation_config, safety_settings=safety_settings)
-
-            response_text = ""
-            try:
-                 if response.parts: response_text = response.text.strip()
-                 if response.prompt_feedback and response.prompt_feedback.block_reason:
-                     block_reason = response.prompt_feedback.block_reason
-                     self.output_signal.emit(f"Warning [SecondPass Gemini]: Response BLOCKED. Reason: {block_reason}")
-                     return f"Blocked by API: {block_reason}"
-                 elif not response_text and hasattr(response, 'text'):
-                      try: response_text = response.text.strip()
-                      except ValueError: response_text = ""
-                 if not response_text:
-                     self.output_signal.emit("Warning [SecondPass Gemini]: Received empty content.")
-                     try: self.output_signal.emit(f"[SecondPass Gemini] Full Response Object (for debug): {response}")
-                     except: pass
-                 else:
-                      self.output_signal.emit("[SecondPass Gemini] Received non-empty response.")
-
-            except ValueError as ve:
-                 self.output_signal.emit(f"Warning [SecondPass Gemini]: Error accessing response text: {ve}")
-                 if response.prompt_feedback and response.prompt_feedback.block_reason:
-                      block_reason = response.prompt_feedback.block_reason
-                      self.output_signal.emit(f"Warning [SecondPass Gemini]: Response BLOCKED (detected during text access error). Reason: {block_reason}")
-                      return f"Blocked by API: {block_reason}"
-                 response_text = ""
-            except Exception as resp_err:
-                 self.output_signal.emit(f"Error [SecondPass Gemini]: Unexpected error accessing response content: {resp_err}")
-                 response_text = ""
-
-            return response_text
+    def _on_usage(self, usage):
+        self.output_signal.emit(f"[SecondPass Generate] API usage: {llm_providers.format_usage(usage)}")
 
-        except Exception as e:
-            self.output_signal.emit(f"Error [SecondPass Gemini]: {str(e)}")
-            self.output_signal.emit(traceback.format_exc())
-            return ""
+    def _on_gap_usage(self, usage):
+        with self.usage_lock:
+            llm_providers.add_usage(self.gap_usage, usage)
 
 
     def save_commentary(self, commentary):
@@ -0,0 +1,133 @@
+import socket
+import time
+from types import SimpleNamespace
+from ac_shared_memory import AC_STATUS_LIVE
+from data_collector_AC import AC_LAP_COMPLETED, LAP_COMPLETED_STRUCT, PACKET_TYPE_STRUCT, DataCollector
+
+
+def _lap_packet(car_id):
+    return PACKET_TYPE_STRUCT.pack(AC_LAP_COMPLETED) + LAP_COMPLETED_STRUCT.pack(car_id, 90000, 0)
+
+
+def test_failing_packet_does_not_stop_the_drain():
+    collector = DataCollector(port=0)
+    handled = []
+
+    def handler(fields):
+        if fields[0] == 2:
+            raise ValueError("bad packet")
+        handled.append(fields[0])
+
+    collector.packet_dispatcher.register(AC_LAP_COMPLETED, "LAP_COMPLETED", LAP_COMPLETED_STRUCT, handler)
+    lines = []
+    collector.output_signal.connect(lines.append)
+    assert collector.setup_udp_socket()
+    port = collector.udp_socket.getsockname()[1]
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            for car_id in (1, 2, 3):
+                sender.sendto(_lap_packet(car_id), ("127.0.0.1", port))
+        time.sleep(0.1)
+        assert collector.receive_and_process_packet(timeout=1.0) == 3
+    finally:
+        collector.udp_socket.close()
+
+    assert handled == [1, 3]
+    assert collector.packet_dispatcher.errors == 1
+    assert collector.backlog_stats['drains'] == 1 and collector.backlog_stats['packets'] == 3
+    assert "Error processing UDP packet: bad packet" in lines
+
+
+def _name(text, size=50):
+    return text.encode('utf-16le').ljust(size, b'\x00')
+
+
+def test_lap_based_race_finishes_on_the_last_lap(tmp_path):
+    collector = DataCollector(port=0)
+    collector.data_directory = str(tmp_path)
+    lines = []
+    collector.output_signal.connect(lines.append)
+    track_length, race_laps = 1000.0, 3
+    speeds = {0: 50.0, 1: 45.0, 2: 40.0} # m/s
+    for car_id in speeds:
+        collector._handle_car_info((car_id, 1, _name("car"), _name("skin"), _name(f"Driver {car_id}"), _name("team"), _name("guid")))
+    collector._handle_session_info((4, 2, 2, 3, 0, 0, _name("server"), _name("ring"), _name(""), _name("", 100), _name("team"),
+                                    _name("car"), 20.0, 25.0, 3, 0.0, 0.0, track_length, 1, race_laps))
+    collector.initialization_complete = True
+
+    distances = {car_id: -5.0 * car_id for car_id in speeds}
+    for step in range(1, 1000):
+        now = step * 0.5
+        for car_id, speed in speeds.items():
+            before = distances[car_id]
+            distances[car_id] += speed * 0.5
+            if before >= 0 and int(distances[car_id] // track_length) > int(before // track_length):
+                collector._handle_lap_completed((car_id, 20000, 0))
+            spline = (distances[car_id] % track_length) / track_length
+            collector._handle_realtime_update((car_id, spline, 0, 0, 0, 0, 0, distances[car_id], speed * 3.6, 0.0, speed,
+                                               0, 0, 0.0, 0.0, 0.0))
+        collector.update_race_state(now)
+        if any("has finished in position 3" in line for line in lines):
+            break
+
+    events = [line.split(" - ", 1)[1] for line in lines if " - " in line]
+    winner = events.index("Checkered flag! Driver 0 takes the win!")
+    assert events.index(f"Lap {race_laps} completed by Driver 0: 00:20.000") < winner
+    final_lap = events.index(f"Leader Driver 0 is starting the final lap ({race_laps - 1}/{race_laps})!")
+    assert final_lap < events.index(f"Lap {race_laps} completed by Driver 0: 00:20.000")
+    assert events[winner + 1:].count("Driver 1 has finished in position 2.") == 1
+    assert "Driver 2 has finished in position 3." in events[winner + 1:]
+
+
+def _session_info(player, race_laps=3):
+    return (4, 2, 2, 3, 0, 0, _name("server"), _name("ring"), _name(""), _name(player, 100), _name("team"),
+            _name("car"), 20.0, 25.0, 3, 0.0, 0.0, 1000.0, 1, race_laps)
+
+
+class _FakeMemorySource:
+    description = "fake pages"
+
+    def __init__(self, player):
+        first, last = player.split()
+        static = SimpleNamespace(track=_name(""), trackConfiguration=_name(""), trackSPlineLength=0.0,
+                                 playerName=_name(first, 66), playerSurname=_name(last, 66), carModel=_name("car", 66))
+        graphics = SimpleNamespace(status=AC_STATUS_LIVE, carCoordinates=(1.0, 2.0, 3.0), normalizedCarPosition=0.25,
+                                   iCurrentTime=1000, iLastTime=0, iBestTime=0, completedLaps=0, distanceTraveled=250.0,
+                                   isInPit=0, isInPitLane=0)
+        physics = SimpleNamespace(speedKmh=180.0, pitLimiterOn=0)
+        self.pages = SimpleNamespace(physics=physics, graphics=graphics, static=static,
+                                     physics_changed=True, graphics_changed=True, static_changed=True)
+
+    def read(self):
+        return self.pages
+
+
+def _collector_with_cars(tmp_path, memory_source=None):
+    collector = DataCollector(port=0, memory_source=memory_source)
+    collector.data_directory = str(tmp_path)
+    for car_id, driver in ((0, "Ann Other"), (1, "Sam Player"), (2, "Max Rival")):
+        collector._handle_car_info((car_id, 1, _name("car"), _name("skin"), _name(driver), _name("team"), _name("guid")))
+    return collector
+
+
+def test_player_car_is_matched_by_name_from_session_info(tmp_path):
+    collector = _collector_with_cars(tmp_path)
+    assert collector.player_car_id is None
+    collector._handle_session_info(_session_info("sam  player"))
+    assert collector.player_car_id == 1
+
+
+def test_shared_memory_feeds_only_the_players_own_car(tmp_path):
+    collector = _collector_with_cars(tmp_path, _FakeMemorySource("Sam Player"))
+    collector.poll_shared_memory()
+    assert collector.player_car_id == 1
+    assert collector.cars[1]['splinePosition'] == 0.25
+    assert 'splinePosition' not in collector.cars[0]
+
+    unknown = _collector_with_cars(tmp_path, _FakeMemorySource("Not Racing"))
+    lines = []
+    unknown.output_signal.connect(lines.append)
+    unknown.poll_shared_memory()
+    assert unknown.player_car_id is None
+    assert not any('splinePosition' in car for car in unknown.cars.values())
+    assert "No UDP car is driven by Not Racing yet, using UDP data only" in lines
@@ -0,0 +1,78 @@
+import itertools
+import time
+from ams2_memory_source import create_memory_source, synthetic_session
+from ams2_recorder import ReplayMemorySource, record_session
+from data_collector_AMS2 import DataCollector
+from event_bus import get_event_bus
+from race_state_engine import ACCIDENT, BATTLE_START, PIT_IN, RACE_START, WINNER
+
+FRAME_TIME = 0.2
+
+
+def _record(tmp_path, frames):
+    path = str(tmp_path / "race.ams2rec")
+    record_session(synthetic_session(num_cars=12, frames=frames, frame_time=FRAME_TIME), path, frame_time=FRAME_TIME)
+    return path
+
+
+def _collect(source, tmp_path):
+    collector = DataCollector(memory_source=source)
+    collector.data_directory = str(tmp_path / "Race Data")
+    lines = []
+    collector.output_signal.connect(lines.append)
+    started = time.perf_counter()
+    collector.run()
+    return lines, time.perf_counter() - started, collector
+
+
+def test_fast_replay_runs_well_under_real_time(tmp_path):
+    frames = 300 # A minute of racing
+    path = _record(tmp_path, frames)
+    lines, elapsed, collector = _collect(create_memory_source(f"replay-fast:{path}"), tmp_path)
+
+    assert collector.poll_interval == 0
+    assert "Memory source exhausted." in lines
+    assert any(" - Race has started!" in line for line in lines)
+    assert elapsed < frames * FRAME_TIME / 10
+
+
+def test_real_time_replay_paces_itself(tmp_path):
+    frames = 10
+    path = _record(tmp_path, frames)
+    source = ReplayMemorySource(path, speed=4.0)
+    _lines, elapsed, collector = _collect(source, tmp_path)
+
+    assert collector.poll_interval == 0 # The replay sleeps, not the collector
+    assert elapsed >= (frames - 1) * FRAME_TIME / 4.0 * 0.9
+
+
+def test_incident_open_when_the_recording_ends_is_logged(tmp_path):
+    frames = 400
+    crash_frame = frames // 2 # synthetic_session(incidents=True) crashes P4 and P5 half way through
+    path = str(tmp_path / "crash.ams2rec")
+    session = itertools.islice(synthetic_session(num_cars=12, frames=frames, frame_time=FRAME_TIME, incidents=True), crash_frame + 3)
+    record_session(session, path, frame_time=FRAME_TIME)
+    lines, _elapsed, _collector = _collect(create_memory_source(f"replay-fast:{path}"), tmp_path)
+
+    accidents = [line for line in lines if " - Accident! Collision involving" in line]
+    assert len(accidents) == 1
+    started = (5 - 1) * FRAME_TIME # Race state goes to RACING on frame 5 (first frame is t=0)
+    assert accidents[0].startswith(f"00:00:{int(crash_frame * FRAME_TIME - started - FRAME_TIME):02d} - ")
+
+
+def test_bus_events_carry_the_kind_they_were_logged_with(tmp_path):
+    path = str(tmp_path / "crash.ams2rec")
+    record_session(synthetic_session(num_cars=12, frames=400, frame_time=FRAME_TIME, incidents=True), path, frame_time=FRAME_TIME)
+    bus = get_event_bus()
+    events = []
+    token = bus.subscribe(events.append)
+    try:
+        _collect(create_memory_source(f"replay-fast:{path}"), tmp_path)
+    finally:
+        bus.unsubscribe(token)
+
+    kinds = {event['kind'] for event in events}
+    assert {RACE_START, BATTLE_START, ACCIDENT, WINNER} <= kinds
+    assert PIT_IN not in kinds # The AMS2 collector has never reported pit stops
+    accident = next(event for event in events if event['kind'] == ACCIDENT)
+    assert accident['source'] == "AMS2" and len(accident['cars']) == 2
@@ -0,0 +1,62 @@
+from data_filterer import merge_window_results, split_into_windows
+from log_compactor import LogCompactor
+
+
+def test_same_second_events_in_one_window_are_all_kept():
+    results = [(0, 600, "00:01:05 - Accident! Driver 3 has stopped at Turn 1\n"
+                        "00:01:05 - Overtake! Driver 4 passes Driver 3 for P3")]
+    assert merge_window_results(results) == [
+        "00:01:05 - Accident! Driver 3 has stopped at Turn 1",
+        "00:01:05 - Overtake! Driver 4 passes Driver 3 for P3",
+    ]
+
+
+def test_overlap_repeats_are_dropped_but_new_overlap_events_kept():
+    results = [
+        (0, 600, "00:09:50 - Battle brewing! A defends P2 from B\n"
+                 "00:10:05 - Overtake! B passes A for P2\n" # Overlap, also reported by the owner
+                 "00:10:20 - C has entered the pits."), # Overlap, missed by the owner
+        (600, None, "00:10:05 - overtake!  B passes A for P2\n"
+                    "00:10:05 - Incident: D spins at Turn 4\n"
+                    "00:12:00 - Checkered flag! B takes the win!"),
+    ]
+    assert merge_window_results(results) == [
+        "00:09:50 - Battle brewing! A defends P2 from B",
+        "00:10:05 - overtake!  B passes A for P2",
+        "00:10:05 - Incident: D spins at Turn 4",
+        "00:10:20 - C has entered the pits.",
+        "00:12:00 - Checkered flag! B takes the win!",
+    ]
+
+
+def test_overlap_events_survive_a_failed_owner_window():
+    windows = split_into_windows("00:00:10 - a\n00:10:30 - b\n00:25:00 - c\n", 600, 60)
+    assert [(start, end) for start, end, _text in windows] == [(10, 610), (610, 1210), (1210, None)]
+    results = [(10, 610, "00:00:10 - a\n00:10:30 - b"), (1210, None, "00:25:00 - c")] # Middle window failed
+    assert merge_window_results(results) == ["00:00:10 - a", "00:10:30 - b", "00:25:00 - c"]
+
+
+def test_untimed_lines_stay_with_the_event_above_them():
+    results = [
+        (10, 610, "Race summary:\n00:00:10 - Race Begins\n00:10:30 - Pit stop: B\n  (drive-through penalty)"),
+        (610, None, "Leaderboard:\n00:11:00 - Current positions: (P1) A, (P2) B"),
+    ]
+    assert merge_window_results(results) == [
+        "Race summary:",
+        "00:00:10 - Race Begins",
+        "Leaderboard:", # Placed at its window's start, 00:10:10
+        "00:10:30 - Pit stop: B",
+        "(drive-through penalty)",
+        "00:11:00 - Current positions: (P1) A, (P2) B",
+    ]
+
+def test_every_window_of_a_compacted_log_starts_with_a_full_leaderboard():
+    log = "".join(f"00:{minute:02}:00 - Current positions: (P1) Alice Adams, (P2) Bob Brown, (P3) Carl Clark\n" for minute in range(0, 30, 5))
+    windows = split_into_windows(log, 600, 60)
+    compacted = LogCompactor().compact(log, restarts=[start for start, _end, _text in windows[1:]])
+    compacted_windows = split_into_windows(compacted, 600, 60)
+    assert [(start, end) for start, end, _text in compacted_windows] == [(start, end) for start, end, _text in windows]
+    for _start, _end, text in compacted_windows:
+        lines = text.splitlines()
+        assert lines[0] == f"{lines[0][:8]} - Current positions: (P1) Alice Adams, (P2) Bob Brown, (P3) Carl Clark"
+        assert "unchanged since" in lines[1] # Still condensed within the window
@@ -0,0 +1,17 @@
+import pytest
+
+from llm_cache import ResponseCache
+
+
+def test_a_failed_store_is_reported_and_the_response_still_returned(tmp_path):
+    blocker = tmp_path / "cache"
+    blocker.write_text("a file where the cache directory should be")
+    cache = ResponseCache(str(blocker))
+
+    errors = []
+    assert cache.cached(("stage", "prompt"), lambda: "00:00:10 - Lights out!", errors.append) == ("00:00:10 - Lights out!", False)
+    assert len(errors) == 1 and errors[0].startswith("LLM cache write failed:")
+    assert cache.stats['stores'] == 0
+
+    with pytest.raises(OSError):
+        cache.cached(("stage", "prompt"), lambda: "00:00:10 - Lights out!")
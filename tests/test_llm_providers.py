@@ -0,0 +1,22 @@
+import threading
+
+import llm_providers
+
+
+def test_a_slow_stream_consumer_does_not_hold_the_concurrency_slot(monkeypatch):
+    def fake_stream_once(settings, system, user, temperature, max_tokens, safety_threshold, usage_out, cache_prefix=None):
+        yield from ("00:00:10 - one\n", "00:00:20 - two\n")
+
+    monkeypatch.setattr(llm_providers, "_stream_once", fake_stream_once)
+    monkeypatch.setitem(llm_providers._semaphores, "mock", threading.BoundedSemaphore(1))
+    settings = {"api": "mock", "model": "mock"}
+
+    stalled = llm_providers.stream(settings, "system", "user")
+    assert next(stalled) == "00:00:10 - one\n" # ...and the caller stops reading for now
+
+    second = []
+    reader = threading.Thread(target=lambda: second.extend(llm_providers.stream(settings, "system", "user")), daemon=True)
+    reader.start()
+    reader.join(timeout=5)
+    assert second == ["00:00:10 - one\n", "00:00:20 - two\n"]
+    assert list(stalled) == ["00:00:20 - two\n"]
@@ -0,0 +1,47 @@
+import llm_providers
+from llm_cache import ResponseCache
+from mock_backends import mock_llm
+from race_commentator import RaceCommentator
+
+SETTINGS = {"api": "mock", "model": "mock", "mock_latency": 0, "mock_tokens_per_second": 1e6,
+            "main_prompt": "You are a race commentator.", "repair_missing": False}
+
+
+def _run(tmp_path, **extra):
+    commentator = RaceCommentator(str(tmp_path / "race_filtered.txt"), dict(SETTINGS, **extra))
+    commentator.cache = ResponseCache(str(tmp_path / "cache"))
+    lines = []
+    commentator.output_signal.connect(lines.append)
+    commentator.run()
+    return lines
+
+
+def test_batch_and_single_persona_requests_are_cached_separately(tmp_path):
+    (tmp_path / "race_filtered.txt").write_text("00:00:00 - The Race Begins!\n00:01:10 - Overtake! A passes B for P1\n")
+    mock_llm.reset_stats()
+
+    _run(tmp_path)
+    batch = _run(tmp_path, shared_log_prefix=True, output_tag="Geoff")
+    assert mock_llm.calls == 2
+    assert not any("Using cached commentary" in line for line in batch)
+
+    repeat = _run(tmp_path, shared_log_prefix=True, output_tag="Geoff")
+    assert mock_llm.calls == 2
+    assert any("Using cached commentary" in line for line in repeat)
+
+
+def test_interrupted_stream_keeps_its_lines_and_repairs_the_rest(tmp_path, monkeypatch):
+    (tmp_path / "race_filtered.txt").write_text("00:00:00 - The Race Begins!\n00:01:10 - Overtake! A passes B for P1\n")
+
+    def interrupted(*_args, **_kwargs):
+        yield "00:00:00 - And they're away!\n"
+        raise ConnectionError("stream dropped")
+    monkeypatch.setattr(llm_providers, "stream", interrupted)
+    lines = _run(tmp_path, repair_missing=True)
+
+    assert any("stream dropped" in line for line in lines)
+    assert "Recovered commentary for 1/1 missing events." in lines
+    commentary = (tmp_path / "race_filtered_commentary.txt").read_text().splitlines()
+    assert commentary[0] == "00:00:00 - And they're away!"
+    assert commentary[1].startswith("00:01:10 - ")
+    assert len(list((tmp_path / "cache").rglob("*.txt"))) == 1 # The repair call, not the cut-off stream
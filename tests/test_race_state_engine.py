@@ -0,0 +1,127 @@
+import os
+import pytest
+from race_state_engine import (AC_MESSAGES, ACC_MESSAGES, ACCIDENT, AMS2_MESSAGES, BATTLE_END, BATTLE_START, FINISH, OVERTAKE,
+                               RACE_START, WINNER, CarFrame, RaceStateEngine, replay)
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# The recordings are synthetic races (pit stop, two-car accident, timed finish) captured with the
+# sims' own recorders:
+#   ams2_race.ams2rec  record_session(synthetic_session(num_cars=12, frames=2000, incidents=True), path)
+#   acc_race.jsonl.gz  python acc_recorder.py tests/data/acc_race.jsonl.gz
+# The golden files are snapshots of the collectors' own output, so they only catch unintended
+# changes; what the engine should report is pinned by the scripted tests below. After an intended
+# change to the race logic, regenerate a golden file with
+#   python race_state_engine.py tests/data/<recording> tests/data/<golden> --update
+
+
+@pytest.mark.parametrize("recording, golden", [
+    ("ams2_race.ams2rec", "ams2_race.golden.txt"),
+    ("acc_race.jsonl.gz", "acc_race.golden.txt"),
+])
+def test_recorded_race_matches_golden(recording, golden, tmp_path):
+    lines = replay(os.path.join(DATA, recording), str(tmp_path))
+    with open(os.path.join(DATA, golden), 'r', encoding='utf-8') as f:
+        expected = f.read().splitlines()
+    assert lines == expected
+
+
+def _frames(speed):
+    return [CarFrame(car_id, f"Driver {car_id}", 0.5 + car_id * 0.001, speed, position=car_id + 1) for car_id in range(2)]
+
+
+def test_accident_is_timed_when_it_happened():
+    engine = RaceStateEngine()
+    engine.start_race(0.0)
+    for now in range(20):
+        engine.tick(_frames(30.0), float(now)) # Up to speed, so both cars are watched
+    events = []
+    for now in (20.0, 21.0, 22.5):
+        events += engine.tick(_frames(0.0), now)
+    accidents = [event for event in events if event.kind == ACCIDENT]
+    assert [event.time for event in accidents] == [20.0] # Reported at 22.5, once nobody else joined
+    assert accidents[0].data['cars'] == [0, 1]
+
+
+def test_flush_hands_over_an_incident_still_open():
+    engine = RaceStateEngine()
+    engine.start_race(0.0)
+    for now in range(20):
+        engine.tick(_frames(30.0), float(now))
+    assert not [event for event in engine.tick(_frames(0.0), 20.0) if event.kind == ACCIDENT]
+    assert [(event.kind, event.time) for event in engine.flush()] == [(ACCIDENT, 20.0)]
+    assert engine.flush() == []
+
+
+@pytest.mark.parametrize("messages, start, accident", [
+    (AMS2_MESSAGES, "Race has started!", "Accident! P2 Driver 1 is involved in an accident!"),
+    (ACC_MESSAGES, "The Race Begins!", "Accident! Driver 1 has stopped from P2"),
+    (AC_MESSAGES, "The Race Begins!", "Accident! Driver 1 has stopped from P2"),
+])
+def test_each_sim_keeps_its_own_wording(messages, start, accident):
+    engine = RaceStateEngine(messages=messages)
+    assert [event.message for event in engine.start_race(0.0)] == [start] # The filter prompts need "Race Begins" for ACC/AC
+    for now in range(20):
+        engine.tick(_frames(30.0), float(now))
+    engine.tick([_frames(30.0)[0], _frames(0.0)[1]], 20.0)
+    assert [event.message for event in engine.flush()] == [accident]
+
+
+@pytest.mark.parametrize("finish_spline, winner_at", [(None, 3.0), (0.99, 2.0)])
+def test_leader_takes_the_flag_at_the_line_or_finish_spline(finish_spline, winner_at):
+    engine = RaceStateEngine(finish_spline=finish_spline)
+    engine.start_race(0.0)
+    engine.tick([CarFrame(0, "Leader", 0.9, 50.0, position=1, laps=4)], 0.0)
+    engine.start_final_lap(1.0)
+    winners = []
+    for now, spline, laps in ((1.0, 0.95, 4), (2.0, 0.995, 4), (3.0, 0.01, 5)):
+        winners += [event.time for event in engine.tick([CarFrame(0, "Leader", spline, 50.0, position=1, laps=laps)], now)
+                    if event.kind == WINNER]
+    assert winners == [winner_at]
+
+
+def test_scripted_race_reports_start_overtake_accident_and_finish():
+    # Three cars on a 1000 m lap. C (45 m/s) catches B (40 m/s) at t=17.6, B stops for 8 s at t=60,
+    # and A (50 m/s) starts its last lap at t=101 and crosses the line at 6000 m, t=120.
+    engine = RaceStateEngine(track_length=1000.0)
+    names, speeds = ["A", "B", "C"], [50.0, 40.0, 45.0]
+    distances = [0.0, -12.0, -100.0]
+    events = engine.start_race(0.0)
+    for step in range(1, 401):
+        now = step * 0.5
+        if now == 101.0:
+            events += engine.start_final_lap(now)
+        for car in range(3):
+            if not (car == 1 and 60.0 <= now < 68.0):
+                distances[car] += speeds[car] * 0.5
+        speed = lambda car: 0.0 if car == 1 and 60.0 <= now < 68.0 else speeds[car]
+        order = sorted(range(3), key=lambda car: -distances[car])
+        frames = [CarFrame(car, names[car], (distances[car] % 1000.0) / 1000.0, speed(car), position=order.index(car) + 1,
+                           laps=int(max(0.0, distances[car]) // 1000.0)) for car in range(3)]
+        events += engine.tick(frames, now)
+
+    def of(kind):
+        return [event for event in events if event.kind == kind]
+
+    assert [(event.time, event.message) for event in of(RACE_START)] == [(0.0, "Race has started!")]
+    assert [(event.time, event.message) for event in of(OVERTAKE)] == [(18.0, "Overtake! C passes B for P2")]
+    assert [(event.time, event.data['cars']) for event in of(ACCIDENT)] == [(60.0, [1])]
+    assert of(ACCIDENT)[0].message == "Accident! B has stopped from P3"
+    assert [(event.time, event.message) for event in of(WINNER)] == [(120.0, "CHECKERED FLAG: A has won the race!")]
+    assert sorted((event.data['car'], event.data['position']) for event in of(FINISH)) == [(1, 3), (2, 2)]
+
+
+def test_battles_are_debounced_per_pair():
+    # B sits 20 m (0.4 s) behind A, drops back to 200 m at t=40-50 and t=80-150, and closes up again
+    engine = RaceStateEngine(track_length=10000.0)
+    engine.start_race(0.0)
+    events = []
+    for step in range(1, 341):
+        now = step * 0.5
+        gap = 20.0 if now < 40 or 50 <= now < 80 or now >= 150 else 200.0
+        leader = 1000.0 + 50.0 * now
+        events += engine.tick([CarFrame(0, "A", leader / 10000.0, 50.0, position=1, laps=0),
+                               CarFrame(1, "B", (leader - gap) / 10000.0, 50.0, position=2, laps=0)], now)
+    battles = [(event.kind, event.time) for event in events if event.kind in (BATTLE_START, BATTLE_END)]
+    # Confirmed after 10 s close; the fight from t=50 comes within 60 s of the last report, so it's left out
+    assert battles == [(BATTLE_START, 20.5), (BATTLE_END, 42.5), (BATTLE_START, 160.0)]
@@ -0,0 +1,16 @@
+from second_pass_commentator import parse_gap_response
+
+
+def test_gap_response_takes_the_line_at_the_gaps_timecode():
+    echoed = ("00:01:00 - Hamilton is closing in.\n"
+              "00:01:20 - And the gap is down to half a second now!\n"
+              "00:01:40 - Into turn one side by side.")
+    assert parse_gap_response(echoed, "00:01:20") == "And the gap is down to half a second now!"
+
+
+def test_gap_response_without_the_gaps_line_is_empty():
+    assert parse_gap_response("00:01:00 - Hamilton is closing in.\n00:01:20 - <COMMENTATE HERE IN 12 WORDS>", "00:01:20") == ""
+
+
+def test_plain_text_gap_response_is_used_as_it_is():
+    assert parse_gap_response("What a move\nthat was!", "00:01:20") == "What a move that was!"
@@ -0,0 +1,48 @@
+import os
+import voice_generator
+from mock_backends import MockTTSServer
+from tts_cache import AudioCache, make_audio_key
+from voice_generator import VoiceGenerator
+
+
+def test_miss_does_not_write_through_a_linked_hit(tmp_path):
+    server = MockTTSServer(latency=0).start()
+    voice_generator.CARTESIA_TTS_URL = server.url
+    try:
+        voice = VoiceGenerator(str(tmp_path / "commentary.txt"), "mock-key", "mock-voice")
+        voice.audio_cache = AudioCache(str(tmp_path / "cache"))
+        out_dir = str(tmp_path / "audio")
+
+        assert voice.generate_audio("What a move into turn one", "00:01:00", out_dir) > 0 # Miss, stored
+        assert voice.generate_audio("What a move into turn one", "00:01:00", out_dir) > 0 # Hit, linked
+        key = make_audio_key("mock-voice", "sonic-2", "normal", [], {"container": "mp3", "sample_rate": 44100},
+                             "What a move into turn one")
+        cached_path = voice.audio_cache._path(key)
+        with open(cached_path, 'rb') as f:
+            cached_audio = f.read()
+
+        # Same file name, different line: synthesised and written over the linked output file
+        assert voice.generate_audio("A much longer line about the battle for the lead at the chicane", "00:01:00", out_dir) > 0
+        with open(cached_path, 'rb') as f:
+            assert f.read() == cached_audio
+        assert os.path.getsize(os.path.join(out_dir, "Commentary_000100.mp3")) > len(cached_audio)
+        assert voice.audio_cache.stats['hits'] == 1
+    finally:
+        server.stop()
+
+
+def test_hits_are_saved_to_the_index(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = AudioCache(directory)
+    cache.put("ab" * 32, b"audio", 1.0)
+    cache.index["ab" * 32][1] -= 60 # Stored a minute ago
+    cache.flush()
+    stored_at = cache.index["ab" * 32][1]
+
+    reader = AudioCache(directory)
+    assert reader.get_into("ab" * 32, str(tmp_path / "out.mp3")) == 1.0
+    reader.flush()
+
+    reloaded = AudioCache(directory)
+    reloaded._load_index()
+    assert reloaded.index["ab" * 32][1] > stored_at
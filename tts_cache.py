@@ -0,0 +1,210 @@
+# tts_cache.py
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from llm_cache import make_key
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Cache", "tts")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+INDEX_SAVE_EVERY = 50 # Stores/hits between index writes (it's always written by flush())
+
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def make_audio_key(voice_id, model_id, speed, emotion, output_format, text):
+    """Key for one synthesised line: same voice, model, controls, format and (normalised) text -> same audio."""
+    return make_key("tts", voice_id, model_id, speed or "normal", sorted(emotion or []),
+                    sorted((output_format or {}).items()), normalize_text(text))
+
+
+class AudioCache:
+    """
+    Disk cache of synthesised lines, content-addressed by make_audio_key(), so a rerun only sends
+    the lines that changed to Cartesia. Audio lives in <directory>/<key[:2]>/<key>.mp3 and
+    index.json records each entry's size, last use and duration (a hit doesn't need to re-read
+    the MP3). Past max_bytes the least recently used entries are removed. Hits are hard-linked
+    into the run's output directory (copied where linking isn't possible). Thread-safe, since
+    VoiceGenerator synthesises several lines at once.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.index = None # key -> [size, last_used, duration], loaded on first use
+        self.unsaved = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'seconds_reused': 0.0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _load_index(self):
+        """Reads index.json, or rebuilds it from the files if it's missing or unreadable. Call with the lock held."""
+        if self.index is not None:
+            return
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                self.index = {key: list(entry) for key, entry in json.load(f).items()}
+            return
+        except (OSError, ValueError, AttributeError, TypeError):
+            pass
+        self.index = {}
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.mp3'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    self.index[name[:-4]] = [stat.st_size, stat.st_mtime, None]
+
+    def get_into(self, key, destination):
+        """
+        Puts the cached audio for key at destination. Returns its duration in seconds (None if
+        unknown), or False on a miss.
+        """
+        if not self.enabled:
+            return False
+        with self.lock:
+            self._load_index()
+            entry = self.index.get(key)
+        if entry is None or not self._link(self._path(key), destination):
+            with self.lock:
+                self.stats['misses'] += 1
+                if entry is not None:
+                    self.index.pop(key, None) # File went missing
+            return False
+        with self.lock:
+            entry[1] = time.time()
+            self.unsaved += 1 # Recency has to reach index.json too, or eviction forgets this hit
+            self.stats['hits'] += 1
+            self.stats['seconds_reused'] += entry[2] or 0.0
+            if self.unsaved >= INDEX_SAVE_EVERY:
+                self._save_index()
+        return entry[2]
+
+    def _link(self, source, destination):
+        try:
+            if os.path.exists(destination):
+                os.remove(destination)
+            try:
+                os.link(source, destination)
+            except OSError:
+                shutil.copyfile(source, destination) # Other filesystem, or links not supported
+            return True
+        except OSError:
+            return False
+
+    def put(self, key, audio_bytes, duration=None):
+        if not self.enabled or not audio_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(audio_bytes)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"TTS cache write failed: {e}")
+            return
+        with self.lock:
+            self._load_index()
+            self.index[key] = [len(audio_bytes), time.time(), duration]
+            self.stats['stores'] += 1
+            if sum(entry[0] for entry in self.index.values()) > self.max_bytes:
+                self._evict()
+            self.unsaved += 1
+            if self.unsaved >= INDEX_SAVE_EVERY:
+                self._save_index()
+
+    def _evict(self):
+        """Removes least recently used audio until the cache is under 90% of max_bytes. Call with the lock held."""
+        total = sum(entry[0] for entry in self.index.values())
+        target = self.max_bytes * 0.9
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1][1]):
+            if total <= target:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            total -= entry[0]
+            del self.index[key]
+            self.stats['evictions'] += 1
+
+    def _save_index(self):
+        """Call with the lock held."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{self._index_path()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f)
+            os.replace(temp_path, self._index_path())
+            self.unsaved = 0
+        except OSError as e:
+            print(f"TTS cache index write failed: {e}")
+
+    def flush(self):
+        with self.lock:
+            if self.index is not None and self.unsaved:
+                self._save_index()
+
+    def clear(self):
+        with self.lock:
+            self._load_index()
+            for key in list(self.index):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self.index = {}
+            self._save_index()
+
+    def summary(self):
+        stats = self.stats
+        lookups = stats['hits'] + stats['misses']
+        rate = f" ({stats['hits'] / lookups:.0%} hit rate)" if lookups else ""
+        return (f"Voice cache: {stats['hits']} lines reused ({stats['seconds_reused']:.0f}s of audio), "
+                f"{stats['misses']} synthesised{rate}, {stats['evictions']} evicted")
+
+
+# --- Process-wide cache ---
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache():
+    """The shared cache. TTS_CACHE=off disables it, TTS_CACHE_DIR / TTS_CACHE_MAX_MB override the defaults."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache(os.environ.get("TTS_CACHE_DIR", DEFAULT_CACHE_DIR),
+                                int(float(os.environ.get("TTS_CACHE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024))) * 1024 * 1024),
+                                os.environ.get("TTS_CACHE", "on").lower() not in ("off", "0", "false", "no"))
+        return _cache
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python tts_cache.py [stats|clear]
+    cache = get_audio_cache()
+    if len(sys.argv) > 1 and sys.argv[1] == "clear":
+        cache.clear()
+        print(f"Cleared {cache.directory}")
+    else:
+        with cache.lock:
+            cache._load_index()
+            entries = list(cache.index.values())
+        print(f"{cache.directory}: {len(entries)} lines, {sum(e[0] for e in entries) / (1024 * 1024):.1f} MiB, "
+              f"{sum(e[2] or 0 for e in entries) / 60:.1f} min of audio (limit {cache.max_bytes / (1024 * 1024):.0f} MiB)")
@@ -1,8 +1,10 @@
 # ui_commentary_tab.py
 import os
+from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton,
-    QLineEdit, QTextEdit, QFileDialog, QMessageBox
+    QLineEdit, QTextEdit, QFileDialog, QMessageBox, QCheckBox,
+    QDialog, QListWidget, QListWidgetItem, QDialogButtonBox
 )
 
 class CommentaryTab(QWidget):
@@ -42,10 +44,22 @@ class CommentaryTab(QWidget):
         input_layout.addWidget(browse_button)
         layout.addLayout(input_layout)
 
+        # Pipeline option: voice generation starts on each line as the commentary streams in
+        self.voice_pipeline_checkbox = QCheckBox("Generate voice while commentary is written (uses this commentator's voice)")
+        self.voice_pipeline_checkbox.setChecked(self.settings.value("commentary_voice_pipeline", False, type=bool))
+        self.voice_pipeline_checkbox.toggled.connect(lambda checked: self.settings.setValue("commentary_voice_pipeline", checked))
+        layout.addWidget(self.voice_pipeline_checkbox)
+
         # Generate Button
         self.generate_button = QPushButton("Generate Commentary") # Store button reference
         self.generate_button.clicked.connect(self.generate_commentary)
-        layout.addWidget(self.generate_button)
+        self.batch_button = QPushButton("Generate for Several Commentators...")
+        self.batch_button.setToolTip("Writes one commentary file per selected commentator from the same input, all at once.")
+        self.batch_button.clicked.connect(self.generate_batch_commentary)
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.generate_button)
+        buttons_layout.addWidget(self.batch_button)
+        layout.addLayout(buttons_layout)
 
         # Output Display
         output_label = QLabel("Generated Commentary:")
@@ -112,11 +126,51 @@ class CommentaryTab(QWidget):
              return
 
         # Let MainWindow handle settings checks and thread start
-        self.main_window.start_commentary_generation(input_path, main_comm_name)
+        self.main_window.start_commentary_generation(input_path, main_comm_name, self.voice_pipeline_checkbox.isChecked())
         self.commentary_output.clear()
         # Optionally disable button
         # self.generate_button.setEnabled(False)
 
+    def generate_batch_commentary(self):
+        """Asks which commentators to use, then starts a batch run via MainWindow."""
+        input_path = self.commentary_input.text() or self.main_window.last_filter_output_path
+        if not input_path or not os.path.exists(input_path):
+             QMessageBox.warning(self, "Input Missing", "Select an existing input file or run filter first.")
+             return
+        self.commentary_input.setText(input_path)
+
+        commentators = self.main_window.commentator_manager.get_all_commentators()
+        if not commentators:
+             QMessageBox.warning(self, "No Commentators", "Create a commentator first.")
+             return
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Batch Commentary")
+        dialog_layout = QVBoxLayout(dialog)
+        dialog_layout.addWidget(QLabel("Commentators to generate (one file each):"))
+        commentator_list = QListWidget()
+        for metadata in commentators:
+            item = QListWidgetItem(f"{metadata.name} - {metadata.style}")
+            item.setData(Qt.UserRole, metadata.name)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if metadata.name == self.main_commentator_combo.currentData() else Qt.Unchecked)
+            commentator_list.addItem(item)
+        dialog_layout.addWidget(commentator_list)
+        dialog_buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        dialog_buttons.accepted.connect(dialog.accept)
+        dialog_buttons.rejected.connect(dialog.reject)
+        dialog_layout.addWidget(dialog_buttons)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+
+        names = [commentator_list.item(i).data(Qt.UserRole) for i in range(commentator_list.count())
+                 if commentator_list.item(i).checkState() == Qt.Checked]
+        if not names:
+             QMessageBox.warning(self, "Commentators Missing", "Select at least one commentator.")
+             return
+        self.commentary_output.clear()
+        self.main_window.start_commentary_batch(input_path, names)
+
     def on_commentary_finished(self, success: bool, output_path: str or None):
         """Called by MainWindow when commentary generation is done."""
         # self.generate_button.setEnabled(True) # Re-enable button
@@ -2,7 +2,7 @@ import traceback
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QGroupBox, QFormLayout, QLineEdit, QPushButton,
     QLabel, QHBoxLayout, QComboBox, QTextEdit, QMessageBox, QRadioButton,
-    QButtonGroup, QCheckBox, QInputDialog
+    QButtonGroup, QCheckBox, QInputDialog, QSpinBox, QDoubleSpinBox
 )
 from PyQt5.QtCore import Qt
 from commentator_dialog import CommentatorDialog # Import the dialog
@@ -70,6 +70,19 @@ class SettingsTab(QWidget):
         self.cartesia_model_combo = QComboBox()
         self.cartesia_model_combo.addItems(["sonic-english", "glow-english", "nova-english"]) # Add more if needed
         cartesia_layout.addRow("Voice Model:", self.cartesia_model_combo)
+        self.tts_concurrency_spin = QSpinBox()
+        self.tts_concurrency_spin.setRange(1, 16)
+        self.tts_concurrency_spin.setToolTip("How many lines are sent to Cartesia at once. Lower it if your plan's concurrency limit is hit.")
+        cartesia_layout.addRow("Voice Requests at Once:", self.tts_concurrency_spin)
+        self.tts_rate_spin = QDoubleSpinBox()
+        self.tts_rate_spin.setRange(0.0, 50.0)
+        self.tts_rate_spin.setDecimals(1)
+        self.tts_rate_spin.setSpecialValueText("No limit")
+        self.tts_rate_spin.setToolTip("Maximum voice requests started per second (0 = no limit).")
+        cartesia_layout.addRow("Voice Requests per Second:", self.tts_rate_spin)
+        self.tts_cache_checkbox = QCheckBox("Reuse previously generated voice lines")
+        self.tts_cache_checkbox.setToolTip("Lines already spoken with the same voice, model, speed and emotions are copied from the local cache instead of being sent to Cartesia again.")
+        cartesia_layout.addRow("", self.tts_cache_checkbox)
         fetch_voices_button = QPushButton("Fetch Available Voices"); fetch_voices_button.clicked.connect(self.fetch_cartesia_voices)
         cartesia_layout.addRow("", fetch_voices_button)
         self.cartesia_voices_text = QTextEdit(); self.cartesia_voices_text.setReadOnly(True); self.cartesia_voices_text.setFixedHeight(100); self.cartesia_voices_text.setPlaceholderText("Enter API key and click fetch...")
@@ -98,6 +111,14 @@ class SettingsTab(QWidget):
         # Other Settings
         self.always_on_top_checkbox = QCheckBox("Always on Top")
         self.always_on_top_checkbox.stateChanged.connect(self.toggle_always_on_top)
+        self.collector_process_checkbox = QCheckBox("Run data collector in a separate process")
+        self.llm_cache_checkbox = QCheckBox("Reuse cached AI responses for identical requests")
+        self.llm_cache_checkbox.setToolTip("Re-running a stage with the same input, prompt and model returns the saved response instead of calling the API. Turn off for a fresh take.")
+        self.log_compaction_checkbox = QCheckBox("Compact race logs before filtering")
+        self.second_pass_gaps_checkbox = QCheckBox("Fill second commentator gaps in parallel")
+        self.second_pass_gaps_checkbox.setToolTip("Sends each gap with a few lines of surrounding script as its own request, several at once, instead of the whole script in one. Faster on long races, and a failed gap only loses that gap.")
+        self.log_compaction_checkbox.setToolTip("Condenses repeated leaderboards, back-and-forth overtakes and pit entry/exit pairs before the log is sent to the filter AI (no AI involved, timecodes kept).")
+        self.collector_process_checkbox.setToolTip("Keeps telemetry collection at full rate while commentary or voice generation is running. Applies the next time collection starts.")
 
         # Save Button
         save_button = QPushButton("Save Settings")
@@ -107,6 +128,10 @@ class SettingsTab(QWidget):
         layout.addWidget(model_selection_group)
         layout.addWidget(commentator_group)
         layout.addWidget(self.always_on_top_checkbox)
+        layout.addWidget(self.collector_process_checkbox)
+        layout.addWidget(self.llm_cache_checkbox)
+        layout.addWidget(self.log_compaction_checkbox)
+        layout.addWidget(self.second_pass_gaps_checkbox)
         layout.addWidget(save_button)
         layout.addStretch()
 
@@ -134,7 +159,14 @@ class SettingsTab(QWidget):
         if index >= 0: self.cartesia_model_combo.setCurrentIndex(index)
         else: self.cartesia_model_combo.setCurrentIndex(0) # Default if not found
 
+        self.tts_concurrency_spin.setValue(self.settings.value("tts_concurrency", 4, type=int))
+        self.tts_rate_spin.setValue(self.settings.value("tts_requests_per_second", 0.0, type=float))
+        self.tts_cache_checkbox.setChecked(self.settings.value("tts_cache_enabled", True, type=bool))
         self.always_on_top_checkbox.setChecked(self.settings.value("always_on_top", False, type=bool))
+        self.collector_process_checkbox.setChecked(self.settings.value("collector_process", False, type=bool))
+        self.llm_cache_checkbox.setChecked(self.settings.value("llm_cache_enabled", True, type=bool))
+        self.log_compaction_checkbox.setChecked(self.settings.value("log_compaction", True, type=bool))
+        self.second_pass_gaps_checkbox.setChecked(self.settings.value("second_pass_gaps", True, type=bool))
 
         # Populate commentator list (MainWindow should trigger this initially and on changes)
         # self.update_commentator_list() # Let main window handle the initial call
@@ -160,7 +192,14 @@ class SettingsTab(QWidget):
             self.settings.setValue("race_commentator_model", self.race_commentator_model_input.text())
 
             self.settings.setValue("cartesia_model", self.cartesia_model_combo.currentText())
+            self.settings.setValue("tts_concurrency", self.tts_concurrency_spin.value())
+            self.settings.setValue("tts_requests_per_second", self.tts_rate_spin.value())
+            self.settings.setValue("tts_cache_enabled", self.tts_cache_checkbox.isChecked())
             self.settings.setValue("always_on_top", self.always_on_top_checkbox.isChecked())
+            self.settings.setValue("collector_process", self.collector_process_checkbox.isChecked())
+            self.settings.setValue("llm_cache_enabled", self.llm_cache_checkbox.isChecked())
+            self.settings.setValue("log_compaction", self.log_compaction_checkbox.isChecked())
+            self.settings.setValue("second_pass_gaps", self.second_pass_gaps_checkbox.isChecked())
 
             # No need to save combo selections here, they are saved on change
 
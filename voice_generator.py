@@ -2,20 +2,82 @@
 import os
 import re
 import inspect
+import threading
+import time
 import requests
 import traceback # Added for detailed error logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 from PyQt5.QtCore import QThread, pyqtSignal # Removed QSettings import
 from mutagen.mp3 import MP3
 from cartesia import Cartesia
 from second_pass_commentator import SecondPassCommentator
+from tts_cache import get_audio_cache, make_audio_key
+
+# Overridable so runs without network can use the local fake in mock_backends
+CARTESIA_TTS_URL = os.environ.get("CARTESIA_TTS_URL", "https://api.cartesia.ai/tts/bytes")
+
+DEFAULT_TTS_CONCURRENCY = 4
+TTS_RETRIES = 3 # Per line, for rate limits (429), server errors and dropped connections
+TTS_TIMEOUT = 60
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+
+def get_tts_session(pool_size=DEFAULT_TTS_CONCURRENCY):
+    """
+    One keep-alive requests.Session shared by every voice run, so TTS requests reuse open
+    connections instead of a new TLS handshake per line. Rebuilt if a bigger pool is needed.
+    """
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None or pool_size > _session_pool_size:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session, _session_pool_size = session, pool_size
+        return _session
+
+
+class RequestBudget:
+    """
+    At most `concurrency` requests in flight and, with requests_per_second set, request starts
+    spaced at least 1/requests_per_second apart. Use as a context manager around each request.
+    """
+
+    def __init__(self, concurrency=DEFAULT_TTS_CONCURRENCY, requests_per_second=0):
+        self.semaphore = threading.BoundedSemaphore(max(1, concurrency))
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        if self.interval:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start)
+                self.next_start = start + self.interval
+            if start > now:
+                time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.semaphore.release()
+        return False
 
 
 class VoiceGenerator(QThread):
     output_signal = pyqtSignal(str)
     progress_signal = pyqtSignal(int)
 
-    def __init__(self, input_path, api_key, voice_id=None, speed="normal", emotion=None, model_id="sonic-2", commentary_api_settings=None):
+    def __init__(self, input_path, api_key, voice_id=None, speed="normal", emotion=None, model_id="sonic-2", commentary_api_settings=None, line_pipeline=None,
+                 tts_concurrency=DEFAULT_TTS_CONCURRENCY, requests_per_second=0, use_cache=True):
         super().__init__()
         self.input_path = input_path
         self.base_output_dir = "audio_output"
@@ -25,6 +87,15 @@ class VoiceGenerator(QThread):
         self.emotion = emotion if emotion else []
         self.model_id = model_id
         self.commentary_api_settings = commentary_api_settings if commentary_api_settings else {}
+        # Pipeline mode: first pass lines come from a running RaceCommentator instead of input_path
+        self.line_pipeline = line_pipeline
+        # Several lines are synthesised at once over a pooled session, within this budget
+        self.tts_concurrency = max(1, int(tts_concurrency))
+        self.budget = RequestBudget(self.tts_concurrency, requests_per_second)
+        self.session = get_tts_session(self.tts_concurrency)
+        self.processed_lines = 0
+        # Lines already synthesised with the same voice settings are reused from disk
+        self.audio_cache = get_audio_cache() if use_cache else None
         self.audio_segments = [] # Stores info about first pass audio
         self.output_dir = None # Path for the *single* audio output directory
         # self.output_dir_filled = None # REMOVED - Using single directory now
@@ -41,6 +112,13 @@ class VoiceGenerator(QThread):
              self.client = None
 
     def run(self):
+        try:
+            self._run()
+        finally:
+            if self.line_pipeline:
+                self.line_pipeline.close() # Never leave the commentary stage blocked on a full queue
+
+    def _run(self):
         # Ensure output_signal is connected before emitting
         # self.output_signal.emit("Starting voice commentary generation...")
         # self.progress_signal.emit(0)
@@ -64,33 +142,44 @@ class VoiceGenerator(QThread):
             self.output_signal.emit(f"Saving ALL audio segments to: {self.output_dir}")
             # ------------------------------------------------------------
 
-            total_lines = self.count_lines()
-            if total_lines == 0:
-                 self.output_signal.emit("Warning: Input file has no timecoded commentary lines. Stopping.")
-                 self.progress_signal.emit(100)
-                 return
-            processed_lines = 0
+            if self.line_pipeline:
+                total_lines = None # Known once the commentary stage has finished
+            else:
+                total_lines = self.count_lines()
+                if total_lines == 0:
+                     self.output_signal.emit("Warning: Input file has no timecoded commentary lines. Stopping.")
+                     self.progress_signal.emit(100)
+                     return
+            self.processed_lines = 0
 
             # --- First pass voice generation ---
-            self.output_signal.emit("Generating initial voice segments...")
-            with open(self.input_path, 'r', encoding='utf-8', errors='replace') as file:
-                for line in file:
-                    match = re.match(r'(\d{2}:\d{2}:\d{2}) - (.+)', line.strip())
-                    if match:
-                        time_code, text = match.groups()
-                        # Save to the single output directory, no suffix needed for first pass
-                        audio_duration = self.generate_audio(text, time_code, target_dir=self.output_dir) # No suffix here
-                        self.audio_segments.append({
-                            'time_code': time_code,
-                            'start_time': self.timecode_to_seconds(time_code),
-                            'text': text,
-                            # Base filename without suffix for tracking
-                            'audio_file': f"Commentary_{time_code.replace(':', '')}.mp3",
-                            'audio_duration': audio_duration
-                        })
-                        processed_lines += 1
-                        progress = int((processed_lines / total_lines) * 50)
-                        self.progress_signal.emit(progress)
+            if self.line_pipeline:
+                self.output_signal.emit("Generating initial voice segments as commentary lines arrive...")
+                file = None
+                lines = self.line_pipeline.lines()
+            else:
+                self.output_signal.emit("Generating initial voice segments...")
+                file = open(self.input_path, 'r', encoding='utf-8', errors='replace')
+                lines = file
+            pending = deque() # (time_code, text, future) in script order
+            try:
+                with ThreadPoolExecutor(max_workers=self.tts_concurrency, thread_name_prefix="tts") as executor:
+                    for line in lines:
+                        match = re.match(r'(\d{2}:\d{2}:\d{2}) - (.+)', line.strip())
+                        if match:
+                            time_code, text = match.groups()
+                            # Save to the single output directory, no suffix needed for first pass
+                            pending.append((time_code, text, executor.submit(self.generate_audio, text, time_code, self.output_dir)))
+                            # Keep only a couple of lines queued per worker; finished ones are recorded in order
+                            self._collect_first_pass(pending, total_lines, keep=self.tts_concurrency * 2)
+                    self._collect_first_pass(pending, total_lines, keep=0)
+            finally:
+                if file:
+                    file.close()
+            if self.line_pipeline and not self.audio_segments:
+                 self.output_signal.emit("Warning: Commentary stage produced no timecoded lines. Stopping.")
+                 self.progress_signal.emit(100)
+                 return
             self.output_signal.emit("Initial voice segments generated.")
             # -----------------------------------
 
@@ -114,6 +203,7 @@ class VoiceGenerator(QThread):
             if api_type == 'claude' and self.commentary_api_settings.get('claude_key'): key_present = True
             elif api_type == 'openai' and self.commentary_api_settings.get('openai_key'): key_present = True
             elif api_type == 'gemini' and self.commentary_api_settings.get('google_key'): key_present = True
+            elif api_type == 'mock': key_present = True # Offline fake LLM, no key
             if not api_type or not model or not key_present:
                  self.output_signal.emit(f"Error: Incomplete commentary settings for second pass. Skipping.")
                  self.progress_signal.emit(100)
@@ -158,6 +248,8 @@ class VoiceGenerator(QThread):
                              self.output_signal.emit("Warning: Filled commentary file contains no valid lines requiring voice generation. Skipping.")
                         else:
                             self.output_signal.emit(f"Generating voice for {total_lines_to_generate_filled} filled/new lines...")
+                            filled_futures = []
+                            executor = ThreadPoolExecutor(max_workers=self.tts_concurrency, thread_name_prefix="tts")
                             for line in lines_in_filled_file:
                                 match = re.match(r'(\d{2}:\d{2}:\d{2}) - (.+)', line.strip())
                                 if match:
@@ -169,20 +261,23 @@ class VoiceGenerator(QThread):
                                     # A more robust check would compare against the original script, but this is simpler.
                                     if "<COMMENTATE HERE" not in text:
                                         # --- Generate audio with suffix, saving to the *original* output dir ---
-                                        audio_duration = self.generate_audio(
+                                        filled_futures.append(executor.submit(
+                                            self.generate_audio,
                                             text,
                                             time_code,
                                             target_dir=self.output_dir, # Save to the same dir
                                             filename_suffix="_filled"   # Add suffix
-                                        )
-                                        # --- (Optional: track filled segments if needed later) ---
-                                        # self.audio_segments_filled.append({ ... })
-                                        # --------------------------------------------------------
-                                        processed_lines_filled += 1
-                                        progress = int(75 + (processed_lines_filled / total_lines_to_generate_filled) * 25)
-                                        self.progress_signal.emit(progress)
+                                        ))
                                     # else: # Line still contains placeholder, skip voice gen for it
                                     #     self.output_signal.emit(f"Skipping voice gen for placeholder line: {time_code}")
+                            try:
+                                for future in filled_futures: # In script order
+                                    future.result()
+                                    processed_lines_filled += 1
+                                    progress = int(75 + (processed_lines_filled / total_lines_to_generate_filled) * 25)
+                                    self.progress_signal.emit(progress)
+                            finally:
+                                executor.shutdown(wait=True)
 
                             self.output_signal.emit(f"\nFilled voice commentary generated and saved to {self.output_dir}")
                 except Exception as e:
@@ -192,6 +287,9 @@ class VoiceGenerator(QThread):
                 self.output_signal.emit(f"\nWarning: Filled commentary file ('{filled_commentary_path}') not found or text generation failed. Skipping second pass voice generation.")
             # ----------------------------------------------------
 
+            if self.audio_cache and self.audio_cache.enabled:
+                self.audio_cache.flush()
+                self.output_signal.emit(self.audio_cache.summary())
             self.output_signal.emit("\nVoice generation process complete.")
             self.progress_signal.emit(100)
 
@@ -210,6 +308,20 @@ class VoiceGenerator(QThread):
 
         text = re.sub(r'\s+', ' ', text).strip()
         if not text: return 0
+
+        time_code_safe = time_code.replace(':', '')
+        output_filename = f"Commentary_{time_code_safe}{filename_suffix}.mp3" # Add suffix here
+        output_path = os.path.join(output_directory, output_filename)
+
+        output_format_params = {"container": "mp3", "sample_rate": 44100}
+        cache_key = None
+        if self.audio_cache and self.audio_cache.enabled:
+            cache_key = make_audio_key(self.voice_id, self.model_id, self.speed, self.emotion, output_format_params, text)
+            os.makedirs(output_directory, exist_ok=True)
+            cached_duration = self.audio_cache.get_into(cache_key, output_path)
+            if cached_duration is not False:
+                return cached_duration if cached_duration is not None else self.get_audio_duration(output_path)
+
         if not self.client:
             self.output_signal.emit(f"Error: Cartesia client not available for timecode {time_code}. Skipping.")
             return 0
@@ -220,36 +332,26 @@ class VoiceGenerator(QThread):
             if self.speed and self.speed != "normal": exp_controls["speed"] = self.speed
             if self.emotion: exp_controls["emotion"] = self.emotion
             if exp_controls: voice_params["experimental_controls"] = exp_controls
-            output_format_params = {"container": "mp3", "sample_rate": 44100}
 
             # --- Make API Request ---
-            response = requests.post(
-                "https://api.cartesia.ai/tts/bytes",
-                headers={
-                    "Cartesia-Version": "2024-05-10",
-                    "X-API-Key": self.api_key,
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "transcript": text, "model_id": self.model_id, "voice": voice_params,
-                    "language": "en", "output_format": output_format_params
-                }
-            )
+            response = self._post_tts(text, time_code, {
+                "transcript": text, "model_id": self.model_id, "voice": voice_params,
+                "language": "en", "output_format": output_format_params
+            })
             # --- Handle Response ---
             if response.status_code != 200:
                 raise Exception(f"Cartesia API request failed ({response.status_code}): {response.text}")
             audio_bytes = response.content
             if not audio_bytes: raise Exception("Cartesia API returned empty audio content.")
 
-            # --- Construct Filename with Suffix ---
-            time_code_safe = time_code.replace(':', '')
-            output_filename = f"Commentary_{time_code_safe}{filename_suffix}.mp3" # Add suffix here
-            output_path = os.path.join(output_directory, output_filename)
-            # --------------------------------------
-
             os.makedirs(output_directory, exist_ok=True)
-            with open(output_path, "wb") as f: f.write(audio_bytes)
+            # Replace rather than overwrite: output_path may be a hard link into the audio cache
+            temp_path = f"{output_path}.tmp"
+            with open(temp_path, "wb") as f: f.write(audio_bytes)
+            os.replace(temp_path, output_path)
             audio_duration = self.get_audio_duration(output_path)
+            if cache_key and audio_duration:
+                self.audio_cache.put(cache_key, audio_bytes, audio_duration)
             # self.output_signal.emit(f"Saved: {output_filename} ({audio_duration:.2f}s)") # Less verbose log
             return audio_duration
 
@@ -261,6 +363,45 @@ class VoiceGenerator(QThread):
             return 0
     # --- END MODIFIED generate_audio ---
 
+    def _post_tts(self, text, time_code, payload):
+        """POSTs one line within the request budget, retrying 429s, 5xx and dropped connections with backoff."""
+        headers = {"Cartesia-Version": "2024-05-10", "X-API-Key": self.api_key, "Content-Type": "application/json"}
+        for attempt in range(TTS_RETRIES + 1):
+            try:
+                with self.budget:
+                    response = self.session.post(CARTESIA_TTS_URL, headers=headers, json=payload, timeout=TTS_TIMEOUT)
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                if attempt == TTS_RETRIES:
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else 2 ** attempt
+                reason = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == TTS_RETRIES:
+                    raise
+                delay, reason = 2 ** attempt, type(e).__name__
+            self.output_signal.emit(f"TTS busy for {time_code} ({reason}), retry {attempt + 1} in {delay:.0f}s...")
+            time.sleep(delay)
+
+    def _collect_first_pass(self, pending, total_lines, keep):
+        """Records finished first pass lines in script order, waiting on the oldest while more than keep are queued."""
+        while pending and (len(pending) > keep or pending[0][2].done()):
+            time_code, text, future = pending.popleft()
+            audio_duration = future.result()
+            self.audio_segments.append({
+                'time_code': time_code,
+                'start_time': self.timecode_to_seconds(time_code),
+                'text': text,
+                # Base filename without suffix for tracking
+                'audio_file': f"Commentary_{time_code.replace(':', '')}.mp3",
+                'audio_duration': audio_duration
+            })
+            self.processed_lines += 1
+            expected = total_lines or max(self.line_pipeline.expected_lines, self.processed_lines)
+            progress = int((self.processed_lines / expected) * 50)
+            self.progress_signal.emit(progress)
+
     def count_lines(self):
         """Counts only lines starting with a timecode in the input file."""
         try: